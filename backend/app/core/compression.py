@@ -0,0 +1,179 @@
+"""
+Negotiated response compression (brotli / gzip) for large JSON payloads
+"""
+import zlib
+from typing import Dict, Optional
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Luồng sự kiện (SSE): không nén, chuyển thẳng
+EXCLUDED_CONTENT_TYPES = ("text/event-stream",)
+
+
+class CompressionResponder:
+    """
+    Wrap `send` of 1 response: hold http.response.start until the first body chunk
+    decides whether to compress, then rewrite the headers once
+
+    - body < minimum_size in a single chunk, already encoded or excluded type: unchanged
+    - single chunk: Content-Encoding + exact Content-Length
+    - streaming (more_body): Content-Encoding, no Content-Length, every chunk flushed
+    Vary: Accept-Encoding is added whenever the coding depended on the request.
+    Subclasses implement compress(); this base class is the identity coding.
+    """
+    content_encoding: Optional[str] = None
+
+    def __init__(self, app: ASGIApp, minimum_size: int) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.send: Optional[Send] = None
+        self.start_message: Optional[Message] = None  # Giữ lại tới chunk body đầu tiên
+        self.excluded = False
+        self.compressing = False
+
+    def compress(self, body: bytes, *, more_body: bool) -> bytes:
+        """Compress 1 chunk; the last chunk (more_body False) closes the stream"""
+        return body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            self.excluded = "content-encoding" in headers or headers.get("content-type", "").startswith(
+                EXCLUDED_CONTENT_TYPES
+            )
+            self.start_message = message
+            return
+
+        if self.start_message is None:
+            # Header đã gửi: chunk tiếp theo của response streaming
+            if self.compressing and message["type"] == "http.response.body":
+                message["body"] = self.compress(message.get("body", b""), more_body=message.get("more_body", False))
+            await self.send(message)
+            return
+
+        start_message, self.start_message = self.start_message, None
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        # Không phải body (vd http.response.pathsend), đã nén sẵn, hoặc nhỏ: giữ nguyên
+        if (
+            message["type"] != "http.response.body"
+            or self.excluded
+            or (len(body) < self.minimum_size and not more_body)
+        ):
+            await self.send(start_message)
+            await self.send(message)
+            return
+
+        headers = MutableHeaders(raw=start_message["headers"])
+        headers.add_vary_header("Accept-Encoding")
+        if self.content_encoding is not None:
+            self.compressing = True
+            message["body"] = self.compress(body, more_body=more_body)
+            headers["Content-Encoding"] = self.content_encoding
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(message["body"]))
+        await self.send(start_message)
+        await self.send(message)
+
+
+class GZipStreamResponder(CompressionResponder):
+    """
+    gzip via a zlib stream: every chunk of a streaming response is sync-flushed,
+    so the client can start decoding before the body is complete
+    """
+    content_encoding = "gzip"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, level: int) -> None:
+        super().__init__(app, minimum_size)
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, body: bytes, *, more_body: bool) -> bytes:
+        data = self.compressor.compress(body)
+        if more_body:
+            return data + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data + self.compressor.flush()
+
+
+class BrotliStreamResponder(CompressionResponder):
+    """Brotli counterpart of GZipStreamResponder"""
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int) -> None:
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, body: bytes, *, more_body: bool) -> bytes:
+        data = self.compressor.process(body)
+        if more_body:
+            return data + self.compressor.flush()
+        return data + self.compressor.finish()
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """
+    Parse Accept-Encoding into {coding: q}
+
+    Example: "gzip, br;q=0.9, *;q=0" -> {"gzip": 1.0, "br": 0.9, "*": 0.0}
+    """
+    encodings: Dict[str, float] = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[coding] = q
+    return encodings
+
+
+class CompressionMiddleware:
+    """
+    Compress responses >= minimum_size with the best coding the client accepts
+
+    Preference: br > gzip > identity. Responses that already carry a
+    Content-Encoding and text/event-stream responses are passed through.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accepted = parse_accept_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+        wildcard = accepted.get("*", 0.0)
+
+        responder: ASGIApp
+        if accepted.get("br", wildcard) > 0:
+            responder = BrotliStreamResponder(self.app, self.minimum_size, quality=self.brotli_quality)
+        elif accepted.get("gzip", wildcard) > 0:
+            responder = GZipStreamResponder(self.app, self.minimum_size, level=self.gzip_level)
+        else:
+            responder = CompressionResponder(self.app, self.minimum_size)
+
+        await responder(scope, receive, send)
@@ -2,9 +2,11 @@
 Database configuration and session management
 """
 import os
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from typing import Callable, Iterator
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -48,18 +50,107 @@ def get_db():
         db.close()
 
 
+# db.info key: callback chờ commit (run_after_commit)
+_AFTER_COMMIT = "after_commit_callbacks"
+
+
+@contextmanager
+def unit_of_work(db: Session) -> Iterator[Session]:
+    """
+    1 transaction cho 1 request / 1 batch: các hàm crud bên trong chỉ flush,
+    commit 1 lần khi khối lệnh chạy xong, rollback nếu có lỗi
+
+    Usage:
+        with unit_of_work(db):
+            result = crud_lich_su.pay_lich_su(db, stt, so_tien)
+    """
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        # Chưa có câu SQL nào thì không có transaction để rollback (không có event)
+        db.info.pop(_AFTER_COMMIT, None)
+        raise
+
+
+def run_after_commit(db: Session, callback: Callable[[], None]) -> None:
+    """
+    Gọi callback sau khi transaction hiện tại của db commit thành công
+    (vd: xóa cache); transaction bị rollback thì callback bị bỏ (rollback về
+    SAVEPOINT thì không: callback vẫn chạy khi transaction ngoài commit)
+    """
+    db.info.setdefault(_AFTER_COMMIT, []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit_callbacks(session: Session) -> None:
+    for callback in session.info.pop(_AFTER_COMMIT, []):
+        callback()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_after_commit_callbacks(session: Session, transaction) -> None:
+    # Transaction ngoài cùng kết thúc mà chưa commit (rollback / close); SAVEPOINT thì bỏ qua
+    if transaction.parent is None:
+        session.info.pop(_AFTER_COMMIT, None)
+
+
+# Idempotent DDL for columns added after the tables were first created.
+# create_all() only creates missing tables, it never alters existing ones.
+SCHEMA_UPGRADES = [
+    'ALTER TABLE tin_chap ADD COLUMN IF NOT EXISTS "Version" INTEGER NOT NULL DEFAULT 1',
+    'ALTER TABLE tra_gop ADD COLUMN IF NOT EXISTS "Version" INTEGER NOT NULL DEFAULT 1',
+    'ALTER TABLE lich_su_tra_lai ADD COLUMN IF NOT EXISTS "Version" INTEGER NOT NULL DEFAULT 1',
+    # TrangThaiNgayThanhToan được tính khi đọc (hybrid property), không còn lưu
+    'ALTER TABLE lich_su_tra_lai DROP COLUMN IF EXISTS "TrangThaiNgayThanhToan"',
+    'ALTER TABLE tin_chap ADD COLUMN IF NOT EXISTS "NgayDenHanTiepTheo" DATE',
+    'ALTER TABLE tra_gop ADD COLUMN IF NOT EXISTS "NgayDenHanTiepTheo" DATE',
+    'CREATE INDEX IF NOT EXISTS "ix_tin_chap_NgayDenHanTiepTheo" ON tin_chap ("NgayDenHanTiepTheo")',
+    'CREATE INDEX IF NOT EXISTS "ix_tra_gop_NgayDenHanTiepTheo" ON tra_gop ("NgayDenHanTiepTheo")',
+    'ALTER TABLE job_runs ADD COLUMN IF NOT EXISTS "ChiSo" TEXT',
+    'ALTER TABLE job_executions ADD COLUMN IF NOT EXISTS "TienDo" TEXT',
+    # Số kỳ lưu riêng thay vì đọc lại từ NoiDung ("Trả lãi kỳ N ...")
+    'ALTER TABLE lich_su_tra_lai ADD COLUMN IF NOT EXISTS "KyThu" INTEGER',
+    'UPDATE lich_su_tra_lai SET "KyThu" = substring("NoiDung" from \'kỳ (\\d+)\')::integer '
+    'WHERE "KyThu" IS NULL AND "NoiDung" ~ \'kỳ \\d+\'',
+    # Sequence cấp số MaHD (app.utils.id_generator): số tiếp theo > MaHD lớn nhất đã có
+    # và > số đã cấp gần nhất (chạy lại mỗi lần khởi động không làm sequence lùi)
+    *[
+        f"SELECT setval('{sequence}', GREATEST("
+        f"(SELECT COALESCE(MAX(substr(\"MaHD\", {len(prefix) + 1})::bigint), 0) FROM {table} WHERE \"MaHD\" ~ '^{prefix}[0-9]+$'), "
+        f"(SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END FROM {sequence})"
+        f") + 1, false)"
+        for table, prefix, sequence in (
+            ("tin_chap", "TC", "tin_chap_ma_hd_seq"),
+            ("tra_gop", "TG", "tra_gop_ma_hd_seq"),
+        )
+    ],
+]
+
+
+def upgrade_db():
+    """
+    Apply SCHEMA_UPGRADES to an existing database
+    """
+    with engine.begin() as conn:
+        for ddl in SCHEMA_UPGRADES:
+            conn.execute(text(ddl))
+
+
 # Function to initialize database
 def init_db():
     """
     Initialize database - create all tables
     """
     # Import all models to ensure they are registered with Base
-    from app.models import TinChap, TraGop, LichSuTraLai, LichSu
+    from app.models import TinChap, TraGop, LichSuTraLai, LichSu, JobRun, JobRunCheckpoint, JobExecution, IdempotencyKey, PaymentAllocation
     
     # Create all tables
     Base.metadata.create_all(bind=engine)
+    upgrade_db()
     print(f"✅ Database initialized at: {POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}")
-    print(f"✅ Tables created: tin_chap, tra_gop, lich_su_tra_lai, lich_su")
+    print(f"✅ Tables created: tin_chap, tra_gop, lich_su_tra_lai, lich_su, job_runs, job_run_checkpoints, job_executions, idempotency_keys, payment_allocation")
 
 
 # Function to drop all tables (use with caution!)
@@ -1,6 +1,7 @@
 """
 Enums cho ứng dụng quản lý tín dụng
 """
+from datetime import date
 from enum import Enum
 
 
@@ -30,6 +31,40 @@ class TrangThaiNgayThanhToan(str, Enum):
         """Trả về danh sách tất cả các giá trị"""
         return [status.value for status in cls]
 
+    @classmethod
+    def from_ngay(cls, ngay: date, today: date) -> "TrangThaiNgayThanhToan":
+        """Trạng thái của kỳ có ngày `ngay` tính tại ngày `today`"""
+        if ngay < today:
+            return cls.QUA_HAN
+        if ngay == today:
+            return cls.DEN_HAN
+        return cls.CHUA_DEN_HAN
+
+
+class TrangThaiJob(str, Enum):
+    """Trạng thái một lần chạy job (job_runs)"""
+    DANG_CHAY = "Đang chạy"
+    HOAN_THANH = "Hoàn thành"
+    CO_LOI = "Có lỗi"
+
+    @classmethod
+    def list_values(cls):
+        """Trả về danh sách tất cả các giá trị"""
+        return [status.value for status in cls]
+
+
+class TrangThaiThucThiJob(str, Enum):
+    """Trạng thái một lần thực thi job của scheduler (job_executions)"""
+    DANG_CHAY = "Đang chạy"
+    THANH_CONG = "Thành công"
+    LOI = "Lỗi"
+    QUA_THOI_GIAN = "Quá thời gian"
+
+    @classmethod
+    def list_values(cls):
+        """Trả về danh sách tất cả các giá trị"""
+        return [status.value for status in cls]
+
 
 class TimePeriod(str, Enum):
     """Mốc thời gian cho dashboard"""
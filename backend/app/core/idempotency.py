@@ -0,0 +1,228 @@
+"""
+Idempotency-Key for money-moving endpoints (pay, pay/batch, pay-full, tra-goc)
+
+A teller UI retrying after a network error sends the same Idempotency-Key:
+- first request: the endpoint runs; the key row (fingerprint, status, response) is
+  written in the same transaction as the payment, so "posted" and "key completed"
+  are committed together or not at all
+- replay (same key, same request): the stored response is returned after one
+  primary-key read; the allocation and WebSocket broadcasts do not run again
+- same key while the first request is still running: 409. The owner holds
+  pg_try_advisory_xact_lock on the key until its transaction ends (commit,
+  rollback or dropped connection), so a running request is never taken over
+- same key with a different method/path/query/body: 422
+Non-2xx responses are not stored (the transaction rolled back): the key can be retried.
+
+Keys older than IDEMPOTENCY_TTL_HOURS are deleted by the idempotency-cleanup job.
+"""
+import datetime
+import hashlib
+import os
+import re
+import zlib
+from dataclasses import dataclass
+from typing import List, Optional, Pattern, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.database import SessionLocal
+from app.core.responses import FastJSONResponse
+from app.crud import idempotency_key as crud_idempotency_key
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+MAX_KEY_LENGTH = 255
+
+# (method, path) of the endpoints that accept Idempotency-Key
+IDEMPOTENT_ROUTES: List[Tuple[str, Pattern[str]]] = [
+    ("POST", re.compile(r"^/lich-su-tra-lai/pay/(\d+|batch)$")),
+    ("POST", re.compile(r"^/lich-su-tra-lai/pay-full/[^/]+$")),
+    ("PUT", re.compile(r"^/tin-chap/tra-goc/[^/]+$")),
+]
+
+
+@dataclass(frozen=True)
+class IdempotencyContext:
+    """Key + fingerprint of the current request, set by IdempotencyMiddleware"""
+    key: str
+    fingerprint: bytes
+
+
+def request_fingerprint(method: str, path: str, query_string: bytes, body: bytes) -> bytes:
+    """sha256 of everything that defines the operation (32 bytes)"""
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), query_string, body):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.digest()
+
+
+def idempotency_context(request: Request) -> Optional[IdempotencyContext]:
+    """Dependency: IdempotencyContext of the request, None without Idempotency-Key"""
+    return getattr(request.state, "idempotency", None)
+
+
+def claim_idempotency_key(db: Session, idempotency: Optional[IdempotencyContext]) -> None:
+    """
+    First statement of the endpoint's unit_of_work: lock the key for this transaction
+
+    Fails fast before any payment work. idempotent_response claims again before storing:
+    a retry_on_stale_data rollback releases the lock, and the lock is re-entrant.
+
+    Raises 409 if another request holds the key or committed it after the middleware
+    lookup (the retry is replayed), 422 if the key was used for a different request.
+    """
+    if idempotency is None:
+        return
+    in_progress = HTTPException(
+        status_code=409,
+        detail=f"Request với {IDEMPOTENCY_HEADER} này đang được xử lý",
+        headers={"Retry-After": "1"},
+    )
+    if not crud_idempotency_key.try_lock_idempotency_key(db, idempotency.key):
+        raise in_progress
+    stored = crud_idempotency_key.get_idempotency_key(db, idempotency.key)
+    if stored is None or stored.StatusCode is None:
+        return
+    if stored.DauVanTay != idempotency.fingerprint:
+        raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} đã được dùng cho 1 request khác")
+    raise in_progress
+
+
+def idempotent_response(db: Session, idempotency: Optional[IdempotencyContext], content) -> FastJSONResponse:
+    """
+    Render the endpoint's response inside its unit_of_work and store it with the key
+
+    The stored bytes are exactly what the first request returns, so replays are identical.
+    """
+    response = FastJSONResponse(jsonable_encoder(content))
+    if idempotency is not None:
+        claim_idempotency_key(db, idempotency)
+        if not crud_idempotency_key.save_idempotency_key(
+            db, idempotency.key, idempotency.fingerprint, response.status_code, zlib.compress(response.body)
+        ):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Request với {IDEMPOTENCY_HEADER} này đang được xử lý",
+                headers={"Retry-After": "1"},
+            )
+    return response
+
+
+def _lookup(key: str) -> Optional[Tuple[bytes, Optional[int], Optional[bytes]]]:
+    """(fingerprint, status, compressed body) of the stored row, None if the key is new"""
+    db = SessionLocal()
+    try:
+        # Replay: 1 primary-key read
+        stored = crud_idempotency_key.get_idempotency_key(db, key)
+        if stored is None:
+            return None
+        return stored.DauVanTay, stored.StatusCode, stored.Response
+    finally:
+        db.close()
+
+
+def purge_expired_idempotency_keys(progress=None) -> dict:
+    """Job idempotency-cleanup: delete keys older than IDEMPOTENCY_TTL_HOURS"""
+    before = datetime.datetime.now() - datetime.timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    db = SessionLocal()
+    try:
+        deleted = crud_idempotency_key.delete_expired_idempotency_keys(db, before)
+    finally:
+        db.close()
+    return {"deleted": deleted, "before": before.isoformat(timespec="seconds")}
+
+
+class IdempotencyMiddleware:
+    """
+    Replay stored responses of IDEMPOTENT_ROUTES requests carrying Idempotency-Key
+
+    New keys are passed to the endpoint as request.state.idempotency; the endpoint
+    claims and stores the key in its own transaction (claim_idempotency_key,
+    idempotent_response). Must be the innermost middleware: the stored body is the
+    uncompressed JSON, and replays still go through CORS / compression.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    @staticmethod
+    def _applies(scope: Scope) -> bool:
+        return any(
+            scope["method"] == method and pattern.match(scope["path"])
+            for method, pattern in IDEMPOTENT_ROUTES
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self._applies(scope):
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get(IDEMPOTENCY_HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        key = key.strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            response = JSONResponse(
+                {"detail": f"{IDEMPOTENCY_HEADER} phải có 1-{MAX_KEY_LENGTH} ký tự"}, status_code=400
+            )
+            await response(scope, receive, send)
+            return
+
+        # Đọc hết body để tính dấu vân tay, rồi phát lại cho endpoint
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        fingerprint = request_fingerprint(scope["method"], scope["path"], scope.get("query_string", b""), body)
+
+        stored = await run_in_threadpool(_lookup, key)
+        # StatusCode NULL: chỗ giữ của phiên bản trước, endpoint ghi đè khi xử lý xong
+        if stored is not None and stored[1] is not None:
+            await self._replay(stored, fingerprint, scope, receive, send)
+            return
+
+        body_sent = False
+
+        async def replay_body() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        scope.setdefault("state", {})["idempotency"] = IdempotencyContext(key, fingerprint)
+        await self.app(scope, replay_body, send)
+
+    @staticmethod
+    async def _replay(
+        stored: Tuple[bytes, Optional[int], Optional[bytes]],
+        fingerprint: bytes,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> None:
+        stored_fingerprint, status_code, compressed = stored
+        if stored_fingerprint != fingerprint:
+            response = JSONResponse(
+                {"detail": f"{IDEMPOTENCY_HEADER} đã được dùng cho 1 request khác"}, status_code=422
+            )
+        else:
+            response = Response(
+                zlib.decompress(compressed),
+                status_code=status_code,
+                media_type="application/json",
+                headers={"Idempotency-Replayed": "true"},
+            )
+        await response(scope, receive, send)
@@ -1,7 +1,7 @@
 """
 CRUD operations package
 """
-from app.crud import tin_chap, tra_gop, lich_su_tra_lai, no_phai_thu, dashboard
+from app.crud import tin_chap, tra_gop, lich_su_tra_lai, no_phai_thu, dashboard, contracts, job_run
 
-__all__ = ["tin_chap", "tra_gop", "lich_su_tra_lai", "no_phai_thu", "dashboard"]
+__all__ = ["tin_chap", "tra_gop", "lich_su_tra_lai", "no_phai_thu", "dashboard", "contracts", "job_run"]
 
@@ -0,0 +1,65 @@
+"""
+CRUD operations across both contract types (TinChap + TraGop)
+"""
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from app.models.tin_chap import TinChap
+from app.models.tra_gop import TraGop
+from app.models.lich_su_tra_lai import LichSuTraLai
+from app.crud.tin_chap import build_tin_chap_response
+from app.crud.tra_gop import build_tra_gop_response
+
+
+def get_contracts_batch(db: Session, ma_hds: List[str]) -> Dict[str, list]:
+    """
+    Get many contracts with their lịch sử trả lãi and balances at once
+    
+    Runs at most 3 queries regardless of how many MaHD are requested:
+    TinChap IN (...), TraGop IN (...), LichSuTraLai IN (...).
+    
+    Args:
+        db: Database session
+        ma_hds: Contract IDs, TC and TG may be mixed
+        
+    Returns:
+        dict: {"items": [...] in request order, "not_found": [...]}
+    """
+    # Giữ thứ tự yêu cầu, bỏ mã trùng
+    ma_hds = list(dict.fromkeys(ma_hds))
+    ma_hd_tc = [ma_hd for ma_hd in ma_hds if ma_hd.startswith("TC")]
+    ma_hd_tg = [ma_hd for ma_hd in ma_hds if ma_hd.startswith("TG")]
+
+    contracts: Dict[str, object] = {}
+    if ma_hd_tc:
+        for tc in db.query(TinChap).filter(TinChap.MaHD.in_(ma_hd_tc)).all():
+            contracts[tc.MaHD] = tc
+    if ma_hd_tg:
+        for tg in db.query(TraGop).filter(TraGop.MaHD.in_(ma_hd_tg)).all():
+            contracts[tg.MaHD] = tg
+
+    histories: Dict[str, List[LichSuTraLai]] = defaultdict(list)
+    if contracts:
+        rows = (
+            db.query(LichSuTraLai)
+            .filter(LichSuTraLai.MaHD.in_(list(contracts)))
+            .order_by(LichSuTraLai.MaHD, LichSuTraLai.Stt)
+            .all()
+        )
+        for row in rows:
+            histories[row.MaHD].append(row)
+
+    items = []
+    not_found = []
+    for ma_hd in ma_hds:
+        contract = contracts.get(ma_hd)
+        if contract is None:
+            not_found.append(ma_hd)
+        elif isinstance(contract, TinChap):
+            items.append(build_tin_chap_response(contract, histories[ma_hd]))
+        else:
+            items.append(build_tra_gop_response(contract, histories[ma_hd]))
+
+    return {"items": items, "not_found": not_found}
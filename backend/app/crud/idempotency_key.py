@@ -0,0 +1,73 @@
+"""
+CRUD operations for IdempotencyKey
+"""
+import datetime
+import hashlib
+from typing import Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models.idempotency_key import IdempotencyKey
+
+
+def get_idempotency_key(db: Session, key: str) -> Optional[IdempotencyKey]:
+    """Đọc 1 key theo khóa chính (1 lần đọc index)"""
+    return db.execute(select(IdempotencyKey).where(IdempotencyKey.Key == key)).scalar_one_or_none()
+
+
+def try_lock_idempotency_key(db: Session, key: str) -> bool:
+    """
+    pg_try_advisory_xact_lock trên hash của key, giữ tới khi transaction hiện tại kết thúc
+
+    Khóa gắn với transaction của request đang xử lý key: tự nhả khi commit / rollback
+    hoặc khi connection bị đóng (worker chết), không phụ thuộc thời gian.
+
+    Returns:
+        True nếu giữ được khóa, False nếu transaction khác đang giữ
+    """
+    lock_key = int.from_bytes(hashlib.sha1(f"idempotency:{key}".encode("utf-8")).digest()[:8], "big", signed=True)
+    return bool(db.execute(select(func.pg_try_advisory_xact_lock(lock_key))).scalar())
+
+
+def save_idempotency_key(db: Session, key: str, dau_van_tay: bytes, status_code: int, response: bytes) -> bool:
+    """
+    Ghi response (đã nén) của key trong transaction hiện tại (không commit)
+
+    Commit cùng thao tác chuyển tiền (unit_of_work của request): hoặc cả 2 được ghi,
+    hoặc không có gì. Dòng cũ chưa có response (StatusCode NULL, phiên bản trước) bị ghi đè.
+
+    Returns:
+        False nếu key đã có response (request khác đã commit), không ghi gì
+    """
+    excluded = insert(IdempotencyKey).excluded
+    saved = db.execute(
+        insert(IdempotencyKey)
+        .values(
+            Key=key,
+            DauVanTay=dau_van_tay,
+            StatusCode=status_code,
+            Response=response,
+            NgayTao=datetime.datetime.now(),
+        )
+        .on_conflict_do_update(
+            index_elements=[IdempotencyKey.Key],
+            set_={
+                "DauVanTay": excluded.DauVanTay,
+                "StatusCode": excluded.StatusCode,
+                "Response": excluded.Response,
+                "NgayTao": excluded.NgayTao,
+            },
+            where=IdempotencyKey.StatusCode.is_(None),
+        )
+        .returning(IdempotencyKey.Key)
+    ).scalar_one_or_none()
+    return saved is not None
+
+
+def delete_expired_idempotency_keys(db: Session, before: datetime.datetime) -> int:
+    """Xóa các key tạo trước `before` (dùng index NgayTao), trả về số dòng đã xóa"""
+    deleted = db.execute(delete(IdempotencyKey).where(IdempotencyKey.NgayTao < before)).rowcount
+    db.commit()
+    return deleted
@@ -0,0 +1,201 @@
+"""
+CRUD operations for JobRun (job-run ledger) và checkpoint theo hợp đồng
+"""
+import datetime
+from datetime import date
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.enums import TrangThaiJob, TrangThaiThucThiJob
+from app.models.job_run import JobRun, JobRunCheckpoint, JobExecution
+
+
+def get_or_create_job_run(db: Session, ten_job: str, ngay_chay: date) -> JobRun:
+    """
+    Lấy (hoặc tạo) dòng job_runs của TenJob cho NgayChay và khóa dòng đó (FOR UPDATE)
+
+    INSERT ... ON CONFLICT DO NOTHING nên 2 lần gọi đồng thời vẫn chỉ có 1 dòng.
+    Không commit.
+    """
+    db.execute(
+        insert(JobRun)
+        .values(
+            TenJob=ten_job,
+            NgayChay=ngay_chay,
+            TrangThai=TrangThaiJob.DANG_CHAY.value,
+            BatDau=datetime.datetime.now(),
+            SoLanChay=0,
+            SoHopDong=0,
+            SoHopDongXong=0,
+            SoBanGhiTao=0,
+            SoBanGhiCapNhat=0,
+            SoLoi=0,
+        )
+        .on_conflict_do_nothing(constraint="uq_job_runs_ten_job_ngay_chay")
+    )
+    return db.execute(
+        select(JobRun)
+        .where(JobRun.TenJob == ten_job, JobRun.NgayChay == ngay_chay)
+        .with_for_update()
+    ).scalar_one()
+
+
+def get_done_ma_hds(db: Session, job_run_id: int) -> Set[str]:
+    """MaHD đã có checkpoint trong lần chạy job_run_id"""
+    return set(
+        db.execute(select(JobRunCheckpoint.MaHD).where(JobRunCheckpoint.JobRunId == job_run_id)).scalars()
+    )
+
+
+def filter_done_ma_hds(db: Session, job_run_id: int, ma_hds: Iterable[str]) -> Set[str]:
+    """Trong ma_hds, những MaHD đã có checkpoint (1 query)"""
+    ma_hds = list(ma_hds)
+    if not ma_hds:
+        return set()
+    return set(
+        db.execute(
+            select(JobRunCheckpoint.MaHD).where(
+                JobRunCheckpoint.JobRunId == job_run_id,
+                JobRunCheckpoint.MaHD.in_(ma_hds),
+            )
+        ).scalars()
+    )
+
+
+def add_checkpoint(db: Session, job_run_id: int, ma_hd: str) -> None:
+    """Ghi checkpoint cho 1 hợp đồng (không commit, đi cùng transaction của hợp đồng)"""
+    db.add(JobRunCheckpoint(JobRunId=job_run_id, MaHD=ma_hd))
+
+
+def add_job_run_counters(
+    db: Session,
+    job_run_id: int,
+    contracts_done: int = 0,
+    records_created: int = 0,
+    records_updated: int = 0,
+) -> None:
+    """
+    Cộng dồn bộ đếm của job_runs bằng UPDATE col = col + n (an toàn khi nhiều worker cùng ghi)
+
+    Không commit: gọi trước commit của chunk để bộ đếm khớp với checkpoint.
+    """
+    if not (contracts_done or records_created or records_updated):
+        return
+    db.execute(
+        update(JobRun)
+        .where(JobRun.Id == job_run_id)
+        .values(
+            SoHopDongXong=JobRun.SoHopDongXong + contracts_done,
+            SoBanGhiTao=JobRun.SoBanGhiTao + records_created,
+            SoBanGhiCapNhat=JobRun.SoBanGhiCapNhat + records_updated,
+        )
+    )
+
+
+def finish_job_run(db: Session, job_run_id: int, so_loi: int, chi_so: Optional[str] = None) -> JobRun:
+    """
+    Kết thúc lần chạy: HOAN_THANH nếu không có lỗi, ngược lại CO_LOI (chạy lại sẽ resume)
+
+    chi_so: JSON đo đạc của lần chạy (thời gian theo pha, số câu SQL, bộ nhớ đỉnh)
+
+    Không commit.
+    """
+    job_run = db.get(JobRun, job_run_id, with_for_update=True)
+    job_run.TrangThai = TrangThaiJob.HOAN_THANH.value if so_loi == 0 else TrangThaiJob.CO_LOI.value
+    job_run.SoLoi = so_loi
+    if chi_so is not None:
+        job_run.ChiSo = chi_so
+    job_run.KetThuc = datetime.datetime.now()
+    return job_run
+
+
+def create_job_execution(db: Session, ten_job: str, kich_hoat: str, worker: str) -> JobExecution:
+    """Ghi nhận 1 lần thực thi job bắt đầu (commit ngay để /jobs thấy được)"""
+    execution = JobExecution(
+        TenJob=ten_job,
+        TrangThai=TrangThaiThucThiJob.DANG_CHAY.value,
+        KichHoat=kich_hoat,
+        Worker=worker,
+        BatDau=datetime.datetime.now(),
+    )
+    db.add(execution)
+    db.commit()
+    db.refresh(execution)
+    return execution
+
+
+def finish_job_execution(
+    db: Session,
+    execution_id: int,
+    trang_thai: str,
+    ket_qua: Optional[str] = None,
+    loi: Optional[str] = None,
+) -> Optional[JobExecution]:
+    """Kết thúc 1 lần thực thi job (commit)"""
+    execution = db.get(JobExecution, execution_id)
+    if not execution:
+        return None
+    execution.TrangThai = trang_thai
+    execution.KetThuc = datetime.datetime.now()
+    execution.ThoiGianMs = int((execution.KetThuc - execution.BatDau).total_seconds() * 1000)
+    execution.KetQua = ket_qua
+    execution.Loi = loi
+    db.commit()
+    return execution
+
+
+def update_job_execution_progress(db: Session, execution_id: int, tien_do: str) -> None:
+    """
+    Ghi tiến độ (JSON) của lần thực thi đang chạy (commit ngay để client poll thấy được)
+
+    Chỉ ghi khi còn DANG_CHAY: tiến độ báo trễ không ghi đè lần đã kết thúc.
+    """
+    db.execute(
+        update(JobExecution)
+        .where(
+            JobExecution.Id == execution_id,
+            JobExecution.TrangThai == TrangThaiThucThiJob.DANG_CHAY.value,
+        )
+        .values(TienDo=tien_do)
+    )
+    db.commit()
+
+
+def get_job_execution(db: Session, execution_id: int) -> Optional[JobExecution]:
+    """Get a JobExecution by Id"""
+    return db.get(JobExecution, execution_id)
+
+
+def get_job_executions(db: Session, ten_job: str, skip: int = 0, limit: int = 20) -> List[JobExecution]:
+    """Lịch sử thực thi của 1 job (mới nhất trước)"""
+    return list(
+        db.execute(
+            select(JobExecution)
+            .where(JobExecution.TenJob == ten_job)
+            .order_by(JobExecution.Id.desc())
+            .offset(skip)
+            .limit(limit)
+        ).scalars()
+    )
+
+
+def get_running_job_execution(db: Session, ten_job: str) -> Optional[JobExecution]:
+    """Lần thực thi đang chạy gần nhất của 1 job (nếu có)"""
+    return db.execute(
+        select(JobExecution)
+        .where(
+            JobExecution.TenJob == ten_job,
+            JobExecution.TrangThai == TrangThaiThucThiJob.DANG_CHAY.value,
+        )
+        .order_by(JobExecution.Id.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def get_last_job_execution(db: Session, ten_job: str) -> Optional[JobExecution]:
+    """Lần thực thi gần nhất của 1 job"""
+    executions = get_job_executions(db, ten_job, limit=1)
+    return executions[0] if executions else None
@@ -1,19 +1,28 @@
 """
 CRUD operations for LichSuTraLai
 """
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import select, or_
-from typing import List, Optional
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import insert, select
+from typing import Dict, List, Optional, Tuple
 
 from app.core.enums import TrangThaiThanhToan, TrangThaiNgayThanhToan
+from app.models.lich_su import LichSu
 from app.models.lich_su_tra_lai import LichSuTraLai
 from app.models.tin_chap import TinChap
 from app.models.tra_gop import TraGop
-from app.schemas.lich_su_tra_lai import LichSuTraLaiCreate, LichSuTraLaiUpdate
+from app.core.database import run_after_commit
+from app.services.projection import invalidate_projection
+from app.schemas.lich_su_tra_lai import LichSuTraLaiUpdate, LichSuTraLaiPayItem
+from app.crud import job_run as crud_job_run
+from app.crud import payment_allocation as crud_payment_allocation
+from app.utils.allocation import PhanBoThanhToan, allocate_waterfall
+from app.utils.calculations import build_payment_schedule
+from app.utils.concurrency import lock_contract, lock_contracts, retry_on_stale_data
 
-from app.utils.lich_su import create_lich_su as create_lich_su_utils, delete_lich_su as delete_lich_su_utils
+from app.utils.lich_su import delete_lich_su as delete_lich_su_utils
 
 def get_lich_su(db: Session, stt: int) -> Optional[LichSuTraLai]:
     """
@@ -119,113 +128,55 @@ def create_lich_su(db: Session, ma_hd: str) -> dict:
                 raise HTTPException(status_code=400, detail="SoLanTra phải lớn hơn 0")
             so_tien_moi_ky = (so_tien_vay + lai_suat) // so_lan_tra  # Làm tròn xuống
         
-        # 5. Tạo danh sách kỳ thanh toán
-        danh_sach_ky = []
-        
-        if loai_hop_dong == "TG":
-            # Trả Góp: Tạo đủ số kỳ theo SoLanTra
-            so_lan_tra = data_hop_dong.SoLanTra
-            ngay_ky_hien_tai = ngay_vay  # Kỳ đầu tiên
-            
-            for ky_thu in range(0, so_lan_tra):
-                ky_thu+=1
-                danh_sach_ky.append({
-                    "ngay": ngay_ky_hien_tai,
-                    "ky_thu": ky_thu,
-                    "so_tien_ky": so_tien_moi_ky
-                })
-                ngay_ky_hien_tai += timedelta(days=ky_dong)
-        else:
-            # Tín Chấp: Tạo kỳ từ NgayVay đến hôm nay (logic cũ)
-            ngay_ky_hien_tai = ngay_vay + timedelta(days=ky_dong)  # Kỳ đầu tiên
-            ky_thu = 0
-            if ngay_vay == date_now:
-                ky_thu += 1
-                danh_sach_ky.append({
-                    "ngay": ngay_vay,
-                    "ky_thu": ky_thu,
-                    "so_tien_ky": so_tien_moi_ky
-                })
-
-            while ngay_ky_hien_tai <= date_now:
-                danh_sach_ky.append({
-                    "ngay": ngay_ky_hien_tai,
-                    "ky_thu": ky_thu,
-                    "so_tien_ky": so_tien_moi_ky
-                })
-                ngay_ky_hien_tai += timedelta(days=ky_dong)
-                ky_thu += 1
-        
+        # 5. Tính lịch kỳ thanh toán (hàm thuần: mảng ngày / kỳ thứ / số tiền)
+        if not ky_dong or ky_dong <= 0:
+            raise HTTPException(status_code=400, detail="KyDong phải lớn hơn 0")
+        lich = build_payment_schedule(
+            loai_hop_dong,
+            ngay_vay,
+            ky_dong,
+            so_tien_moi_ky,
+            data_hop_dong.SoLanTra if loai_hop_dong == "TG" else 0,
+            date_now,
+        )
+
         # 6. Nếu không có kỳ nào
-        if len(danh_sach_ky) == 0:
+        if len(lich) == 0:
             return {
                 "success": True,
                 "message": "Chưa đến kỳ thanh toán đầu tiên",
                 "records_created": 0
             }
-        
-        # 7. Tạo các bản ghi lịch sử
-        so_ky = len(danh_sach_ky)
-        end_date = danh_sach_ky[-1]["ngay"]
-        
-        for idx, ky in enumerate(danh_sach_ky):
-            # Xác định trạng thái ngày thanh toán dựa trên ngày kỳ
-            if loai_hop_dong == "TG" and end_date < date_now:
-                # Trả Góp: Nếu ngày cuối cùng đã quá hạn, tất cả các kỳ đều QUA_HAN
-                trang_thai_ngay = TrangThaiNgayThanhToan.QUA_HAN.value
-            elif ky["ngay"] == date_now:
-                trang_thai_ngay = TrangThaiNgayThanhToan.DEN_HAN.value
-            elif ky["ngay"] < date_now:
-                trang_thai_ngay = TrangThaiNgayThanhToan.QUA_HAN.value
-            else:
-                trang_thai_ngay = TrangThaiNgayThanhToan.CHUA_DEN_HAN.value
-            
-            # Tính số tiền dựa trên loại hợp đồng và trạng thái
-            if loai_hop_dong == "TG":
-                # Trả Góp: Logic cộng dồn đặc biệt
-                if end_date < date_now:
-                    # Nếu ngày cuối cùng đã quá hạn:
-                    # - Các kỳ trước kỳ cuối: SoTien = 0
-                    # - Kỳ cuối cùng: SoTien = tổng cộng dồn tất cả các kỳ
-                    if idx < len(danh_sach_ky) - 1:
-                        so_tien = 0
-                    else:
-                        # Kỳ cuối cùng: cộng dồn tất cả
-                        so_tien = so_tien_moi_ky * so_ky
-                elif ky["ngay"] < date_now:
-                    # Các kỳ quá hạn: SoTien = 0
-                    so_tien = 0
-                elif ky["ngay"] == date_now:
-                    # Kỳ hiện tại: SoTien = tổng cộng dồn của tất cả kỳ quá hạn + kỳ hiện tại
-                    so_ky_qua_han = sum(1 for k in danh_sach_ky if k["ngay"] < date_now)
-                    so_tien = so_tien_moi_ky * (so_ky_qua_han + 1)  # +1 cho kỳ hiện tại
-                else:
-                    # Các kỳ chưa đến hạn: SoTien = số tiền cố định
-                    # so_tien = so_tien_moi_ky
-                    so_ky_qua_han = sum(1 for k in danh_sach_ky if k["ngay"] < date_now)
-                    so_tien = so_tien_moi_ky * (so_ky_qua_han + 1)
-                
-            else:
-                # Tín Chấp: Logic cộng dồn (các kỳ cũ = 0, kỳ cuối = tổng cộng dồn)
-                tong_tien_cong_don = so_tien_moi_ky * so_ky
-                so_tien = 0 if idx < len(danh_sach_ky) - 1 else tong_tien_cong_don
-                
-            
-            db_lich_su = LichSuTraLai(
-                MaHD=ma_hd,
-                Ngay=ky["ngay"],
-                SoTien=so_tien,
-                NoiDung=f"Trả lãi kỳ {ky['ky_thu']}",
-                TrangThaiThanhToan=TrangThaiThanhToan.CHUA_THANH_TOAN.value,
-                TrangThaiNgayThanhToan=trang_thai_ngay,
-                TienDaTra=0
-            )
-            db.add(db_lich_su)
-        # 8. Commit vào database
-        db.commit()
-        # 9. Tự động tạo lịch sử trả lãi cho hôm nay nếu đến hạn
+
+        # 7. Ghi tất cả các kỳ bằng 1 INSERT nhiều dòng (executemany -> INSERT ... VALUES (...), (...))
+        so_ky = len(lich)
+        end_date = lich.ngay[-1]
+        chua_thanh_toan = TrangThaiThanhToan.CHUA_THANH_TOAN.value
+        db.execute(
+            insert(LichSuTraLai.__table__),
+            [
+                {
+                    "MaHD": ma_hd,
+                    "Ngay": ngay,
+                    "SoTien": so_tien,
+                    "NoiDung": f"Trả lãi kỳ {ky_thu}",
+                    "KyThu": ky_thu,
+                    "TrangThaiThanhToan": chua_thanh_toan,
+                    "TienDaTra": 0,
+                }
+                for ngay, ky_thu, so_tien in zip(lich.ngay, lich.ky_thu, lich.so_tien)
+            ],
+        )
+        # Ngày đến hạn tiếp theo cho job cộng dồn (tính từ hôm nay)
+        # Import trong hàm: app.services.accrual import app.crud (vòng lặp import)
+        from app.services.accrual import next_due_date_from_dates
+        data_hop_dong.NgayDenHanTiepTheo = next_due_date_from_dates(data_hop_dong, lich.ngay, date_now)
+        # 8. Flush (commit 1 lần ở unit_of_work của request)
+        db.flush()
+        run_after_commit(db, invalidate_projection)
+        # 9. Tự động tạo lịch sử trả lãi cho hôm nay nếu đến hạn (chỉ hợp đồng vừa tạo lịch)
         if end_date < date_now and loai_hop_dong == "TG":
-            auto_create_lich_su(db)
+            auto_create_lich_su(db, ma_hds=[ma_hd])
             
         # 10. Trả về kết quả
         return {
@@ -239,7 +190,6 @@ def create_lich_su(db: Session, ma_hd: str) -> dict:
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Lỗi khi tạo lịch sử: {str(e)}")
 
 
@@ -264,8 +214,8 @@ def update_lich_su(db: Session, stt: int, lich_su_update: LichSuTraLaiUpdate) ->
     for key, value in update_data.items():
         setattr(db_lich_su, key, value)
     
-    db.commit()
-    db.refresh(db_lich_su)
+    db.flush()
+    run_after_commit(db, invalidate_projection)
     
     return db_lich_su
 
@@ -288,7 +238,8 @@ def delete_lich_su(db: Session, stt: int) -> bool:
     
     delete_lich_su_utils(db, ma_hd=db_lich_su.MaHD)
     db.delete(db_lich_su)
-    db.commit()
+    db.flush()
+    run_after_commit(db, invalidate_projection)
     
     return True
 
@@ -347,436 +298,220 @@ def delete_lich_sus_by_contract(db: Session, ma_hd: str) -> int:
         for lich_su in lich_sus:
             db.delete(lich_su)
         
-        # Commit vào database
-        db.commit()
+        db.flush()
+        run_after_commit(db, invalidate_projection)
         
         return so_ban_ghi
         
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Lỗi khi xóa lịch sử trả lãi: {str(e)}")
 
 
-def auto_create_lich_su(db: Session) -> dict:
+def auto_create_lich_su(db: Session, ma_hds: Optional[List[str]] = None) -> dict:
     """
     Tự động cập nhật lịch sử trả lãi cho tất cả hợp đồng chưa thanh toán
     
     Logic:
     - Chỉ xử lý hợp đồng chưa có trạng thái "DA_TAT_TOAN"
-    - Kiểm tra ngày hôm nay đã có trong bảng lịch_su_tra_lai chưa
-    - Tín Chấp: Cộng dồn số tiền chưa trả vào kỳ mới, tạo bản ghi mới
-    - Trả Góp: Cập nhật kỳ có ngày trùng với hôm nay, không tạo mới
+    - Tín Chấp: Cộng dồn số tiền chưa trả vào kỳ mới, tạo bản ghi mới (accrue_tin_chap)
+    - Trả Góp: Cập nhật kỳ có ngày trùng với hôm nay, tạo kỳ hôm nay nếu thiếu (accrue_tra_gop)
+    - Toàn bộ kỳ của các hợp đồng được load 1 lần (load_periods)
+    
+    Chạy tuần tự trong session hiện tại, chỉ flush (caller commit 1 lần). Hợp đồng đã có checkpoint
+    trong job_runs của hôm nay được bỏ qua, hợp đồng xử lý xong được ghi checkpoint.
+    Job hằng đêm dùng app.services.accrual.run_accrual (song song theo shard, commit theo chunk).
+    
+    Args:
+        ma_hds: Chỉ xử lý các hợp đồng này (None = tất cả hợp đồng đến hạn)
     
     Returns:
         dict: Thông tin kết quả xử lý
     """
+    # Import trong hàm: app.services.accrual import app.crud (vòng lặp import)
+    from app.services.accrual import ACCRUAL_JOB_NAME, load_periods, apply_accrual, due_filter, next_due_date, save_next_due_dates
+
     try:
         date_now = date.today()
-        # date_now = date(2025, 10, 24)
-        contracts_processed = 0
         records_created = 0
         records_updated = 0
         
-        tin_chap_contracts = db.execute(select(TinChap).where(TinChap.TrangThai != "DA_TAT_TOAN")).scalars().all()
-        tra_gop_contracts = db.execute(select(TraGop).where(TraGop.TrangThai != "DA_TAT_TOAN")).scalars().all()
-        # 3. Xử lý Tín Chấp
-        for contract in tin_chap_contracts:
-            ma_hd = contract.MaHD
-            # Chuẩn hóa trạng thái ngày cho TẤT CẢ bản ghi theo date_now
-            all_records_tc = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == ma_hd).all()
-            for rec in all_records_tc:
-                if rec.Ngay < date_now:
-                    rec.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.QUA_HAN.value
-                elif rec.Ngay == date_now:
-                    rec.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.DEN_HAN.value
-                else:
-                    rec.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.CHUA_DEN_HAN.value
-            # Kiểm tra hôm nay có phải là ngày đóng lãi không
-            ky_dong = contract.KyDong
-            if (date_now.day - contract.NgayVay.day) % ky_dong != 0:
-                continue
-            
-            # Tính số tiền cộng dồn từ tất cả các kỳ chưa trả
-            tong_tien_chua_tra = 0
-            lich_sus_chua_tra = db.query(LichSuTraLai).filter(
-                LichSuTraLai.MaHD == ma_hd,
-                LichSuTraLai.SoTien > LichSuTraLai.TienDaTra,
-                LichSuTraLai.SoTien != 0
-            ).all()
-            
-            # Cập nhật tất cả các kỳ cũ: SoTien = 0, TrangThaiNgayThanhToan = QUA_HAN
-            for ls in lich_sus_chua_tra:
-                tong_tien_chua_tra += (ls.SoTien - ls.TienDaTra)
-                ls.SoTien = 0
-                ls.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.QUA_HAN.value
-                # Cập nhật NoiDung để bỏ phần cộng dồn
-                if "kỳ" in ls.NoiDung:
-                    ky_so = ls.NoiDung.split("kỳ ")[1].split(" ")[0]
-                    ls.NoiDung = f"Trả lãi kỳ {ky_so}"
-
-            # Cập nhật hoặc tạo bản ghi cho hôm nay với số tiền = lãi ngày + cộng dồn
-            existing_today = db.query(LichSuTraLai).filter(
-                LichSuTraLai.MaHD == ma_hd,
-                LichSuTraLai.Ngay == date_now
-            ).first()
-
-            so_tien_ky_moi = (contract.LaiSuat or 0) + tong_tien_chua_tra
-            if existing_today:
-                existing_today.SoTien = so_tien_ky_moi
-                existing_today.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.DEN_HAN.value
-                # Cập nhật NoiDung thể hiện cộng dồn
-                existing_today.NoiDung = f"Trả lãi kỳ (cộng dồn {tong_tien_chua_tra})"
-                records_updated += 1
-            else:
-                db_lich_su = LichSuTraLai(
-                    MaHD=ma_hd,
-                    Ngay=date_now,
-                    SoTien=so_tien_ky_moi,
-                    NoiDung=f"Trả lãi kỳ 1 (cộng dồn {tong_tien_chua_tra})",
-                    TrangThaiThanhToan=TrangThaiThanhToan.CHUA_THANH_TOAN.value,
-                    TrangThaiNgayThanhToan=TrangThaiNgayThanhToan.DEN_HAN.value,
-                    TienDaTra=0
-                )
-                db.add(db_lich_su)
-                records_created += 1
-        
-        # 4. Xử lý Trả Góp
-        
-        for contract in tra_gop_contracts:
-            ma_hd = contract.MaHD
-            # Chuẩn hóa trạng thái ngày cho TẤT CẢ bản ghi theo date_now
-            all_records_tg = (
-                db.query(LichSuTraLai)
-                .filter(LichSuTraLai.MaHD == ma_hd)
-                .order_by(LichSuTraLai.Ngay.asc())
-                .all()
-            )
-            end_date = all_records_tg[-1].Ngay
-            if end_date < date_now:
-                continue
-            for rec in all_records_tg:
-                if rec.Ngay < date_now:
-                    rec.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.QUA_HAN.value
-                elif rec.Ngay == date_now:
-                    rec.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.DEN_HAN.value
-                else:
-                    rec.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.CHUA_DEN_HAN.value
-            ky_dong = contract.KyDong
-            
-            # Kiểm tra ngày hôm nay có phải là ngày đóng lãi không
-            check_ngay_dong_lai = db.query(LichSuTraLai).filter(
-                LichSuTraLai.MaHD == ma_hd,
-                LichSuTraLai.Ngay == date_now
-            ).first()
-            if not check_ngay_dong_lai:
-                continue
-                
-            # Tìm kỳ có trạng thái "Đến hạn trả lãi" (kỳ cần cập nhật)
-            latest_ky = db.query(LichSuTraLai).filter(
-                LichSuTraLai.MaHD == ma_hd,
-                LichSuTraLai.Ngay == date_now-timedelta(days=ky_dong)
-            ).first()
-            
-            if not latest_ky:
-                continue
-                
-            # Lưu số tiền gốc trước khi đặt = 0
-            so_tien_goc = latest_ky.SoTien
-            tong_tien_chua_tra = so_tien_goc - latest_ky.TienDaTra
-            
-            # Cập nhật kỳ cũ: SoTien = 0, TrangThaiNgayThanhToan = QUA_HAN
-            latest_ky.SoTien = 0
-            latest_ky.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.QUA_HAN.value
-            
-            # Cập nhật kỳ hôm nay với số tiền cộng dồn
-            so_tien_moi_ky = (contract.SoTienVay + contract.LaiSuat) // contract.SoLanTra
-            check_ngay_dong_lai.SoTien = so_tien_moi_ky + tong_tien_chua_tra
-            check_ngay_dong_lai.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.DEN_HAN.value
-            
-            # Cập nhật NoiDung
-            if "kỳ" in latest_ky.NoiDung:
-                ky_so = int(latest_ky.NoiDung.split('kỳ ')[1].split(' ')[0]) + 1
-                check_ngay_dong_lai.NoiDung = f"Trả lãi kỳ {ky_so} (cộng dồn {tong_tien_chua_tra})"
-            
-            records_updated += 1
-        
-        # 4.1. Xử lý Trả Góp - Tạo kỳ hôm nay khi đến hạn mà chưa có
-        for contract in tra_gop_contracts:
-            ma_hd = contract.MaHD
-            # Kiểm tra hôm nay có phải là ngày đóng lãi không
-            ky_dong = contract.KyDong
-            if (date_now.day - contract.NgayVay.day) % ky_dong != 0:
-                continue
-            
-            # Kiểm tra đã có lịch sử cho ngày hôm nay chưa
-            existing_today = db.query(LichSuTraLai).filter(
-                LichSuTraLai.MaHD == ma_hd,
-                LichSuTraLai.Ngay == date_now
-            ).first()
-            
-            if existing_today:
-                # Nếu đã có, bảo đảm số tiền hôm nay bao gồm cộng dồn
-                # Tính số tiền cộng dồn từ các kỳ chưa trả (trước hôm nay)
-                tong_tien_chua_tra = 0
-                lich_sus_chua_tra = db.query(LichSuTraLai).filter(
-                    LichSuTraLai.MaHD == ma_hd,
-                    LichSuTraLai.Ngay < date_now,
-                    LichSuTraLai.SoTien > LichSuTraLai.TienDaTra,
-                    LichSuTraLai.SoTien != 0
-                ).all()
-                for ls in lich_sus_chua_tra:
-                    tong_tien_chua_tra += (ls.SoTien - ls.TienDaTra)
-                    ls.SoTien = 0
-                    ls.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.QUA_HAN.value
-                so_tien_moi_ky = (contract.SoTienVay + contract.LaiSuat) // contract.SoLanTra
-                existing_today.SoTien = so_tien_moi_ky + tong_tien_chua_tra
-                existing_today.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.DEN_HAN.value
-                records_updated += 1
-                continue
-            
-            # Tính số tiền cộng dồn từ tất cả các kỳ chưa trả
-            tong_tien_chua_tra = 0
-            lich_sus_chua_tra = db.query(LichSuTraLai).filter(
-                LichSuTraLai.MaHD == ma_hd,
-                LichSuTraLai.SoTien > LichSuTraLai.TienDaTra,
-                LichSuTraLai.SoTien != 0
-            ).all()
-            so_tien_chua_tra = 0
-            # Cập nhật tất cả các kỳ cũ: SoTien = 0, TrangThaiNgayThanhToan = QUA_HAN
-            for ls in lich_sus_chua_tra:
-                # Tính số tiền chưa trả TRƯỚC KHI set SoTien = 0
-                so_tien_chua_tra = ls.SoTien - ls.TienDaTra
-                if so_tien_chua_tra > 0:  # Chỉ cộng dồn nếu thực sự chưa trả đủ
-                    tong_tien_chua_tra += so_tien_chua_tra
-                # Sau đó mới set SoTien = 0
-                ls.SoTien = 0
-                ls.TrangThaiNgayThanhToan = TrangThaiNgayThanhToan.QUA_HAN.value
-                # Cập nhật NoiDung để bỏ phần cộng dồn
-                if "kỳ" in ls.NoiDung:
-                    ky_so = ls.NoiDung.split("kỳ ")[1].split(" ")[0]
-                    ls.NoiDung = f"Trả lãi kỳ {ky_so}"
-
-            # Tạo bản ghi mới cho hôm nay với số tiền = (Gốc+Lãi)/Số lần + cộng dồn
-            so_tien_moi_ky = (contract.SoTienVay + contract.LaiSuat) // contract.SoLanTra
-            if end_date < date_now:
-                so_tien_ky_moi = tong_tien_chua_tra
-            else:
-                so_tien_ky_moi = so_tien_moi_ky + tong_tien_chua_tra
-            
-            db_lich_su = LichSuTraLai(
-                MaHD=ma_hd,
-                Ngay=date_now,
-                SoTien=so_tien_ky_moi,
-                NoiDung=f"Trả lãi kỳ {len(lich_sus_chua_tra) + 1} (cộng dồn {tong_tien_chua_tra})",
-                TrangThaiThanhToan=TrangThaiThanhToan.CHUA_THANH_TOAN.value,
-                TrangThaiNgayThanhToan=TrangThaiNgayThanhToan.DEN_HAN.value,
-                TienDaTra=0
-            )
-            db.add(db_lich_su)
-            records_created += 1
-        
-        # 5. Commit tất cả thay đổi
-        db.commit()
-        contracts_processed = len(tin_chap_contracts) + len(tra_gop_contracts)
+        # Bỏ qua hợp đồng đã được job hôm nay xử lý (checkpoint trong job_runs)
+        job_run = crud_job_run.get_or_create_job_run(db, ACCRUAL_JOB_NAME, date_now)
+        done = crud_job_run.get_done_ma_hds(db, job_run.Id)
+
+        # Chỉ các hợp đồng đến hạn hôm nay (NgayDenHanTiepTheo <= hôm nay hoặc NULL)
+        tin_chap_query = select(TinChap).where(due_filter(TinChap, date_now))
+        tra_gop_query = select(TraGop).where(due_filter(TraGop, date_now))
+        if ma_hds is not None:
+            tin_chap_query = tin_chap_query.where(TinChap.MaHD.in_(ma_hds))
+            tra_gop_query = tra_gop_query.where(TraGop.MaHD.in_(ma_hds))
+        tin_chap_contracts = db.execute(tin_chap_query).scalars().all()
+        tra_gop_contracts = db.execute(tra_gop_query).scalars().all()
+        pending = [c for c in [*tin_chap_contracts, *tra_gop_contracts] if c.MaHD not in done]
+
+        periods = load_periods(db, [c.MaHD for c in pending])
+        contracts_processed = 0
+        advanced = []
+        for contract in pending:
+            counts = apply_accrual(db, contract, periods[contract.MaHD], date_now)
+            crud_job_run.add_checkpoint(db, job_run.Id, contract.MaHD)
+            advanced.append((contract, next_due_date(contract, periods[contract.MaHD], date_now + timedelta(days=1))))
+            contracts_processed += 1
+            records_created += counts["created"]
+            records_updated += counts["updated"]
+        save_next_due_dates(db, advanced)
+        
+        crud_job_run.add_job_run_counters(
+            db,
+            job_run.Id,
+            contracts_done=contracts_processed,
+            records_created=records_created,
+            records_updated=records_updated,
+        )
+        db.flush()
+        run_after_commit(db, invalidate_projection)
         
         return {
             "success": True,
             "message": f"Đã xử lý {contracts_processed} hợp đồng",
             "contracts_processed": contracts_processed,
+            "contracts_skipped": len(done),
             "records_created": records_created,
             "records_updated": records_updated
         }
         
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Lỗi khi tự động cập nhật lịch sử: {str(e)}")
 
-def pay_lich_su(db: Session, stt: int, so_tien: int) -> dict:
+# Loại hợp đồng theo MaHD: (model, hành động ghi vào nhật ký lich_su khi thanh toán lãi)
+_PAY_CONTRACT_TYPES = {
+    "TC": (TinChap, "Thanh toán lãi hợp đồng tín chấp"),
+    "TG": (TraGop, "Thanh toán lãi hợp đồng trả góp"),
+}
+
+
+def _loai_hop_dong(ma_hd: str) -> str:
+    """TC / TG theo MaHD, 400 nếu không nhận ra"""
+    for loai in _PAY_CONTRACT_TYPES:
+        if loai in ma_hd:
+            return loai
+    raise HTTPException(status_code=400, detail=f"Mã hợp đồng không hợp lệ: {ma_hd}")
+
+
+def _load_periods_for_payment(db: Session, ma_hds: List[str]) -> Dict[str, List[LichSuTraLai]]:
     """
-    Thanh toán lịch sử trả lãi theo chuẩn logic:
-    - Chỉ cho phép thanh toán kỳ "Đến hạn" (DEN_HAN)
-    - Không cho phép trả vượt quá số tiền còn lại của kỳ
-    - Cập nhật trạng thái kỳ: DONG_DU hoặc THANH_TOAN_MOT_PHAN
-    - Cập nhật trạng thái HĐ: nếu còn kỳ chưa trả đủ => THANH_TOAN_MOT_PHAN; nếu tất cả đã đủ => DA_TAT_TOAN
+    Nạp mọi kỳ của các hợp đồng trong 1 query, theo (Ngay, Stt)
+
+    Gọi sau khi đã khóa hợp đồng; populate_existing để bản đã có trong session
+    (vd: kỳ được chọn theo Stt) nhận giá trị mới nhất.
     """
-    if so_tien <= 0:
-        raise HTTPException(status_code=400, detail="Số tiền thanh toán phải > 0")
+    periods: Dict[str, List[LichSuTraLai]] = {ma_hd: [] for ma_hd in ma_hds}
+    for period in (
+        db.query(LichSuTraLai)
+        .filter(LichSuTraLai.MaHD.in_(ma_hds))
+        .order_by(LichSuTraLai.MaHD, LichSuTraLai.Ngay.asc(), LichSuTraLai.Stt.asc())
+        .populate_existing()
+    ):
+        periods[period.MaHD].append(period)
+    return periods
+
+
+def _allocate_payment(
+    db: Session,
+    contract,
+    db_lich_su: LichSuTraLai,
+    periods: List[LichSuTraLai],
+    so_tien: int,
+) -> Tuple[dict, List[LichSuTraLai], List[Tuple[LichSuTraLai, int]]]:
+    """
+    Phân bổ so_tien từ kỳ db_lich_su trở đi, trong bộ nhớ (không flush, không commit)
 
-    db_lich_su = get_lich_su(db, stt)
-    if not db_lich_su:
-        raise HTTPException(status_code=404, detail="Không tìm thấy bản ghi lịch sử")
+    Args:
+        contract: Hợp đồng đã khóa (lock_contract)
+        db_lich_su: Kỳ được chọn
+        periods: Mọi kỳ của hợp đồng theo (Ngay, Stt) (_load_periods_for_payment)
+        so_tien: Số tiền thanh toán (> 0)
 
+    Returns:
+        (kết quả như pay_lich_su,
+         các kỳ mới tạo khi trả trước tín chấp - đã db.add_all,
+         [(kỳ, số tiền vào kỳ)] để ghi payment_allocation)
+    """
     ma_hd = db_lich_su.MaHD
+    new_periods: List[LichSuTraLai] = []
+    allocations: List[Tuple[LichSuTraLai, int]] = []
 
-    so_tien_con_lai_de_phan_bo = so_tien
-    tong_da_thanh_toan = 0
-
-    if "TC" in ma_hd:
+    if isinstance(contract, TinChap):
         # Tín Chấp: có thể chưa tồn tại bản ghi tương lai; tạo dần theo KyDong và phân bổ
-        contract = db.query(TinChap).filter(TinChap.MaHD == ma_hd).first()
-        if not contract:
-            raise HTTPException(status_code=404, detail=f"Không tìm thấy hợp đồng {ma_hd}")
-
-        current_date = db_lich_su.Ngay
-        ky_dong_days = contract.KyDong or 1
+        step = timedelta(days=contract.KyDong or 1)
         daily_interest = contract.LaiSuat or 0
-        ky_so = 1  # Initialize period number
-        is_first_period = True  # Track if this is the first period (selected period)
 
-        # Cộng dồn nội dung cho bản ghi được chọn (STT)
-        if "Số tiền thanh toán" in db_lich_su.NoiDung:
-            db_lich_su.NoiDung += f" + {so_tien:,} VNĐ"
-        else:
-            db_lich_su.NoiDung += f" |Số tiền thanh toán: {so_tien:,} VNĐ"
-
-        while so_tien_con_lai_de_phan_bo > 0:
-            # Tìm hoặc tạo bản ghi cho current_date
-            period = (
-                db.query(LichSuTraLai)
-                .filter(LichSuTraLai.MaHD == ma_hd, LichSuTraLai.Ngay == current_date)
-                .first()
-            )
-            # nếu không có bản ghi thì tạo bản ghi mới
-            if not period:
-                if is_first_period:
-                    # Kỳ đầu tiên: ghi tổng số tiền thanh toán
-                    period = LichSuTraLai(
-                        MaHD=ma_hd,
-                        Ngay=current_date,
-                        SoTien=daily_interest,
-                        NoiDung=f"Trả lãi kỳ {ky_so}. Số tiền thanh toán: {so_tien}",
-                        TrangThaiThanhToan=TrangThaiThanhToan.CHUA_THANH_TOAN.value,
-                        TrangThaiNgayThanhToan=(
-                            TrangThaiNgayThanhToan.CHUA_DEN_HAN.value
-                            if current_date > date.today()
-                            else (
-                                TrangThaiNgayThanhToan.DEN_HAN.value
-                                if current_date == date.today()
-                                else TrangThaiNgayThanhToan.QUA_HAN.value
-                            )
-                        ),
-                        TienDaTra=0,
-                    )
-                else:
-                    # Các kỳ sau: chỉ ghi lãi đã được trả
-                    period = LichSuTraLai(
-                        MaHD=ma_hd,
-                        Ngay=current_date,
-                        SoTien=daily_interest,
-                        NoiDung=f"Lãi đã được trả vào ngày {date.today().isoformat()}",
-                        TrangThaiThanhToan=TrangThaiThanhToan.CHUA_THANH_TOAN.value,
-                        TrangThaiNgayThanhToan=(
-                            TrangThaiNgayThanhToan.CHUA_DEN_HAN.value
-                            if current_date > date.today()
-                            else (
-                                TrangThaiNgayThanhToan.DEN_HAN.value
-                                if current_date == date.today()
-                                else TrangThaiNgayThanhToan.QUA_HAN.value
-                            )
-                        ),
-                        TienDaTra=0,
-                    )
-                db.add(period)
-            
-            con_lai_ky = max(0, period.SoTien - period.TienDaTra)
-            if con_lai_ky > 0:
-                nop_vao_ky = min(so_tien_con_lai_de_phan_bo, con_lai_ky)
-                period.TienDaTra += nop_vao_ky
-                tong_da_thanh_toan += nop_vao_ky
-                so_tien_con_lai_de_phan_bo -= nop_vao_ky
-
-                period.TrangThaiThanhToan = (
-                    TrangThaiThanhToan.DONG_DU.value
-                    if period.TienDaTra >= period.SoTien
-                    else TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value
-                )
-                
-                # Cập nhật NoiDung sau khi đã tính toán nop_vao_ky - cộng dồn nội dung
-                if is_first_period:
-                    # Kỳ đầu tiên: không cần cập nhật vì đã cập nhật ở trên
-                    pass
-                else:
-                    # Các kỳ sau: cộng dồn nội dung thanh toán
-                    if "Số tiền thanh toán" in period.NoiDung:
-                        # Đã có ghi chú thanh toán trước đó, cộng dồn
-                        period.NoiDung += f" + {nop_vao_ky:,} VNĐ"
-                    else:
-                        # Chưa có ghi chú thanh toán, tạo mới
-                        period.NoiDung = f"Lãi đã được trả vào ngày {date.today().isoformat()} |Số tiền thanh toán: {nop_vao_ky:,} VNĐ"
-                
-
-            # Nếu kỳ đã đóng đủ thì tiến sang ngày kế tiếp theo KyDong
-            if period.TienDaTra >= period.SoTien or con_lai_ky == 0:
-                current_date = current_date + timedelta(days=ky_dong_days)
-                ky_so += 1  # Increment period number for next iteration
-                is_first_period = False  # After first period, mark as not first
+        # Chuỗi kỳ từ ngày kỳ được chọn, cách nhau KyDong, tới kỳ cuối đã có;
+        # ngày chưa có kỳ là None (kỳ mới SoTien = LaiSuat, chỉ tạo nếu nhận tiền)
+        periods_by_date = {}
+        for period in periods:
+            if period.Ngay >= db_lich_su.Ngay:
+                periods_by_date.setdefault(period.Ngay, period)
+        last_date = max(periods_by_date, default=db_lich_su.Ngay)
+        chain: List[Optional[LichSuTraLai]] = []
+        current_date = db_lich_su.Ngay
+        while current_date <= last_date:
+            chain.append(periods_by_date.get(current_date))
+            current_date += step
+
+        phan_bo = allocate_waterfall(
+            [period.SoTien if period else daily_interest for period in chain],
+            [period.TienDaTra if period else 0 for period in chain],
+            so_tien,
+            so_tien_ky_them=daily_interest,
+        )
+        tong_da_thanh_toan = phan_bo.da_phan_bo
+
+        # Tạo các kỳ mới nhận tiền (đánh số tiếp theo kỳ liền trước) và ghi kết quả lên từng kỳ
+        ky_thu = None
+        for i in range(phan_bo.chi_so[-1] + 1 if phan_bo.chi_so else 0):
+            period = chain[i] if i < len(chain) else None
+            if period is not None:
+                ky_thu = period.KyThu
             else:
-                # Không đủ để đóng đủ kỳ hiện tại thì dừng
-                break
+                ky_thu = ky_thu + 1 if ky_thu is not None else None
+                if not phan_bo.nop_vao_ky[i]:
+                    continue
+                period = LichSuTraLai(
+                    MaHD=ma_hd,
+                    Ngay=db_lich_su.Ngay + step * i,
+                    SoTien=daily_interest,
+                    NoiDung=f"Trả lãi kỳ {ky_thu}" if ky_thu else f"Lãi đã được trả vào ngày {date.today().isoformat()}",
+                    KyThu=ky_thu,
+                    TienDaTra=0,
+                )
+                new_periods.append(period)
+            if phan_bo.nop_vao_ky[i]:
+                period.TienDaTra = phan_bo.tien_da_tra[i]
+                period.TrangThaiThanhToan = phan_bo.trang_thai[i]
+                allocations.append((period, phan_bo.nop_vao_ky[i]))
+        # Các kỳ mới được INSERT cùng 1 lần flush
+        db.add_all(new_periods)
         contract.TrangThai = TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value
     
-    elif "TG" in ma_hd:
+    else:
         # Trả Góp: đã có lịch thanh toán đầy đủ → phân bổ trên các bản ghi tương lai sẵn có
-        contract = db.query(TraGop).filter(TraGop.MaHD == ma_hd).first()
-        if not contract:
-            raise HTTPException(status_code=404, detail=f"Không tìm thấy hợp đồng {ma_hd}")
-        
-        # Cộng dồn nội dung cho bản ghi được chọn (STT) - Trả Góp
-        if "Số tiền thanh toán" in db_lich_su.NoiDung:
-            db_lich_su.NoiDung += f" + {so_tien:,} VNĐ"
-        else:
-            db_lich_su.NoiDung += f" |Số tiền thanh toán: {so_tien:,} VNĐ"
-        
-        future_periods: List[LichSuTraLai] = (
-            db.query(LichSuTraLai)
-            .filter(
-        LichSuTraLai.MaHD == ma_hd,
-                LichSuTraLai.Ngay >= db_lich_su.Ngay,
-            )
-            .order_by(LichSuTraLai.Ngay.asc())
-            .all()
-        )
+        future_periods = [period for period in periods if period.Ngay >= db_lich_su.Ngay]
 
         if not future_periods:
             raise HTTPException(status_code=400, detail="Không có kỳ nào để thanh toán")
 
-        is_first_period = True  # Track if this is the first period (selected period)
-        
-        for period in future_periods:
-            if so_tien_con_lai_de_phan_bo <= 0:
-                break
-
-            con_lai_ky = max(0, period.SoTien - period.TienDaTra)
-            if con_lai_ky <= 0:
-                continue
-
-            nop_vao_ky = min(so_tien_con_lai_de_phan_bo, con_lai_ky)
-            period.TienDaTra += nop_vao_ky
-            tong_da_thanh_toan += nop_vao_ky
-            so_tien_con_lai_de_phan_bo -= nop_vao_ky
-
-            # Cập nhật trạng thái thanh toán kỳ
-            if period.TienDaTra >= period.SoTien:
-                period.TrangThaiThanhToan = TrangThaiThanhToan.DONG_DU.value
-            else:
-                period.TrangThaiThanhToan = TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value
-            
-            # Cộng dồn nội dung thanh toán cho Trả Góp
-            if is_first_period:
-                # Kỳ đầu tiên: không cần cập nhật vì đã cập nhật ở trên
-                is_first_period = False
-            else:
-                # Các kỳ sau: cộng dồn nội dung thanh toán
-                noi_dung_lai = f"Lãi đã được trả vào ngày {date.today().isoformat()} |Số tiền thanh toán: {nop_vao_ky:,} VNĐ"
-                if "Số tiền thanh toán" in period.NoiDung:
-                    # Đã có ghi chú thanh toán trước đó, cộng dồn
-                    period.NoiDung += f" + {nop_vao_ky:,} VNĐ"
-                else:
-                    # Chưa có ghi chú thanh toán, tạo mới
-                    period.NoiDung += f" |{noi_dung_lai}"
-
-    # Kiểm tra tất toán: nếu tổng đã trả >= tổng cần trả
-    if "TG" in ma_hd:
+        # Còn kỳ chưa trả đủ hay không: xét trên dữ liệu trước lần phân bổ này
+        any_unpaid = any(period.SoTien > period.TienDaTra for period in periods)
+
+        phan_bo = allocate_waterfall(
+            [period.SoTien for period in future_periods],
+            [period.TienDaTra for period in future_periods],
+            so_tien,
+        )
+        allocations = _apply_allocation(future_periods, phan_bo)
+        tong_da_thanh_toan = phan_bo.da_phan_bo
+        # Kiểm tra tất toán: nếu tổng đã trả >= tổng cần trả
         # Trả Góp: tổng số tiền của tất cả các kỳ trong lịch sử
         tong_can_tra = contract.SoTienVay + contract.LaiSuat
         
@@ -785,49 +520,213 @@ def pay_lich_su(db: Session, stt: int, so_tien: int) -> dict:
         
         if tong_da_tra >= tong_can_tra:
             contract.TrangThai = TrangThaiThanhToan.DA_TAT_TOAN.value
-    # Cập nhật trạng thái hợp đồng dựa trên tổng còn nợ trong lịch sử (nếu chưa tất toán)
-    if contract and contract.TrangThai != TrangThaiThanhToan.DA_TAT_TOAN.value and "TG" in ma_hd:
-        any_unpaid = db.query(LichSuTraLai).filter(
-            LichSuTraLai.MaHD == ma_hd,
-            LichSuTraLai.SoTien > LichSuTraLai.TienDaTra
-        ).first() is not None
-
-        contract.TrangThai = (
-            TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value if any_unpaid else TrangThaiThanhToan.DA_TAT_TOAN.value
-        )
-
-    db.commit()
-
-    # Tạo bản ghi lịch sử cho việc thanh toán (sau khi commit thành công)
-    if "TC" in ma_hd:
-        create_lich_su_utils(db, 
-            ma_hd=ma_hd, 
-            ho_ten=contract.HoTen, 
-            ngay=date.today(), 
-            so_tien=so_tien, 
-            hanh_dong="Thanh toán lãi hợp đồng tín chấp", 
-            loai_hop_dong="TC")
-    elif "TG" in ma_hd:
-        create_lich_su_utils(db, 
-            ma_hd=ma_hd, 
-            ho_ten=contract.HoTen, 
-            ngay=date.today(), 
-            so_tien=so_tien, 
-            hanh_dong="Thanh toán lãi hợp đồng trả góp", 
-            loai_hop_dong="TG")
-    else:
-        raise HTTPException(status_code=400, detail=f"Mã hợp đồng không hợp lệ: {ma_hd}")
+        # Cập nhật trạng thái hợp đồng dựa trên tổng còn nợ trong lịch sử (nếu chưa tất toán)
+        if contract.TrangThai != TrangThaiThanhToan.DA_TAT_TOAN.value:
+            contract.TrangThai = (
+                TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value if any_unpaid else TrangThaiThanhToan.DA_TAT_TOAN.value
+            )
 
-    return {
+    result = {
         "success": True,
         "ma_hd": ma_hd,
-        "stt": stt,
+        "stt": db_lich_su.Stt,
         "da_thanh_toan": tong_da_thanh_toan,
         "so_tien_con_du": so_tien - tong_da_thanh_toan,
-        "trang_thai_hop_dong": contract.TrangThai if contract else None,
+        "trang_thai_hop_dong": contract.TrangThai,
     }
+    return result, new_periods, allocations
 
 
+def _apply_allocation(periods: List[LichSuTraLai], phan_bo: PhanBoThanhToan) -> List[Tuple[LichSuTraLai, int]]:
+    """Ghi TienDaTra / TrangThaiThanhToan mới lên các kỳ nhận tiền, trả về [(kỳ, số tiền vào kỳ)]"""
+    allocations = []
+    for i in phan_bo.chi_so:
+        period = periods[i]
+        period.TienDaTra = phan_bo.tien_da_tra[i]
+        period.TrangThaiThanhToan = phan_bo.trang_thai[i]
+        allocations.append((period, phan_bo.nop_vao_ky[i]))
+    return allocations
+
+
+def _record_payments(db: Session, payments: List[Tuple[dict, List[Tuple[LichSuTraLai, int]]]]) -> List[int]:
+    """
+    Ghi nhật ký lich_su của các lần thanh toán và phân bổ của chúng (không commit)
+
+    1 INSERT ... RETURNING id cho nhật ký, 1 INSERT nhiều dòng cho payment_allocation.
+    Gọi sau flush: các kỳ mới tạo đã có Stt.
+
+    Args:
+        payments: [(dòng nhật ký lich_su, [(kỳ, số tiền vào kỳ)])]
+
+    Returns:
+        id nhật ký của từng lần thanh toán, theo thứ tự payments
+    """
+    if not payments:
+        return []
+    lich_su_ids = db.execute(
+        insert(LichSu.__table__).returning(LichSu.__table__.c.id, sort_by_parameter_order=True),
+        [audit_row for audit_row, _ in payments],
+    ).scalars().all()
+    thoi_gian = datetime.now()
+    crud_payment_allocation.create_payment_allocations(db, [
+        {"LichSuId": lich_su_id, "Stt": period.Stt, "MaHD": period.MaHD, "SoTien": so_tien, "ThoiGian": thoi_gian}
+        for lich_su_id, (_, allocations) in zip(lich_su_ids, payments)
+        for period, so_tien in allocations
+    ])
+    return lich_su_ids
+
+
+def _audit_row(contract, loai: str, so_tien: int, hanh_dong: str) -> dict:
+    """Dòng nhật ký lich_su cho 1 lần thanh toán"""
+    return {
+        "ma_hd": contract.MaHD,
+        "ho_ten": contract.HoTen,
+        "ngay": date.today(),
+        "so_tien": so_tien,
+        "hanh_dong": hanh_dong,
+        "loai_hop_dong": loai,
+    }
+
+
+@retry_on_stale_data
+def pay_lich_su(db: Session, stt: int, so_tien: int) -> dict:
+    """
+    Thanh toán lịch sử trả lãi theo chuẩn logic:
+    - Chỉ cho phép thanh toán kỳ "Đến hạn" (DEN_HAN)
+    - Không cho phép trả vượt quá số tiền còn lại của kỳ
+    - Cập nhật trạng thái kỳ: DONG_DU hoặc THANH_TOAN_MOT_PHAN
+    - Cập nhật trạng thái HĐ: nếu còn kỳ chưa trả đủ => THANH_TOAN_MOT_PHAN; nếu tất cả đã đủ => DA_TAT_TOAN
+    - Khóa dòng hợp đồng (FOR UPDATE) tới khi commit (unit_of_work của request): các lần
+      thanh toán đồng thời trên cùng hợp đồng chạy lần lượt, không ghi đè TienDaTra của nhau
+    - Số tiền vào từng kỳ được ghi vào payment_allocation (NoiDung giữ nhãn ngắn)
+    """
+    if so_tien <= 0:
+        raise HTTPException(status_code=400, detail="Số tiền thanh toán phải > 0")
+
+    db_lich_su = get_lich_su(db, stt)
+    if not db_lich_su:
+        raise HTTPException(status_code=404, detail="Không tìm thấy bản ghi lịch sử")
+
+    ma_hd = db_lich_su.MaHD
+    loai = _loai_hop_dong(ma_hd)
+    model, hanh_dong = _PAY_CONTRACT_TYPES[loai]
+    contract = lock_contract(db, model, ma_hd)
+    if not contract:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy hợp đồng {ma_hd}")
+    # Đọc các kỳ sau khi có lock (kỳ được chọn có thể vừa được lần thanh toán khác cập nhật)
+    periods = _load_periods_for_payment(db, [ma_hd])[ma_hd]
+
+    result, _, allocations = _allocate_payment(db, contract, db_lich_su, periods, so_tien)
+    db.flush()
+
+    # Nhật ký lich_su và phân bổ theo kỳ, cùng transaction với thanh toán
+    result["lich_su_id"] = _record_payments(db, [(_audit_row(contract, loai, so_tien, hanh_dong), allocations)])[0]
+    run_after_commit(db, invalidate_projection)
+
+    return result
+
+
+@retry_on_stale_data
+def pay_lich_su_batch(db: Session, items: List[LichSuTraLaiPayItem]) -> dict:
+    """
+    Thanh toán nhiều khoản trong 1 transaction (cuối ngày chi nhánh nhập các khoản đã thu)
+
+    - Mỗi khoản theo Stt (kỳ được chọn) hoặc MaHD (kỳ sớm nhất còn nợ, hết nợ thì kỳ cuối)
+    - Khóa mọi hợp đồng liên quan 1 lần (theo thứ tự MaHD) và nạp mọi kỳ của chúng trong
+      1 query; phân bổ như pay_lich_su, lần lượt theo thứ tự khoản
+    - Mỗi khoản chạy trong 1 SAVEPOINT: khoản lỗi chỉ bị rollback một mình
+    - Nhật ký lich_su và payment_allocation của các khoản thành công được ghi bằng
+      1 INSERT mỗi bảng; caller commit 1 lần cho cả batch
+
+    Returns:
+        dict: {"success", "succeeded", "failed", "total_paid", "items": [kết quả từng khoản]}
+    """
+    selected_stts = [item.Stt for item in items if item.Stt is not None]
+    selected = {
+        period.Stt: period
+        for period in db.query(LichSuTraLai).filter(LichSuTraLai.Stt.in_(selected_stts))
+    } if selected_stts else {}
+
+    # Xác định hợp đồng của từng khoản; lỗi ở bước này ghi thẳng vào kết quả
+    targets: List[Tuple[Optional[str], Optional[HTTPException]]] = []
+    for item in items:
+        if item.Stt is not None and item.Stt not in selected:
+            targets.append((None, HTTPException(status_code=404, detail="Không tìm thấy bản ghi lịch sử")))
+            continue
+        ma_hd = item.MaHD if item.Stt is None else selected[item.Stt].MaHD
+        try:
+            _loai_hop_dong(ma_hd)
+        except HTTPException as e:
+            targets.append((ma_hd, e))
+            continue
+        targets.append((ma_hd, None))
+
+    contracts = {}
+    ma_hds = sorted({ma_hd for ma_hd, error in targets if error is None})
+    for loai, (model, _) in _PAY_CONTRACT_TYPES.items():
+        contracts.update(lock_contracts(db, model, [ma_hd for ma_hd in ma_hds if _loai_hop_dong(ma_hd) == loai]))
+    periods = _load_periods_for_payment(db, list(contracts))
+
+    results = []
+    payments = []  # (kết quả khoản, (dòng nhật ký, phân bổ))
+    for index, (item, (ma_hd, error)) in enumerate(zip(items, targets)):
+        outcome = {"index": index, "stt": item.Stt, "ma_hd": ma_hd, "so_tien": item.SoTien}
+        if error is None and ma_hd not in contracts:
+            error = HTTPException(status_code=404, detail=f"Không tìm thấy hợp đồng {ma_hd}")
+        if error is None:
+            contract = contracts[ma_hd]
+            contract_periods = periods[ma_hd]
+            if item.Stt is not None:
+                db_lich_su = selected[item.Stt]
+            else:
+                db_lich_su = next(
+                    (period for period in contract_periods if period.SoTien > period.TienDaTra),
+                    contract_periods[-1] if contract_periods else None,
+                )
+            if db_lich_su is None:
+                error = HTTPException(status_code=400, detail="Không có kỳ nào để thanh toán")
+        if error is not None:
+            results.append({**outcome, "success": False, "status_code": error.status_code, "error": error.detail})
+            continue
+
+        savepoint = db.begin_nested()
+        try:
+            result, new_periods, allocations = _allocate_payment(db, contract, db_lich_su, contract_periods, item.SoTien)
+            db.flush()
+            savepoint.commit()
+        except StaleDataError:
+            raise
+        except HTTPException as e:
+            savepoint.rollback()
+            results.append({**outcome, "success": False, "status_code": e.status_code, "error": e.detail})
+            continue
+        except Exception as e:
+            savepoint.rollback()
+            results.append({**outcome, "success": False, "status_code": 500, "error": str(e)})
+            continue
+        if new_periods:
+            contract_periods.extend(new_periods)
+            contract_periods.sort(key=lambda period: (period.Ngay, period.Stt))
+        results.append({**outcome, **result})
+        loai = _loai_hop_dong(ma_hd)
+        payments.append((results[-1], (_audit_row(contract, loai, item.SoTien, _PAY_CONTRACT_TYPES[loai][1]), allocations)))
+
+    lich_su_ids = _record_payments(db, [payment for _, payment in payments])
+    for (result, _), lich_su_id in zip(payments, lich_su_ids):
+        result["lich_su_id"] = lich_su_id
+    run_after_commit(db, invalidate_projection)
+
+    succeeded = [result for result in results if result["success"]]
+    return {
+        "success": len(succeeded) == len(results),
+        "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "total_paid": sum(result["da_thanh_toan"] for result in succeeded),
+        "items": results,
+    }
+
+
+@retry_on_stale_data
 def tat_toan_hop_dong(db: Session, ma_hd: str, tien_lai: int = 0) -> dict:
     """
     Tất toán hợp đồng cho cả Trả Góp và Tín Chấp.
@@ -841,76 +740,43 @@ def tat_toan_hop_dong(db: Session, ma_hd: str, tien_lai: int = 0) -> dict:
         loai = None
         if "TG" in ma_hd:
             loai = "TG"
-            contract = db.query(TraGop).filter(TraGop.MaHD == ma_hd).first()
+            contract = lock_contract(db, TraGop, ma_hd)
         elif "TC" in ma_hd:
             loai = "TC"
-            contract = db.query(TinChap).filter(TinChap.MaHD == ma_hd).first()
+            contract = lock_contract(db, TinChap, ma_hd)
         else:
             raise HTTPException(status_code=400, detail=f"Mã hợp đồng không hợp lệ: {ma_hd}")
 
         if not contract:
             raise HTTPException(status_code=404, detail=f"Không tìm thấy hợp đồng {ma_hd}")
 
-        # 2. Tính tổng lãi còn nợ (chỉ tính các kỳ không quá hạn)
-        total_interest_due = 0
-        lich_sus_all = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == ma_hd).all()
-        for ls in lich_sus_all:
-            if ls.TrangThaiNgayThanhToan != TrangThaiNgayThanhToan.QUA_HAN.value:
-                total_interest_due += max(0, (ls.SoTien or 0) - (ls.TienDaTra or 0))
-
-        # 3. Xử lý phân bổ tiền lãi nếu có
+        # 2. Các kỳ không quá hạn (theo Ngay) và tổng lãi còn nợ của chúng
+        qua_han = TrangThaiNgayThanhToan.QUA_HAN.value
+        periods = [
+            period
+            for period in _load_periods_for_payment(db, [ma_hd])[ma_hd]
+            if period.TrangThaiNgayThanhToan != qua_han
+        ]
+        total_interest_due = sum(max(0, (period.SoTien or 0) - (period.TienDaTra or 0)) for period in periods)
+
+        # 3. Xử lý phân bổ tiền lãi nếu có: tiền lãi < còn nợ thì phân bổ một phần từ
+        # các kỳ sớm đến muộn, ngược lại mọi kỳ không quá hạn được đóng đủ
         histories_updated = 0
+        allocations: List[Tuple[LichSuTraLai, int]] = []
         if tien_lai and tien_lai > 0:
-            if tien_lai < total_interest_due:
-                # Phân bổ một phần tiền lãi
-                so_tien_con_lai_de_phan_bo = tien_lai
-
-                # Ưu tiên từ các kỳ sớm đến muộn, không lấy quá hạn
-                periods = (
-                    db.query(LichSuTraLai)
-                    .filter(
-                        LichSuTraLai.MaHD == ma_hd,
-                        LichSuTraLai.TrangThaiNgayThanhToan != TrangThaiNgayThanhToan.QUA_HAN.value,
-                    )
-                    .order_by(LichSuTraLai.Ngay.asc())
-                    .all()
-                )
-
-                for period in periods:
-                    if so_tien_con_lai_de_phan_bo <= 0:
-                        break
-                    con_lai_ky = max(0, (period.SoTien or 0) - (period.TienDaTra or 0))
-                    if con_lai_ky <= 0:
-                        continue
-                    nop_vao_ky = min(so_tien_con_lai_de_phan_bo, con_lai_ky)
-                    period.TienDaTra = (period.TienDaTra or 0) + nop_vao_ky
-                    so_tien_con_lai_de_phan_bo -= nop_vao_ky
-                    period.TrangThaiThanhToan = (
-                        TrangThaiThanhToan.DONG_DU.value
-                        if period.TienDaTra >= period.SoTien
-                        else TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value
-                    )
-                    # Cập nhật nội dung cộng dồn
-                    if period.NoiDung and "Số tiền thanh toán" in period.NoiDung:
-                        period.NoiDung += f" + {nop_vao_ky:,} VNĐ"
-                    else:
-                        period.NoiDung = (period.NoiDung or "") + f" |Số tiền thanh toán: {nop_vao_ky:,} VNĐ"
-                    histories_updated += 1
-            else:
+            phan_bo = allocate_waterfall(
+                [period.SoTien or 0 for period in periods],
+                [period.TienDaTra or 0 for period in periods],
+                min(tien_lai, total_interest_due),
+            )
+            allocations = _apply_allocation(periods, phan_bo)
+            histories_updated = len(allocations)
+            if tien_lai >= total_interest_due:
                 # Tất toán đầy đủ - cập nhật tất cả các kỳ không quá hạn
-                periods = (
-                    db.query(LichSuTraLai)
-                    .filter(
-                        LichSuTraLai.MaHD == ma_hd,
-                        LichSuTraLai.TrangThaiNgayThanhToan != TrangThaiNgayThanhToan.QUA_HAN.value,
-                    )
-                    .all()
-                )
-
                 for period in periods:
                     period.TienDaTra = period.SoTien
                     period.TrangThaiThanhToan = TrangThaiThanhToan.DONG_DU.value
-                    histories_updated += 1
+                histories_updated = len(periods)
 
         # 4. Cập nhật trạng thái hợp đồng
         contract.TrangThai = TrangThaiThanhToan.DA_TAT_TOAN.value
@@ -919,41 +785,26 @@ def tat_toan_hop_dong(db: Session, ma_hd: str, tien_lai: int = 0) -> dict:
             tien_con_lai = contract.SoTienVay - contract.SoTienTraGoc
             contract.SoTienTraGoc = tien_con_lai
 
-        # 5. Cập nhật nội dung lịch sử hôm nay
+        # 5. Nhãn kỳ hôm nay (số tiền gốc / lãi nằm trong nhật ký lich_su và payment_allocation)
         db_lich_su_tra_lai_today = db.query(LichSuTraLai).filter(
             LichSuTraLai.MaHD == ma_hd, 
             LichSuTraLai.Ngay == date.today()
         ).first()
         
         if db_lich_su_tra_lai_today:
-            if loai == "TC":
-                noi_dung_tat_toan = f'''Tất toán: [Tiền Gốc: {tien_con_lai:,} VNĐ & Tiền lãi: {tien_lai:,} VNĐ] | {db_lich_su_tra_lai_today.NoiDung}'''
-            else:
-                noi_dung_tat_toan = f"Tất toán: {tien_lai:,} VNĐ | {db_lich_su_tra_lai_today.NoiDung}"
-            db_lich_su_tra_lai_today.NoiDung = noi_dung_tat_toan
-
-        db.commit()
+            ky_thu = db_lich_su_tra_lai_today.KyThu
+            db_lich_su_tra_lai_today.NoiDung = f"Tất toán kỳ {ky_thu}" if ky_thu else "Tất toán"
+        db.flush()
 
-        # Tạo bản ghi lịch sử cho việc tất toán hợp đồng
+        # Nhật ký tất toán và phân bổ tiền lãi, cùng transaction với tất toán
         if loai == "TC":
             # Tín chấp: lãi + gốc còn lại
-            so_tien_tat_toan = tien_lai + tien_con_lai
-            create_lich_su_utils(db, 
-                ma_hd=ma_hd, 
-                ho_ten=contract.HoTen, 
-                ngay=date.today(), 
-                so_tien=so_tien_tat_toan, 
-                hanh_dong="Tất toán hợp đồng tín chấp", 
-                loai_hop_dong="TC")
-        elif loai == "TG":
+            audit_row = _audit_row(contract, "TC", tien_lai + tien_con_lai, "Tất toán hợp đồng tín chấp")
+        else:
             # Trả góp: chỉ lãi
-            create_lich_su_utils(db, 
-                ma_hd=ma_hd, 
-                ho_ten=contract.HoTen, 
-                ngay=date.today(), 
-                so_tien=tien_lai, 
-                hanh_dong="Tất toán hợp đồng trả góp", 
-                loai_hop_dong="TG")
+            audit_row = _audit_row(contract, "TG", tien_lai, "Tất toán hợp đồng trả góp")
+        _record_payments(db, [(audit_row, allocations)])
+        run_after_commit(db, invalidate_projection)
 
         return {
             "success": True,
@@ -964,6 +815,8 @@ def tat_toan_hop_dong(db: Session, ma_hd: str, tien_lai: int = 0) -> dict:
             "contract_status": contract.TrangThai,
         }
 
+    except StaleDataError:
+        # Xung đột Version: để retry_on_stale_data thử lại
+        raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Lỗi khi tất toán hợp đồng: {str(e)}")
\ No newline at end of file
@@ -3,7 +3,7 @@ from app.models.tin_chap import TinChap
 from app.models.lich_su_tra_lai import LichSuTraLai
 from app.models.tra_gop import TraGop
 from app.schemas.no_phai_thu import NoPhaiThuResponse
-from app.schemas.lich_su_tra_lai import LichSuTraLai as LichSuTraLaiSchema
+from app.schemas.lich_su_tra_lai import lich_su_tra_lai_to_dict
 from typing import List
 from datetime import date, timedelta
 from app.core.enums import TrangThaiThanhToan
@@ -45,7 +45,7 @@ def get_no_phai_thus(db: Session, time: str = "today") -> List[NoPhaiThuResponse
 
             # Fetch history
             lich_sus = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == ma_hd).all()
-            lich_su_schemas = [LichSuTraLaiSchema.model_validate(ls).model_dump() for ls in lich_sus]
+            lich_su_schemas = [lich_su_tra_lai_to_dict(ls) for ls in lich_sus]
 
             # Compute today's payment aggregates only
             today = date.today()
@@ -83,7 +83,7 @@ def get_no_phai_thus(db: Session, time: str = "today") -> List[NoPhaiThuResponse
             trang_thai_ngay_thanh_toan = lich_sus[-1].TrangThaiNgayThanhToan if lich_sus else ""
 
             results.append(
-                NoPhaiThuResponse(
+                NoPhaiThuResponse.model_construct(
                     MaHD=ma_hd,
                     HoTen=ho_ten,
                     NgayVay=ngay_vay,
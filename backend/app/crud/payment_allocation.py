@@ -0,0 +1,49 @@
+"""
+CRUD operations for PaymentAllocation
+"""
+from typing import List
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app.models.payment_allocation import PaymentAllocation
+
+
+def create_payment_allocations(db: Session, rows: List[dict]) -> None:
+    """
+    Ghi các dòng phân bổ bằng 1 INSERT nhiều dòng (không commit)
+
+    Args:
+        rows: [{"LichSuId", "Stt", "MaHD", "SoTien", "ThoiGian"}]
+    """
+    if rows:
+        db.execute(insert(PaymentAllocation.__table__), rows)
+
+
+def get_allocations_by_contract(db: Session, ma_hd: str, skip: int = 0, limit: int = 100) -> List[PaymentAllocation]:
+    """Phân bổ của 1 hợp đồng, mới nhất trước (index MaHD, ThoiGian)"""
+    return db.execute(
+        select(PaymentAllocation)
+        .where(PaymentAllocation.MaHD == ma_hd)
+        .order_by(PaymentAllocation.ThoiGian.desc(), PaymentAllocation.Id.desc())
+        .offset(skip)
+        .limit(limit)
+    ).scalars().all()
+
+
+def get_allocations_by_period(db: Session, stt: int) -> List[PaymentAllocation]:
+    """Các lần thanh toán đã vào kỳ Stt, theo thứ tự thời gian (index Stt)"""
+    return db.execute(
+        select(PaymentAllocation)
+        .where(PaymentAllocation.Stt == stt)
+        .order_by(PaymentAllocation.ThoiGian, PaymentAllocation.Id)
+    ).scalars().all()
+
+
+def get_allocations_by_payment(db: Session, lich_su_id: int) -> List[PaymentAllocation]:
+    """Các kỳ mà 1 lần thanh toán (id nhật ký lich_su) đã được phân bổ vào (index LichSuId)"""
+    return db.execute(
+        select(PaymentAllocation)
+        .where(PaymentAllocation.LichSuId == lich_su_id)
+        .order_by(PaymentAllocation.Id)
+    ).scalars().all()
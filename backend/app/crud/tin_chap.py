@@ -2,42 +2,39 @@
 CRUD operations for TinChap
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import or_, func
 from typing import List, Optional
 from datetime import date
 
 from app.models.tin_chap import TinChap
 from app.models.lich_su_tra_lai import LichSuTraLai
+from app.core.database import run_after_commit
+from app.services.projection import invalidate_projection
 from app.schemas.tin_chap import TinChapCreate, TinChapUpdate, TinChapResponse
-from app.schemas.lich_su_tra_lai import LichSuTraLai as LichSuTraLaiSchema
+from app.schemas.lich_su_tra_lai import lich_su_tra_lai_to_dict
 from app.core.enums import TrangThaiThanhToan
 from app.utils.lich_su import create_lich_su, delete_lich_su
+from app.utils.etag import build_etag, lich_su_version_subquery
+from app.utils.concurrency import lock_contract, retry_on_stale_data
 
 
-def _calculate_payment_info(db: Session, ma_hd: str) -> dict:
+def _calculate_payment_info(tin_chap: TinChap, lich_sus: List[LichSuTraLai]) -> dict:
     """
-    Calculate payment information for a TinChap contract
+    Calculate payment information for a TinChap contract from its loaded history
     
     Args:
-        db: Database session
-        ma_hd: Contract ID
+        tin_chap: TinChap contract
+        lich_sus: All payment history rows of the contract
         
     Returns:
         dict: Payment information including LaiDaTra, GocConLai, LaiConLai
     """
-    # Get all payment history for this contract
-    lich_sus = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == ma_hd).all()
-    
     # Calculate total interest paid
     lai_da_tra = sum(ls.TienDaTra for ls in lich_sus)
     
     # For TinChap, the remaining principal is the original loan amount
     # since TinChap only pays interest, not principal
-    tin_chap = db.query(TinChap).filter(TinChap.MaHD == ma_hd).first()
-    if tin_chap:
-        goc_con_lai = tin_chap.SoTienVay - tin_chap.SoTienTraGoc  # SoTienVay - SoTienTraGoc
-    else:
-        goc_con_lai = 0
+    goc_con_lai = tin_chap.SoTienVay - tin_chap.SoTienTraGoc  # SoTienVay - SoTienTraGoc
     
     # Calculate remaining interest
     # Total interest should be calculated based on the contract terms
@@ -52,6 +49,70 @@ def _calculate_payment_info(db: Session, ma_hd: str) -> dict:
     }
 
 
+def build_tin_chap_response(tin_chap: TinChap, lich_sus: List[LichSuTraLai]) -> TinChapResponse:
+    """
+    Build the TinChap detail response from already loaded rows (no queries)
+    
+    Args:
+        tin_chap: TinChap contract
+        lich_sus: All payment history rows of the contract
+        
+    Returns:
+        TinChapResponse object
+    """
+    payment_info = _calculate_payment_info(tin_chap, lich_sus)
+    return TinChapResponse.model_construct(
+        MaHD=tin_chap.MaHD,
+        HoTen=tin_chap.HoTen,
+        NgayVay=tin_chap.NgayVay,
+        SoTienVay=tin_chap.SoTienVay,
+        KyDong=tin_chap.KyDong,
+        LaiSuat=tin_chap.LaiSuat,
+        SoTienTraGoc=tin_chap.SoTienTraGoc,
+        TrangThai=tin_chap.TrangThai,
+        LichSuTraLai=[lich_su_tra_lai_to_dict(ls) for ls in lich_sus],
+        LaiDaTra=payment_info["lai_da_tra"],
+        GocConLai=payment_info["goc_con_lai"],
+        LaiConLai=payment_info["lai_con_lai"]
+    )
+
+
+def _filter_tin_chaps(
+    query,
+    status: Optional[str] = None,
+    search: Optional[str] = None,
+    sort_by: str = "NgayVay",
+    sort_dir: str = "desc",
+    today_only: bool = False,
+):
+    """
+    Apply list filter/search/sort to a TinChap query (shared by list and ETag queries)
+    """
+    if status:
+        query = query.filter(TinChap.TrangThai == status)
+
+    if search:
+        like = f"%{search}%"
+        query = query.filter(or_(TinChap.HoTen.ilike(like), TinChap.MaHD.ilike(like)))
+
+    if today_only:
+        query = query.filter(TinChap.NgayVay == date.today())
+
+    allowed_sort_fields = {
+        "MaHD": TinChap.MaHD,
+        "HoTen": TinChap.HoTen,
+        "NgayVay": TinChap.NgayVay,
+        "SoTienVay": TinChap.SoTienVay,
+        "KyDong": TinChap.KyDong,
+        "LaiSuat": TinChap.LaiSuat,
+        "TrangThai": TinChap.TrangThai,
+    }
+    sort_column = allowed_sort_fields.get(sort_by, TinChap.NgayVay)
+    if sort_dir.lower() == "asc":
+        return query.order_by(sort_column.asc())
+    return query.order_by(sort_column.desc())
+
+
 def get_tin_chap(db: Session, ma_hd: str) -> Optional[TinChap]:
     """
     Get a TinChap contract by MaHD
@@ -70,6 +131,61 @@ def get_tin_chap(db: Session, ma_hd: str) -> Optional[TinChap]:
         raise
 
 
+def get_tin_chap_etag(db: Session, ma_hd: str) -> Optional[str]:
+    """
+    Get the ETag of a TinChap detail response with a single version query
+    
+    Args:
+        db: Database session
+        ma_hd: Contract ID
+        
+    Returns:
+        Weak ETag or None if the contract does not exist
+    """
+    row = (
+        db.query(TinChap.Version, lich_su_version_subquery(TinChap.MaHD))
+        .filter(TinChap.MaHD == ma_hd)
+        .first()
+    )
+    if not row:
+        return None
+    return build_etag("tin_chap", ma_hd, *row)
+
+
+def get_tin_chaps_etag(
+    db: Session,
+    status: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 10,
+    search: Optional[str] = None,
+    sort_by: str = "NgayVay",
+    sort_dir: str = "desc",
+    today_only: bool = False,
+) -> str:
+    """
+    Get the ETag of a TinChap list page with a single version query
+    (same filter/sort/pagination as get_tin_chaps, versions only)
+    """
+    page = max(1, page)
+    page_size = max(1, page_size)
+    query = _filter_tin_chaps(
+        db.query(
+            TinChap.MaHD,
+            TinChap.Version,
+            lich_su_version_subquery(TinChap.MaHD),
+            func.count().over(),
+        ),
+        status, search, sort_by, sort_dir, today_only,
+    )
+    rows = query.offset((page - 1) * page_size).limit(page_size).all()
+    if rows:
+        total = rows[0][3]
+    else:
+        # Trang rỗng: không có window count, đếm riêng
+        total = _filter_tin_chaps(db.query(TinChap), status, search, sort_by, sort_dir, today_only).count()
+    return build_etag("tin_chaps", page, page_size, total, *(tuple(row[:3]) for row in rows))
+
+
 def get_tin_chap_with_history(db: Session, ma_hd: str) -> Optional[TinChapResponse]:
     """
     Get a TinChap contract by MaHD with payment history information
@@ -88,28 +204,8 @@ def get_tin_chap_with_history(db: Session, ma_hd: str) -> Optional[TinChapRespon
         
         # Get payment history for this contract
         lich_sus = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == tin_chap.MaHD).all()
-        lich_su_schemas = [LichSuTraLaiSchema.model_validate(ls).model_dump() for ls in lich_sus]
-        
-        # Calculate payment information
-        payment_info = _calculate_payment_info(db, tin_chap.MaHD)
-        
-        # Create TinChapResponse
-        tin_chap_response = TinChapResponse(
-            MaHD=tin_chap.MaHD,
-            HoTen=tin_chap.HoTen,
-            NgayVay=tin_chap.NgayVay,
-            SoTienVay=tin_chap.SoTienVay,
-            KyDong=tin_chap.KyDong,
-            LaiSuat=tin_chap.LaiSuat,
-            SoTienTraGoc=tin_chap.SoTienTraGoc,
-            TrangThai=tin_chap.TrangThai,
-            LichSuTraLai=lich_su_schemas,
-            LaiDaTra=payment_info["lai_da_tra"],
-            GocConLai=payment_info["goc_con_lai"],
-            LaiConLai=payment_info["lai_con_lai"]
-        )
         
-        return tin_chap_response
+        return build_tin_chap_response(tin_chap, lich_sus)
     except Exception as e:
         raise
 
@@ -128,32 +224,7 @@ def get_tin_chaps(
     Get TinChap contracts with filter/search/sort/pagination and payment history
     """
     try:
-        query = db.query(TinChap)
-
-        if status:
-            query = query.filter(TinChap.TrangThai == status)
-
-        if search:
-            like = f"%{search}%"
-            query = query.filter(or_(TinChap.HoTen.ilike(like), TinChap.MaHD.ilike(like)))
-
-        if today_only:
-            query = query.filter(TinChap.NgayVay == date.today())
-
-        allowed_sort_fields = {
-            "MaHD": TinChap.MaHD,
-            "HoTen": TinChap.HoTen,
-            "NgayVay": TinChap.NgayVay,
-            "SoTienVay": TinChap.SoTienVay,
-            "KyDong": TinChap.KyDong,
-            "LaiSuat": TinChap.LaiSuat,
-            "TrangThai": TinChap.TrangThai,
-        }
-        sort_column = allowed_sort_fields.get(sort_by, TinChap.NgayVay)
-        if sort_dir.lower() == "asc":
-            query = query.order_by(sort_column.asc())
-        else:
-            query = query.order_by(sort_column.desc())
+        query = _filter_tin_chaps(db.query(TinChap), status, search, sort_by, sort_dir, today_only)
 
         # Count BEFORE pagination
         total = query.count()
@@ -166,26 +237,7 @@ def get_tin_chaps(
         results = []
         for tin_chap in tin_chaps:
             lich_sus = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == tin_chap.MaHD).all()
-            lich_su_schemas = [LichSuTraLaiSchema.model_validate(ls).model_dump() for ls in lich_sus]
-
-            payment_info = _calculate_payment_info(db, tin_chap.MaHD)
-
-            results.append(
-                TinChapResponse(
-                    MaHD=tin_chap.MaHD,
-                    HoTen=tin_chap.HoTen,
-                    NgayVay=tin_chap.NgayVay,
-                    SoTienVay=tin_chap.SoTienVay,
-                    KyDong=tin_chap.KyDong,
-                    LaiSuat=tin_chap.LaiSuat,
-                    SoTienTraGoc=tin_chap.SoTienTraGoc,
-                    TrangThai=tin_chap.TrangThai,
-                    LichSuTraLai=lich_su_schemas,
-                    LaiDaTra=payment_info["lai_da_tra"],
-                    GocConLai=payment_info["goc_con_lai"],
-                    LaiConLai=payment_info["lai_con_lai"],
-                )
-            )
+            results.append(build_tin_chap_response(tin_chap, lich_sus))
 
         # Build paginated payload
         total_pages = (total + page_size - 1) // page_size if page_size > 0 else 0
@@ -226,9 +278,6 @@ def create_tin_chap(db: Session, tin_chap: TinChapCreate, ma_hd: str) -> TinChap
         )
         
         db.add(db_tin_chap)
-        db.commit()
-        db.refresh(db_tin_chap)
-
         create_lich_su(db, 
             ma_hd=ma_hd, 
             ho_ten=tin_chap.HoTen, 
@@ -236,11 +285,13 @@ def create_tin_chap(db: Session, tin_chap: TinChapCreate, ma_hd: str) -> TinChap
             so_tien=tin_chap.SoTienVay, 
             hanh_dong="Tạo hợp đồng tín chấp", 
             loai_hop_dong="TC")
+        # Hợp đồng và nhật ký cùng 1 flush (commit ở unit_of_work của request)
+        db.flush()
+        run_after_commit(db, invalidate_projection)
         
         return db_tin_chap
         
     except Exception as e:
-        db.rollback()
         raise
 
 
@@ -267,9 +318,12 @@ def update_tin_chap(db: Session, ma_hd: str, tin_chap_update: TinChapUpdate) ->
         if update_data:
             for key, value in update_data.items():
                 setattr(db_tin_chap, key, value)
+            if "NgayVay" in update_data or "KyDong" in update_data:
+                # Lịch đóng lãi thay đổi: để job cộng dồn tính lại ngày đến hạn
+                db_tin_chap.NgayDenHanTiepTheo = None
             
-            db.commit()
-            db.refresh(db_tin_chap)
+            db.flush()
+            run_after_commit(db, invalidate_projection)
         
         # create_lich_su(db, 
         #     ma_hd=ma_hd, 
@@ -281,7 +335,6 @@ def update_tin_chap(db: Session, ma_hd: str, tin_chap_update: TinChapUpdate) ->
         return db_tin_chap
         
     except Exception as e:
-        db.rollback()
         raise
 
 
@@ -304,12 +357,12 @@ def delete_tin_chap(db: Session, ma_hd: str) -> bool:
         
         delete_lich_su(db, ma_hd=ma_hd)
         db.delete(db_tin_chap)
-        db.commit()
+        db.flush()
+        run_after_commit(db, invalidate_projection)
         
         return True
         
     except Exception as e:
-        db.rollback()
         raise
 
 
@@ -347,9 +400,13 @@ def count_tin_chaps(db: Session) -> int:
     except Exception as e:
         raise
 
+@retry_on_stale_data
 def tra_goc_tin_chap(db: Session, ma_hd: str, so_tien_tra_goc: int) -> bool:
     """
     Trả gốc hợp đồng tín chấp
+
+    Khóa dòng hợp đồng (FOR UPDATE) tới khi commit (unit_of_work của request) để các
+    lần trả gốc đồng thời không ghi đè SoTienTraGoc của nhau
     
     Args:
         db: Database session
@@ -357,41 +414,37 @@ def tra_goc_tin_chap(db: Session, ma_hd: str, so_tien_tra_goc: int) -> bool:
         so_tien_tra_goc: Amount to pay off
         
     Returns:
-        True if successful, False if not found or error
+        True if successful, False if not found
     """
-    try:
-        db_tin_chap = get_tin_chap(db, ma_hd)
-        if not db_tin_chap:
-            return False
-        db_tin_chap.SoTienTraGoc += so_tien_tra_goc
-        db_lich_su_tra_lai_tin_chap = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == ma_hd).all()
-        if db_tin_chap.SoTienTraGoc > db_tin_chap.SoTienVay:
-            # Nếu tổng TienDaTra > SoTien thì thay đổi trạng thái thành DA_TAT_TOAN
-            if sum(ls.TienDaTra for ls in db_lich_su_tra_lai_tin_chap) > db_tin_chap.SoTienVay:
-                db_tin_chap.TrangThai = TrangThaiThanhToan.DA_TAT_TOAN.value
-            else:
-                db_tin_chap.TrangThai = TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value
-        db_lich_su_tra_lai_tin_chap_today = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == ma_hd, LichSuTraLai.Ngay == date.today()).first()
-        if db_lich_su_tra_lai_tin_chap_today:
-            if "Trả gốc" not in db_lich_su_tra_lai_tin_chap_today.NoiDung:
-                db_lich_su_tra_lai_tin_chap_today.NoiDung = f"Trả gốc: {so_tien_tra_goc:,} VNĐ| {db_lich_su_tra_lai_tin_chap_today.NoiDung}"
-            else:
-                noi_dung_ban_dau = db_lich_su_tra_lai_tin_chap_today.NoiDung.split("|")
-                noi_dung_khong_doi = noi_dung_ban_dau[1:]
-                noi_dung_tra_goc_moi = f"{noi_dung_ban_dau[0]} + {so_tien_tra_goc:,} VNĐ"
-                db_lich_su_tra_lai_tin_chap_today.NoiDung = f"{noi_dung_tra_goc_moi} | {'|'.join(noi_dung_khong_doi)}"
-        db.commit()
-        db.refresh(db_tin_chap)
-        db.refresh(db_lich_su_tra_lai_tin_chap_today)
-
-        create_lich_su(db, 
-            ma_hd=ma_hd, 
-            ho_ten=db_tin_chap.HoTen, 
-            ngay= date.today(), 
-            so_tien=so_tien_tra_goc, 
-            hanh_dong="Trả gốc hợp đồng tín chấp", 
-            loai_hop_dong="TC")
-        return True
-    except Exception as e:
-        db.rollback()
-        return False
\ No newline at end of file
+    db_tin_chap = lock_contract(db, TinChap, ma_hd)
+    if not db_tin_chap:
+        return False
+    db_tin_chap.SoTienTraGoc += so_tien_tra_goc
+    db_lich_su_tra_lai_tin_chap = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == ma_hd).all()
+    if db_tin_chap.SoTienTraGoc > db_tin_chap.SoTienVay:
+        # Nếu tổng TienDaTra > SoTien thì thay đổi trạng thái thành DA_TAT_TOAN
+        if sum(ls.TienDaTra for ls in db_lich_su_tra_lai_tin_chap) > db_tin_chap.SoTienVay:
+            db_tin_chap.TrangThai = TrangThaiThanhToan.DA_TAT_TOAN.value
+        else:
+            db_tin_chap.TrangThai = TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value
+    db_lich_su_tra_lai_tin_chap_today = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == ma_hd, LichSuTraLai.Ngay == date.today()).first()
+    if db_lich_su_tra_lai_tin_chap_today:
+        if "Trả gốc" not in db_lich_su_tra_lai_tin_chap_today.NoiDung:
+            db_lich_su_tra_lai_tin_chap_today.NoiDung = f"Trả gốc: {so_tien_tra_goc:,} VNĐ| {db_lich_su_tra_lai_tin_chap_today.NoiDung}"
+        else:
+            noi_dung_ban_dau = db_lich_su_tra_lai_tin_chap_today.NoiDung.split("|")
+            noi_dung_khong_doi = noi_dung_ban_dau[1:]
+            noi_dung_tra_goc_moi = f"{noi_dung_ban_dau[0]} + {so_tien_tra_goc:,} VNĐ"
+            db_lich_su_tra_lai_tin_chap_today.NoiDung = f"{noi_dung_tra_goc_moi} | {'|'.join(noi_dung_khong_doi)}"
+
+    create_lich_su(db, 
+        ma_hd=ma_hd, 
+        ho_ten=db_tin_chap.HoTen, 
+        ngay= date.today(), 
+        so_tien=so_tien_tra_goc, 
+        hanh_dong="Trả gốc hợp đồng tín chấp", 
+        loai_hop_dong="TC")
+    # Hợp đồng, kỳ hôm nay và nhật ký cùng 1 flush
+    db.flush()
+    run_after_commit(db, invalidate_projection)
+    return True
\ No newline at end of file
@@ -2,16 +2,19 @@
 CRUD operations for TraGop
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import or_, func
 from typing import List, Optional
 from datetime import date
 
 from app.core.enums import TrangThaiThanhToan
 from app.models.tra_gop import TraGop
 from app.models.lich_su_tra_lai import LichSuTraLai
+from app.core.database import run_after_commit
+from app.services.projection import invalidate_projection
 from app.schemas.tra_gop import TraGopCreate, TraGopUpdate, TraGopResponse
-from app.schemas.lich_su_tra_lai import LichSuTraLai as LichSuTraLaiSchema
+from app.schemas.lich_su_tra_lai import lich_su_tra_lai_to_dict
 from app.utils.lich_su import create_lich_su, delete_lich_su
+from app.utils.etag import build_etag, lich_su_version_subquery
 
 
 def get_tra_gop(db: Session, ma_hd: str) -> Optional[TraGop]:
@@ -28,30 +31,41 @@ def get_tra_gop(db: Session, ma_hd: str) -> Optional[TraGop]:
     return db.query(TraGop).filter(TraGop.MaHD == ma_hd).first()
 
 
-def _calculate_tg_payment_info(db: Session, ma_hd: str) -> dict:
-    """Calculate total paid and remaining for TraGop from lịch sử."""
-    histories = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == ma_hd).all()
+def _calculate_tg_payment_info(histories: List[LichSuTraLai]) -> dict:
+    """Calculate total paid and remaining for TraGop from its loaded lịch sử."""
     da_thanh_toan = sum(h.TienDaTra for h in histories)
     tong_phai_tra = sum(h.SoTien for h in histories)
     con_lai = max(0, tong_phai_tra - da_thanh_toan)
     return {"da_thanh_toan": da_thanh_toan, "con_lai": con_lai}
 
 
-def get_tra_gops(
-    db: Session,
+def build_tra_gop_response(tg: TraGop, histories: List[LichSuTraLai]) -> TraGopResponse:
+    """Build the TraGop detail response from already loaded rows (no queries)."""
+    totals = _calculate_tg_payment_info(histories)
+    return TraGopResponse.model_construct(
+        MaHD=tg.MaHD,
+        HoTen=tg.HoTen,
+        NgayVay=tg.NgayVay,
+        SoTienVay=tg.SoTienVay,
+        KyDong=tg.KyDong,
+        SoLanTra=tg.SoLanTra,
+        LaiSuat=tg.LaiSuat,
+        TrangThai=tg.TrangThai,
+        LichSuTraLai=[lich_su_tra_lai_to_dict(h) for h in histories],
+        DaThanhToan=totals["da_thanh_toan"],
+        ConLai=totals["con_lai"],
+    )
+
+
+def _filter_tra_gops(
+    query,
     status: Optional[str] = None,
-    page: int = 1,
-    page_size: int = 10,
     search: Optional[str] = None,
     sort_by: str = "NgayVay",
     sort_dir: str = "desc",
     today_only: bool = False,
-) -> dict:
-    """
-    Get TraGop contracts with filter/search/sort/pagination and enrich with lịch sử + totals.
-    """
-    query = db.query(TraGop)
-
+):
+    """Apply list filter/search/sort to a TraGop query (shared by list and ETag queries)."""
     if status:
         query = query.filter(TraGop.TrangThai == status)
 
@@ -74,9 +88,67 @@ def get_tra_gops(
     }
     sort_column = allowed_sort_fields.get(sort_by, TraGop.NgayVay)
     if sort_dir.lower() == "asc":
-        query = query.order_by(sort_column.asc())
+        return query.order_by(sort_column.asc())
+    return query.order_by(sort_column.desc())
+
+
+def get_tra_gop_etag(db: Session, ma_hd: str) -> Optional[str]:
+    """ETag of a TraGop detail response, computed with a single version query."""
+    row = (
+        db.query(TraGop.Version, lich_su_version_subquery(TraGop.MaHD))
+        .filter(TraGop.MaHD == ma_hd)
+        .first()
+    )
+    if not row:
+        return None
+    return build_etag("tra_gop", ma_hd, *row)
+
+
+def get_tra_gops_etag(
+    db: Session,
+    status: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 10,
+    search: Optional[str] = None,
+    sort_by: str = "NgayVay",
+    sort_dir: str = "desc",
+    today_only: bool = False,
+) -> str:
+    """ETag of a TraGop list page (same filter/sort/pagination as get_tra_gops, versions only)."""
+    page = max(1, page)
+    page_size = max(1, page_size)
+    query = _filter_tra_gops(
+        db.query(
+            TraGop.MaHD,
+            TraGop.Version,
+            lich_su_version_subquery(TraGop.MaHD),
+            func.count().over(),
+        ),
+        status, search, sort_by, sort_dir, today_only,
+    )
+    rows = query.offset((page - 1) * page_size).limit(page_size).all()
+    if rows:
+        total = rows[0][3]
     else:
-        query = query.order_by(sort_column.desc())
+        # Trang rỗng: không có window count, đếm riêng
+        total = _filter_tra_gops(db.query(TraGop), status, search, sort_by, sort_dir, today_only).count()
+    return build_etag("tra_gops", page, page_size, total, *(tuple(row[:3]) for row in rows))
+
+
+def get_tra_gops(
+    db: Session,
+    status: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 10,
+    search: Optional[str] = None,
+    sort_by: str = "NgayVay",
+    sort_dir: str = "desc",
+    today_only: bool = False,
+) -> dict:
+    """
+    Get TraGop contracts with filter/search/sort/pagination and enrich with lịch sử + totals.
+    """
+    query = _filter_tra_gops(db.query(TraGop), status, search, sort_by, sort_dir, today_only)
 
     # Count BEFORE pagination
     total = query.count()
@@ -89,23 +161,7 @@ def get_tra_gops(
     results: List[TraGopResponse] = []
     for tg in tra_gops:
         histories = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == tg.MaHD).all()
-        histories_schema = [LichSuTraLaiSchema.model_validate(h).model_dump() for h in histories]
-        totals = _calculate_tg_payment_info(db, tg.MaHD)
-        results.append(
-            TraGopResponse(
-                MaHD=tg.MaHD,
-                HoTen=tg.HoTen,
-                NgayVay=tg.NgayVay,
-                SoTienVay=tg.SoTienVay,
-                KyDong=tg.KyDong,
-                SoLanTra=tg.SoLanTra,
-                LaiSuat=tg.LaiSuat,
-                TrangThai=tg.TrangThai,
-                LichSuTraLai=histories_schema,
-                DaThanhToan=totals["da_thanh_toan"],
-                ConLai=totals["con_lai"],
-            )
-        )
+        results.append(build_tra_gop_response(tg, histories))
 
     total_pages = (total + page_size - 1) // page_size if page_size > 0 else 0
     return {
@@ -123,21 +179,7 @@ def get_tra_gop_with_history(db: Session, ma_hd: str) -> Optional[TraGopResponse
     if not tg:
         return None
     histories = db.query(LichSuTraLai).filter(LichSuTraLai.MaHD == tg.MaHD).all()
-    histories_schema = [LichSuTraLaiSchema.model_validate(h).model_dump() for h in histories]
-    totals = _calculate_tg_payment_info(db, tg.MaHD)
-    return TraGopResponse(
-        MaHD=tg.MaHD,
-        HoTen=tg.HoTen,
-        NgayVay=tg.NgayVay,
-        SoTienVay=tg.SoTienVay,
-        KyDong=tg.KyDong,
-        SoLanTra=tg.SoLanTra,
-        LaiSuat=tg.LaiSuat,
-        TrangThai=tg.TrangThai,
-        LichSuTraLai=histories_schema,
-        DaThanhToan=totals["da_thanh_toan"],
-        ConLai=totals["con_lai"],
-    )
+    return build_tra_gop_response(tg, histories)
 
 
 def create_tra_gop(db: Session, tra_gop: TraGopCreate, ma_hd: str) -> TraGop:
@@ -165,9 +207,6 @@ def create_tra_gop(db: Session, tra_gop: TraGopCreate, ma_hd: str) -> TraGop:
     )
     
     db.add(db_tra_gop)
-    db.commit()
-    db.refresh(db_tra_gop)
-    
     create_lich_su(db, 
         ma_hd=ma_hd, 
         ho_ten=tra_gop.HoTen, 
@@ -175,6 +214,9 @@ def create_tra_gop(db: Session, tra_gop: TraGopCreate, ma_hd: str) -> TraGop:
         so_tien=tra_gop.SoTienVay, 
         hanh_dong="Tạo hợp đồng trả góp", 
         loai_hop_dong="TG")
+    # Hợp đồng và nhật ký cùng 1 flush (commit ở unit_of_work của request)
+    db.flush()
+    run_after_commit(db, invalidate_projection)
     return db_tra_gop
 
 
@@ -205,9 +247,12 @@ def update_tra_gop(db: Session, ma_hd: str, tra_gop_update: TraGopUpdate) -> Opt
     update_data = tra_gop_update.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_tra_gop, key, value)
+    if "NgayVay" in update_data or "KyDong" in update_data:
+        # Lịch đóng lãi thay đổi: để job cộng dồn tính lại ngày đến hạn
+        db_tra_gop.NgayDenHanTiepTheo = None
     
-    db.commit()
-    db.refresh(db_tra_gop)
+    db.flush()
+    run_after_commit(db, invalidate_projection)
     
     return db_tra_gop
 
@@ -229,7 +274,8 @@ def delete_tra_gop(db: Session, ma_hd: str) -> bool:
         return False
     delete_lich_su(db, ma_hd=ma_hd)
     db.delete(db_tra_gop)
-    db.commit()
+    db.flush()
+    run_after_commit(db, invalidate_projection)
     
     return True
 
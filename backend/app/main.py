@@ -4,9 +4,13 @@ Main FastAPI application
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import logging
+import os
 
-from app.core.database import engine, Base
-from app.routers import tin_chap, tra_gop, lich_su_tra_lai, no_phai_thu, dashboard, lich_su
+from app.core.database import engine, Base, upgrade_db
+from app.core.compression import CompressionMiddleware
+from app.core.idempotency import IdempotencyMiddleware
+from app.services.scheduler import scheduler, SCHEDULER_ENABLED
+from app.routers import tin_chap, tra_gop, lich_su_tra_lai, no_phai_thu, dashboard, lich_su, contracts, jobs
 from app.websocket import router as websocket_router
 
 # Configure logging for the application
@@ -19,6 +23,7 @@ logging.basicConfig(
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+upgrade_db()
 
 # Create FastAPI instance
 app = FastAPI(
@@ -29,6 +34,9 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Idempotency-Key for pay / pay-full / tra-goc (innermost: stores the uncompressed body)
+app.add_middleware(IdempotencyMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +44,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotency-Replayed"],
+)
+
+# Compress large JSON payloads (br/gzip, negotiated via Accept-Encoding)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024")),
 )
 
 # Include routers
@@ -45,15 +60,25 @@ app.include_router(lich_su_tra_lai.router)
 app.include_router(no_phai_thu.router)
 app.include_router(dashboard.router)
 app.include_router(lich_su.router)
+app.include_router(contracts.router)
+app.include_router(jobs.router)
 app.include_router(websocket_router)
 # Startup event
 @app.on_event("startup")
 async def startup_event():
-    """Configure logging on startup"""
+    """Configure logging and start the in-app scheduler on startup"""
     logger = logging.getLogger("api_app_credit")
     logger.info("="*60)
     logger.info("🚀 API App Credit Started!")
     logger.info("="*60)
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the in-app job scheduler"""
+    await scheduler.stop()
 
 
 # Root endpoints
@@ -70,6 +95,8 @@ async def root():
             "NoPhaiThu": "/no-phai-thu",
             "Dashboard": "/dashboard",
             "LichSu": "/lich-su",
+            "Contracts": "/contracts",
+            "Jobs": "/jobs",
             "WebSocket": "/ws/{client_id}",
             "WebSocket Status": "/ws/connections"
         },
@@ -4,6 +4,9 @@ Database models package
 from app.models.tin_chap import TinChap
 from app.models.tra_gop import TraGop
 from app.models.lich_su_tra_lai import LichSuTraLai
+from app.models.job_run import JobRun, JobRunCheckpoint, JobExecution
+from app.models.idempotency_key import IdempotencyKey
+from app.models.payment_allocation import PaymentAllocation
 
-__all__ = ["TinChap", "TraGop", "LichSuTraLai"]
+__all__ = ["TinChap", "TraGop", "LichSuTraLai", "JobRun", "JobRunCheckpoint", "JobExecution", "IdempotencyKey", "PaymentAllocation"]
 
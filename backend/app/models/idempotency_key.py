@@ -0,0 +1,26 @@
+"""
+IdempotencyKey model - Kết quả đã lưu của các request chuyển tiền có header Idempotency-Key
+"""
+from sqlalchemy import Column, String, SmallInteger, DateTime, LargeBinary
+from app.core.database import Base
+import datetime
+
+
+class IdempotencyKey(Base):
+    """
+    1 dòng cho mỗi Idempotency-Key: dấu vân tay request và response đã trả
+
+    Dòng được ghi trong cùng transaction với thao tác chuyển tiền (có response ngay).
+    StatusCode NULL chỉ còn ở dòng giữ chỗ của phiên bản trước: request tiếp theo cùng
+    key ghi đè. Dòng quá IDEMPOTENCY_TTL_HOURS bị job idempotency-cleanup xóa.
+    """
+    __tablename__ = "idempotency_keys"
+
+    Key = Column(String(255), primary_key=True)
+    DauVanTay = Column(LargeBinary(32), nullable=False)  # sha256(method, path, query, body)
+    StatusCode = Column(SmallInteger, nullable=True)
+    Response = Column(LargeBinary, nullable=True)  # Body response, nén zlib
+    NgayTao = Column(DateTime, nullable=False, default=datetime.datetime.now, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(Key='{self.Key}', StatusCode={self.StatusCode})>"
@@ -0,0 +1,68 @@
+"""
+JobRun model - Sổ theo dõi các lần chạy job hằng ngày (job-run ledger)
+"""
+from sqlalchemy import Column, Integer, String, Date, DateTime, Text, ForeignKey, UniqueConstraint
+from app.core.database import Base
+import datetime
+
+
+class JobRun(Base):
+    """
+    Một lần chạy job cho một ngày (mỗi TenJob + NgayChay chỉ có 1 dòng)
+    """
+    __tablename__ = "job_runs"
+    __table_args__ = (UniqueConstraint("TenJob", "NgayChay", name="uq_job_runs_ten_job_ngay_chay"),)
+
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    TenJob = Column(String, nullable=False)  # Ví dụ: "accrual"
+    NgayChay = Column(Date, nullable=False, index=True)  # Ngày nghiệp vụ của lần chạy
+    TrangThai = Column(String, nullable=False)  # TrangThaiJob
+    BatDau = Column(DateTime, nullable=False, default=datetime.datetime.now)
+    KetThuc = Column(DateTime, nullable=True)
+    SoLanChay = Column(Integer, nullable=False, default=0)  # Số lần chạy (tăng mỗi lần resume)
+    SoHopDong = Column(Integer, nullable=False, default=0)  # Tổng số hợp đồng cần xử lý
+    SoHopDongXong = Column(Integer, nullable=False, default=0)  # Số hợp đồng đã có checkpoint
+    SoBanGhiTao = Column(Integer, nullable=False, default=0)
+    SoBanGhiCapNhat = Column(Integer, nullable=False, default=0)
+    SoLoi = Column(Integer, nullable=False, default=0)  # Số hợp đồng lỗi ở lần chạy gần nhất
+    ChiSo = Column(Text, nullable=True)  # JSON đo đạc của lần chạy gần nhất: thời gian theo pha, SQL, bộ nhớ đỉnh
+
+    def __repr__(self):
+        return f"<JobRun(Id={self.Id}, TenJob='{self.TenJob}', NgayChay={self.NgayChay}, TrangThai='{self.TrangThai}')>"
+
+
+class JobRunCheckpoint(Base):
+    """
+    Checkpoint theo hợp đồng: hợp đồng MaHD đã xử lý xong trong lần chạy JobRunId
+
+    Được ghi trong cùng transaction với thay đổi của hợp đồng, nên chạy lại
+    không bao giờ cộng dồn 2 lần.
+    """
+    __tablename__ = "job_run_checkpoints"
+    __table_args__ = (UniqueConstraint("JobRunId", "MaHD", name="uq_job_run_checkpoints_run_ma_hd"),)
+
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    JobRunId = Column(Integer, ForeignKey("job_runs.Id", ondelete="CASCADE"), nullable=False, index=True)
+    MaHD = Column(String, nullable=False)
+    ThoiGian = Column(DateTime, nullable=False, default=datetime.datetime.now)
+
+
+class JobExecution(Base):
+    """
+    Một lần thực thi job bởi scheduler trong app (lịch sử cho /jobs/{name}/history)
+
+    Chỉ worker giữ advisory lock mới ghi dòng này.
+    """
+    __tablename__ = "job_executions"
+
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    TenJob = Column(String, nullable=False, index=True)
+    TrangThai = Column(String, nullable=False)  # TrangThaiThucThiJob
+    KichHoat = Column(String, nullable=False)  # "schedule" | "manual"
+    Worker = Column(String, nullable=False)  # hostname:pid của worker đã chạy
+    BatDau = Column(DateTime, nullable=False, default=datetime.datetime.now)
+    KetThuc = Column(DateTime, nullable=True)
+    ThoiGianMs = Column(Integer, nullable=True)
+    KetQua = Column(Text, nullable=True)  # JSON kết quả trả về của job
+    Loi = Column(Text, nullable=True)
+    TienDo = Column(Text, nullable=True)  # JSON tiến độ job báo trong lúc chạy
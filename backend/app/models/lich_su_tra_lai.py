@@ -1,8 +1,10 @@
 """
 LichSuTraLai model - Lịch sử trả lãi (Payment history)
 """
-from sqlalchemy import Column, Integer, String, Date
+from sqlalchemy import Column, Integer, String, Date, case, literal
+from sqlalchemy.ext.hybrid import hybrid_property
 from app.core.database import Base
+from app.core.enums import TrangThaiNgayThanhToan as TrangThaiNgay
 import datetime
 
 
@@ -16,11 +18,33 @@ class LichSuTraLai(Base):
     MaHD = Column(String, nullable=False, index=True)  # Contract ID (can be from TinChap or TraGop)
     Ngay = Column(Date, nullable=False, default=datetime.date.today)
     SoTien = Column(Integer, nullable=False)
-    NoiDung = Column(String, nullable=True)
+    NoiDung = Column(String, nullable=True)  # Nhãn ngắn; số tiền từng lần trả nằm trong payment_allocation
+    KyThu = Column(Integer, nullable=True)  # Số kỳ (kỳ 1, 2, ...), NULL với dữ liệu cũ không có số kỳ
     TrangThaiThanhToan = Column(String, nullable=False)  # Trạng thái thanh toán
-    TrangThaiNgayThanhToan = Column(String, nullable=False)  # Trạng thái ngày thanh toán
     TienDaTra = Column(Integer, nullable=False)  # Total amount paid so far
+    Version = Column(Integer, nullable=False, server_default="1")  # Row version, tăng mỗi lần UPDATE (dùng cho ETag)
+
+    __mapper_args__ = {"version_id_col": Version}
+
+    @hybrid_property
+    def TrangThaiNgayThanhToan(self) -> str:
+        """
+        Trạng thái ngày thanh toán, tính từ Ngay so với hôm nay (không lưu trong DB)
+
+        Dùng được cả trong query: filter(LichSuTraLai.TrangThaiNgayThanhToan == ...)
+        """
+        return TrangThaiNgay.from_ngay(self.Ngay, datetime.date.today()).value
+
+    @TrangThaiNgayThanhToan.inplace.expression
+    @classmethod
+    def _trang_thai_ngay_thanh_toan_expression(cls):
+        # Ngày hôm nay lấy từ Python (không dùng current_date của DB) để khớp với bản Python
+        today = literal(datetime.date.today(), Date)
+        return case(
+            (cls.Ngay < today, TrangThaiNgay.QUA_HAN.value),
+            (cls.Ngay == today, TrangThaiNgay.DEN_HAN.value),
+            else_=TrangThaiNgay.CHUA_DEN_HAN.value,
+        )
 
     def __repr__(self):
         return f"<LichSuTraLai(Stt={self.Stt}, MaHD='{self.MaHD}', SoTien={self.SoTien})>"
-
@@ -0,0 +1,28 @@
+"""
+PaymentAllocation model - Phân bổ của từng lần thanh toán vào các kỳ lịch sử trả lãi
+"""
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from app.core.database import Base
+import datetime
+
+
+class PaymentAllocation(Base):
+    """
+    1 dòng cho mỗi (lần thanh toán, kỳ): số tiền của lần thanh toán LichSuId đã vào kỳ Stt
+
+    Thay cho việc nối chuỗi " |Số tiền thanh toán: ... + ..." vào LichSuTraLai.NoiDung.
+    """
+    __tablename__ = "payment_allocation"
+    __table_args__ = (
+        Index("ix_payment_allocation_MaHD_ThoiGian", "MaHD", "ThoiGian"),
+    )
+
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    LichSuId = Column(Integer, ForeignKey("lich_su.id", ondelete="CASCADE"), nullable=False, index=True)  # Lần thanh toán (nhật ký lich_su)
+    Stt = Column(Integer, ForeignKey("lich_su_tra_lai.Stt", ondelete="CASCADE"), nullable=False, index=True)  # Kỳ nhận tiền
+    MaHD = Column(String, nullable=False)
+    SoTien = Column(Integer, nullable=False)
+    ThoiGian = Column(DateTime, nullable=False, default=datetime.datetime.now)
+
+    def __repr__(self):
+        return f"<PaymentAllocation(LichSuId={self.LichSuId}, Stt={self.Stt}, SoTien={self.SoTien})>"
@@ -1,11 +1,15 @@
 """
 TinChap model - Tín chấp (Credit without collateral)
 """
-from sqlalchemy import Column, Integer, String, Date
+from sqlalchemy import Column, Integer, String, Date, Sequence
 from app.core.database import Base
 import datetime
 
 
+# Số thứ tự trong MaHD (TC001, TC002, ...), cấp bằng nextval (app.utils.id_generator)
+MA_HD_SEQUENCE = Sequence("tin_chap_ma_hd_seq", metadata=Base.metadata)
+
+
 class TinChap(Base):
     """
     Tín chấp - Credit without collateral
@@ -20,6 +24,10 @@ class TinChap(Base):
     LaiSuat = Column(Integer, nullable=False)  # Fixed interest amount (VNĐ)
     SoTienTraGoc = Column(Integer, nullable=True, default=0)  # Số tiền trả gốc (nếu cần cho tất toán)
     TrangThai = Column(String, nullable=False)  # [TrangThaiThanhToan, TrangThaiNgayThanhToan]
+    NgayDenHanTiepTheo = Column(Date, nullable=True, index=True)  # Ngày job cộng dồn cần xử lý tiếp theo (NULL = xử lý ở lần chạy tới)
+    Version = Column(Integer, nullable=False, server_default="1")  # Row version, tăng mỗi lần UPDATE (dùng cho ETag)
+
+    __mapper_args__ = {"version_id_col": Version}
 
     # def __repr__(self):
     #     return f"<TinChap(MaHD='{self.MaHD}', HoTen='{self.HoTen}', SoTienVay={self.SoTienVay})>"
@@ -1,11 +1,15 @@
 """
 TraGop model - Trả góp (Installment payment)
 """
-from sqlalchemy import Column, Integer, String, Date
+from sqlalchemy import Column, Integer, String, Date, Sequence
 from app.core.database import Base
 import datetime
 
 
+# Số thứ tự trong MaHD (TG001, TG002, ...), cấp bằng nextval (app.utils.id_generator)
+MA_HD_SEQUENCE = Sequence("tra_gop_ma_hd_seq", metadata=Base.metadata)
+
+
 class TraGop(Base):
     """
     Trả góp - Installment payment
@@ -20,4 +24,8 @@ class TraGop(Base):
     SoLanTra = Column(Integer, nullable=False, default=0)  # Number of times to pay - Tổng số lần phải trả
     LaiSuat = Column(Integer, nullable=False)  # Fixed interest amount (VNĐ)
     TrangThai = Column(String, nullable=False)  # [TrangThaiThanhToan, TrangThaiNgayThanhToan]
+    NgayDenHanTiepTheo = Column(Date, nullable=True, index=True)  # Ngày job cộng dồn cần xử lý tiếp theo (NULL = xử lý ở lần chạy tới)
+    Version = Column(Integer, nullable=False, server_default="1")  # Row version, tăng mỗi lần UPDATE (dùng cho ETag)
+
+    __mapper_args__ = {"version_id_col": Version}
 
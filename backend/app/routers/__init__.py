@@ -1,7 +1,7 @@
 """
 API Routers package
 """
-from . import tin_chap, tra_gop, lich_su_tra_lai, no_phai_thu, dashboard
+from . import tin_chap, tra_gop, lich_su_tra_lai, no_phai_thu, dashboard, contracts, jobs
 
-__all__ = ["tin_chap", "tra_gop", "lich_su_tra_lai", "no_phai_thu", "dashboard"]
+__all__ = ["tin_chap", "tra_gop", "lich_su_tra_lai", "no_phai_thu", "dashboard", "contracts", "jobs"]
 
@@ -0,0 +1,71 @@
+"""
+Contracts API routes (thao tác trên cả tín chấp và trả góp)
+"""
+import io
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Literal, Optional
+
+from app.core.database import get_db
+from app.schemas.contracts import ContractBatchRequest
+from app.schemas.response import ApiResponse
+from app.crud import contracts as crud_contracts
+from app.services.contract_import import detect_format, import_contracts
+from app.websocket import manager, broadcast_dashboard_update
+
+router = APIRouter(
+    prefix="/contracts",
+    tags=["Hợp đồng"]
+)
+
+
+@router.post("/batch", response_model=ApiResponse[Dict[str, Any]])
+async def get_contracts_batch(request: ContractBatchRequest, db: Session = Depends(get_db)):
+    """
+    Lấy chi tiết nhiều hợp đồng (TC + TG) trong một lần gọi
+    
+    Cùng shape với GET /tin-chap/{ma_hd} và GET /tra-gop/{ma_hd}; mã không tồn tại
+    được trả về trong `not_found` thay vì 404.
+    """
+    result = crud_contracts.get_contracts_batch(db=db, ma_hds=request.MaHD)
+    return ApiResponse.trusted_response(data=result, message="Lấy danh sách hợp đồng thành công")
+
+
+@router.post("/import", response_model=ApiResponse[Dict[str, Any]])
+async def import_contracts_file(
+    request: Request,
+    format: Optional[Literal["csv", "ndjson"]] = None,
+    batch_size: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Import hàng loạt hợp đồng TC + TG từ body CSV (có header) hoặc NDJSON
+
+    Cột: LoaiHopDong (TC/TG), HoTen, NgayVay, SoTienVay, KyDong, LaiSuat, SoLanTra (TG).
+    `format` mặc định đoán theo Content-Type (text/csv, application/x-ndjson).
+    Tạo luôn lịch sử trả lãi và dòng lich_su; dòng lỗi được báo theo số dòng
+    trong `errors`, các dòng hợp lệ vẫn được nhập.
+    """
+    body = await request.body()
+    if not body:
+        raise HTTPException(status_code=400, detail="Body rỗng: gửi nội dung CSV hoặc NDJSON")
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File phải được mã hóa UTF-8")
+
+    fmt = format or detect_format(request.headers.get("content-type"))
+    result = await run_in_threadpool(import_contracts, db, io.StringIO(text), fmt, batch_size)
+
+    if result["rows_imported"]:
+        await broadcast_dashboard_update(
+            manager=manager,
+            dashboard_data={"action": "contracts_imported", "count": result["rows_imported"]},
+            message=f"Đã nhập {result['rows_imported']} hợp đồng",
+        )
+    return ApiResponse.success_response(
+        data=result,
+        message=f"Đã nhập {result['rows_imported']}/{result['rows_read']} hợp đồng",
+    )
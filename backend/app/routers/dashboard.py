@@ -1,13 +1,16 @@
 """
 Dashboard API routes
 """
+from typing import Any
 from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from app.schemas.response import ApiResponse
 from app.schemas.dashboard import DashboardResponse
 from app.core.database import get_db
 from app.core.enums import TimePeriod
 from sqlalchemy.orm import Session
 from app.crud import dashboard as crud_dashboard
+from app.services.projection import PROJECTION_DAYS, PROJECTION_MAX_DAYS, get_projection
 
 router = APIRouter(
     prefix="/dashboard", 
@@ -28,4 +31,20 @@ async def get_dashboard(
         time_period = TimePeriod.ALL.value
     
     result = crud_dashboard.get_dashboard(db=db, time_period=time_period)
-    return ApiResponse.success_response(data=result, message="Lấy dữ liệu dashboard thành công")
\ No newline at end of file
+    return ApiResponse.success_response(data=result, message="Lấy dữ liệu dashboard thành công")
+
+
+@router.get("/projection", response_model=ApiResponse[Any])
+async def get_cash_flow_projection(
+    days: int = Query(PROJECTION_DAYS, ge=1, le=PROJECTION_MAX_DAYS, description="Số ngày dự báo từ hôm nay"),
+    db: Session = Depends(get_db)
+):
+    """
+    Dự báo tiền thu vào theo ngày và theo tuần (thứ Hai - Chủ nhật) của mọi hợp đồng đang hoạt động
+
+    Gồm phần còn nợ của các kỳ đã có và tiền lãi của các kỳ tín chấp job cộng dồn sẽ tạo;
+    phần quá hạn trước hôm nay báo riêng ở `overdue`. Kết quả được cache tới lần thanh toán /
+    thay đổi hợp đồng / chạy job cộng dồn tiếp theo (`cached` cho biết lấy từ cache).
+    """
+    result = await run_in_threadpool(get_projection, db, days)
+    return ApiResponse.trusted_response(data=result, message="Lấy dự báo dòng tiền thành công")
@@ -0,0 +1,108 @@
+"""
+Jobs API routes - trạng thái và lịch sử các job của scheduler trong app
+
+Chạy job thủ công theo kiểu submit-and-poll:
+    POST /jobs/{name}/runs        -> 202 + Id lần thực thi (Location: /jobs/executions/{id})
+    GET  /jobs/executions/{id}    -> TrangThai, TienDo, KetQua; poll tới khi hết "Đang chạy"
+Tiến độ và kết quả cũng được phát qua WebSocket (job_progress / job_completed).
+"""
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.orm import Session
+from typing import List
+
+from app.core.database import get_db
+from app.schemas.job import JobExecution, JobStatus
+from app.schemas.response import ApiResponse
+from app.crud import job_run as crud_job_run
+from app.services.scheduler import scheduler, ScheduledJob
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["Jobs"]
+)
+
+
+def _job_status(db: Session, job: ScheduledJob) -> JobStatus:
+    last = crud_job_run.get_last_job_execution(db, job.name)
+    return JobStatus(
+        name=job.name,
+        description=job.description,
+        cron=job.schedule.expression,
+        timezone=str(scheduler.tz),
+        timeout_seconds=job.timeout_seconds,
+        scheduler_enabled=scheduler.started,
+        next_run=job.next_run,
+        running=job.running,
+        last_execution=JobExecution.model_validate(last) if last else None,
+    )
+
+
+def _get_job(name: str) -> ScheduledJob:
+    job = scheduler.jobs.get(name)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy job {name}")
+    return job
+
+
+@router.get("", response_model=ApiResponse[List[JobStatus]])
+async def get_jobs(db: Session = Depends(get_db)):
+    """Trạng thái tất cả job đã đăng ký"""
+    statuses = [_job_status(db, job) for job in scheduler.jobs.values()]
+    return ApiResponse.success_response(data=statuses, message="Lấy trạng thái job thành công")
+
+
+@router.get("/executions/{execution_id}", response_model=ApiResponse[JobExecution])
+async def get_job_execution(execution_id: int, db: Session = Depends(get_db)):
+    """Trạng thái 1 lần thực thi job (dùng để poll sau khi submit)"""
+    execution = crud_job_run.get_job_execution(db, execution_id)
+    if not execution:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy lần thực thi {execution_id}")
+    return ApiResponse.success_response(
+        data=JobExecution.model_validate(execution),
+        message="Lấy trạng thái thực thi job thành công",
+    )
+
+
+@router.get("/{name}", response_model=ApiResponse[JobStatus])
+async def get_job(name: str, db: Session = Depends(get_db)):
+    """Trạng thái 1 job"""
+    job = _get_job(name)
+    return ApiResponse.success_response(data=_job_status(db, job), message="Lấy trạng thái job thành công")
+
+
+@router.get("/{name}/history", response_model=ApiResponse[List[JobExecution]])
+async def get_job_history(name: str, skip: int = 0, limit: int = 20, db: Session = Depends(get_db)):
+    """Lịch sử thực thi của 1 job (mới nhất trước)"""
+    _get_job(name)
+    executions = crud_job_run.get_job_executions(db, name, skip=skip, limit=limit)
+    return ApiResponse.success_response(
+        data=[JobExecution.model_validate(execution) for execution in executions],
+        message="Lấy lịch sử job thành công",
+    )
+
+
+@router.post("/{name}/runs", response_model=ApiResponse[JobExecution], status_code=202)
+async def submit_job_run(name: str, response: Response, db: Session = Depends(get_db)):
+    """
+    Chạy job ngay trong nền và trả về 202 với Id lần thực thi, không chờ job xong
+
+    Poll GET /jobs/executions/{id} (header Location) tới khi TrangThai khác "Đang chạy".
+    Nếu job đang chạy (advisory lock đang bị giữ): 409 kèm lần thực thi đang chạy để poll tiếp.
+    """
+    _get_job(name)
+    execution_id = await scheduler.submit(name, trigger="manual")
+    if execution_id is None:
+        running = crud_job_run.get_running_job_execution(db, name)
+        detail = {"message": f"Job {name} đang chạy"}
+        headers = None
+        if running:
+            detail["execution"] = JobExecution.model_validate(running).model_dump(mode="json")
+            headers = {"Location": f"{router.prefix}/executions/{running.Id}"}
+        raise HTTPException(status_code=409, detail=detail, headers=headers)
+
+    execution = crud_job_run.get_job_execution(db, execution_id)
+    response.headers["Location"] = f"{router.prefix}/executions/{execution_id}"
+    return ApiResponse.success_response(
+        data=JobExecution.model_validate(execution),
+        message=f"Đã bắt đầu job {name}",
+    )
@@ -4,12 +4,14 @@ Lich Su (History) API routes
 from fastapi import APIRouter, Depends, Query, HTTPException, status
 from sqlalchemy.orm import Session
 from datetime import datetime, date
-from typing import Optional, Literal
+from typing import List, Optional, Literal
 
 from app.core.database import get_db
 from app.schemas.lich_su import LichSuResponse
+from app.schemas.lich_su_tra_lai import PaymentAllocation
 from app.schemas.response import ApiResponse
 from app.crud import lich_su as crud_lich_su
+from app.crud import payment_allocation as crud_payment_allocation
 
 router = APIRouter(
     prefix="/lich-su",
@@ -141,3 +143,10 @@ async def financial_statistics(
         message="Thống kê tài chính được tính toán thành công"
     )
 
+
+@router.get("/{lich_su_id}/allocations", response_model=ApiResponse[List[PaymentAllocation]])
+async def get_allocations_by_payment(lich_su_id: int, db: Session = Depends(get_db)):
+    """Các kỳ mà lần thanh toán `lich_su_id` đã được phân bổ vào"""
+    result = crud_payment_allocation.get_allocations_by_payment(db=db, lich_su_id=lich_su_id)
+    allocations_response = [PaymentAllocation.model_validate(allocation) for allocation in result]
+    return ApiResponse.success_response(data=allocations_response, message="Lấy phân bổ của lần thanh toán thành công")
@@ -1,14 +1,24 @@
 """
 LichSuTraLai API routes
 """
-from fastapi import APIRouter, Depends, HTTPException
+import json
+from datetime import date
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List, Any
+from typing import List, Any, Optional, Tuple
 
-from app.core.database import get_db
-from app.schemas.lich_su_tra_lai import LichSuTraLai
+from app.core.database import get_db, unit_of_work
+from app.core.idempotency import IdempotencyContext, claim_idempotency_key, idempotency_context, idempotent_response
+from app.core.enums import TrangThaiThucThiJob
+from app.schemas.lich_su_tra_lai import LichSuTraLai, LichSuTraLaiPayItem, PaymentAllocation
 from app.schemas.response import ApiResponse
 from app.crud import lich_su_tra_lai as crud_lich_su
+from app.crud import job_run as crud_job_run
+from app.crud import payment_allocation as crud_payment_allocation
+from app.services.accrual import ACCRUAL_JOB_NAME, run_accrual, simulate_accrual
+from app.services.scheduler import scheduler, scheduler_today
 from app.websocket import manager, EventType, broadcast_lich_su_tra_lai_event, broadcast_dashboard_update
 
 router = APIRouter(
@@ -23,7 +33,8 @@ async def create_lich_su(
     ma_hd: str = ""
 ):
     """Create payment history records for a contract"""
-    result = crud_lich_su.create_lich_su(db=db, ma_hd=ma_hd)
+    with unit_of_work(db):
+        result = crud_lich_su.create_lich_su(db=db, ma_hd=ma_hd)
     
     # Broadcast WebSocket event
     await broadcast_lich_su_tra_lai_event(
@@ -65,12 +76,34 @@ async def get_lich_su_by_contract(ma_hd: str, db: Session = Depends(get_db)):
     return ApiResponse.success_response(data=lich_sus_response, message="Lấy lịch sử trả lãi theo hợp đồng thành công")
 
 
+@router.get("/contract/{ma_hd}/allocations", response_model=ApiResponse[List[PaymentAllocation]])
+async def get_allocations_by_contract(
+    ma_hd: str,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    """Số tiền từng lần thanh toán đã phân bổ vào từng kỳ của hợp đồng, mới nhất trước"""
+    result = crud_payment_allocation.get_allocations_by_contract(db=db, ma_hd=ma_hd, skip=skip, limit=limit)
+    allocations_response = [PaymentAllocation.model_validate(allocation) for allocation in result]
+    return ApiResponse.success_response(data=allocations_response, message="Lấy phân bổ thanh toán theo hợp đồng thành công")
+
+
+@router.get("/{stt}/allocations", response_model=ApiResponse[List[PaymentAllocation]])
+async def get_allocations_by_period(stt: int, db: Session = Depends(get_db)):
+    """Các lần thanh toán đã vào kỳ `stt` (thay cho chuỗi "Số tiền thanh toán: ..." trong NoiDung)"""
+    result = crud_payment_allocation.get_allocations_by_period(db=db, stt=stt)
+    allocations_response = [PaymentAllocation.model_validate(allocation) for allocation in result]
+    return ApiResponse.success_response(data=allocations_response, message="Lấy phân bổ thanh toán của kỳ thành công")
+
+
 @router.delete("/{stt}", response_model=ApiResponse[Any])
 async def delete_lich_su(stt: int, db: Session = Depends(get_db)):
     """Delete a payment history record"""
-    success = crud_lich_su.delete_lich_su(db=db, stt=stt)
-    if not success:
-        raise HTTPException(status_code=404, detail="Không tìm thấy lịch sử trả lãi")
+    with unit_of_work(db):
+        success = crud_lich_su.delete_lich_su(db=db, stt=stt)
+        if not success:
+            raise HTTPException(status_code=404, detail="Không tìm thấy lịch sử trả lãi")
     
     # Broadcast WebSocket event
     await broadcast_lich_su_tra_lai_event(
@@ -86,9 +119,10 @@ async def delete_lich_su(stt: int, db: Session = Depends(get_db)):
 @router.delete("/contract/{ma_hd}", response_model=ApiResponse[Any])
 async def delete_lich_su_by_contract(ma_hd: str, db: Session = Depends(get_db)):
     """Delete all payment history records for a specific contract"""
-    so_ban_ghi_da_xoa = crud_lich_su.delete_lich_sus_by_contract(db=db, ma_hd=ma_hd)
-    if so_ban_ghi_da_xoa == 0:
-        raise HTTPException(status_code=404, detail="Không tìm thấy lịch sử trả lãi cho hợp đồng này")
+    with unit_of_work(db):
+        so_ban_ghi_da_xoa = crud_lich_su.delete_lich_sus_by_contract(db=db, ma_hd=ma_hd)
+        if so_ban_ghi_da_xoa == 0:
+            raise HTTPException(status_code=404, detail="Không tìm thấy lịch sử trả lãi cho hợp đồng này")
     
     # Broadcast WebSocket event
     await broadcast_lich_su_tra_lai_event(
@@ -103,16 +137,74 @@ async def delete_lich_su_by_contract(ma_hd: str, db: Session = Depends(get_db)):
         message=f"Xóa {so_ban_ghi_da_xoa} bản ghi lịch sử trả lãi cho hợp đồng {ma_hd} thành công"
     )
 
+def _pay_lich_su_batch(
+    db: Session, items: List[LichSuTraLaiPayItem], idempotency: Optional[IdempotencyContext]
+) -> Tuple[dict, Response]:
+    """pay_lich_su_batch + Idempotency-Key + commit của cả batch, chạy trong threadpool"""
+    with unit_of_work(db):
+        claim_idempotency_key(db, idempotency)
+        result = crud_lich_su.pay_lich_su_batch(db, items)
+        return result, idempotent_response(db, idempotency, ApiResponse.success_response(
+            data=result,
+            message=f"Thanh toán {result['succeeded']}/{len(result['items'])} khoản thành công"
+        ))
+
+
+@router.post("/pay/batch", response_model=ApiResponse[Any])
+async def pay_lich_su_batch(
+    items: List[LichSuTraLaiPayItem] = Body(..., min_length=1, max_length=1000),
+    db: Session = Depends(get_db),
+    idempotency: Optional[IdempotencyContext] = Depends(idempotency_context)
+):
+    """
+    Thanh toán nhiều khoản trong 1 request (vd: cuối ngày nhập các khoản đã thu)
+
+    Body: `[{"Stt": 12, "SoTien": 50000}, {"MaHD": "TG003", "SoTien": 200000}, ...]`.
+    Các khoản được phân bổ như POST /pay/{stt}, lần lượt theo thứ tự, trong 1
+    transaction; khoản lỗi không ảnh hưởng khoản khác (xem `items[].error`).
+    Chỉ gửi 1 sự kiện WebSocket cho cả batch.
+    """
+    result, response = await run_in_threadpool(_pay_lich_su_batch, db, items, idempotency)
+    paid = [item for item in result["items"] if item["success"]]
+
+    if paid:
+        await broadcast_lich_su_tra_lai_event(
+            manager=manager,
+            event_type=EventType.LICH_SU_TRA_LAI_UPDATED,
+            lich_su_data={"action": "pay_batch", "items": paid},
+            message=f"Thanh toán {len(paid)} khoản, tổng {result['total_paid']:,} VNĐ thành công"
+        )
+        await broadcast_dashboard_update(
+            manager=manager,
+            dashboard_data={"action": "pay_batch", "count": len(paid), "amount": result["total_paid"]},
+            message="Dashboard cần cập nhật sau thanh toán"
+        )
+
+    return response
+
+def _pay_lich_su(
+    db: Session, stt: int, so_tien: int, idempotency: Optional[IdempotencyContext]
+) -> Tuple[dict, Response]:
+    """pay_lich_su + Idempotency-Key + commit, chạy trong threadpool (retry_on_stale_data sleep đồng bộ)"""
+    with unit_of_work(db):
+        claim_idempotency_key(db, idempotency)
+        result = crud_lich_su.pay_lich_su(db=db, stt=stt, so_tien=so_tien)
+        if not result:
+            raise HTTPException(status_code=404, detail="Không tìm thấy lịch sử trả lãi")
+        return result, idempotent_response(db, idempotency, ApiResponse.success_response(
+            data=result, message="Thanh toán lịch sử trả lãi thành công"
+        ))
+
+
 @router.post("/pay/{stt}", response_model=ApiResponse[Any])
 async def pay_lich_su(
     stt: int,
     so_tien: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    idempotency: Optional[IdempotencyContext] = Depends(idempotency_context)
 ):
     """Pay a payment history record"""
-    result = crud_lich_su.pay_lich_su(db=db, stt=stt, so_tien=so_tien)
-    if not result:
-        raise HTTPException(status_code=404, detail="Không tìm thấy lịch sử trả lãi")
+    result, response = await run_in_threadpool(_pay_lich_su, db, stt, so_tien, idempotency)
     
     # Broadcast WebSocket event - quan trọng cho real-time updates!
     await broadcast_lich_su_tra_lai_event(
@@ -129,20 +221,84 @@ async def pay_lich_su(
         message="Dashboard cần cập nhật sau thanh toán"
     )
     
-    return ApiResponse.success_response(data=result, message="Thanh toán lịch sử trả lãi thành công")
+    return response
 
 @router.post("/auto-create-lich-su", response_model=ApiResponse[Any])
-async def auto_create_lich_su(db: Session = Depends(get_db)):
-    """Auto create payment history records for all contracts"""
-    result = crud_lich_su.auto_create_lich_su(db=db)
+async def auto_create_lich_su(
+    workers: int | None = None,
+    chunk_size: int | None = None,
+    catch_up: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Auto create payment history records for all contracts
+    
+    Chạy theo shard MaHD song song (`workers` process), commit theo từng chunk
+    `chunk_size` hợp đồng. Mặc định lấy từ ACCRUAL_WORKERS / ACCRUAL_CHUNK_SIZE.
+    `catch_up=true`: chạy bù mọi ngày từ sau lần chạy thành công gần nhất tới hôm nay.
+
+    Chạy như job "accrual" của scheduler (cùng advisory lock, ghi vào job_executions):
+    job đang chạy (theo lịch hoặc POST /jobs/accrual/runs) thì trả 409.
+    Request giữ kết nối tới khi job xong; để chạy nền và poll tiến độ dùng
+    POST /jobs/accrual/runs rồi GET /jobs/executions/{id}.
+    """
+    execution_id = await scheduler.run_job(
+        ACCRUAL_JOB_NAME,
+        trigger="manual",
+        job_func=lambda progress: run_accrual(
+            workers=workers, chunk_size=chunk_size, date_now=scheduler_today(), catch_up=catch_up, progress=progress,
+        ),
+    )
+    if execution_id is None:
+        running = crud_job_run.get_running_job_execution(db, ACCRUAL_JOB_NAME)
+        detail = {"message": f"Job {ACCRUAL_JOB_NAME} đang chạy"}
+        headers = None
+        if running:
+            detail["execution_id"] = running.Id
+            headers = {"Location": f"/jobs/executions/{running.Id}"}
+        raise HTTPException(status_code=409, detail=detail, headers=headers)
+
+    execution = crud_job_run.get_job_execution(db, execution_id)
+    if execution.TrangThai != TrangThaiThucThiJob.THANH_CONG.value:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi tự động cập nhật lịch sử: {execution.Loi or execution.TrangThai}")
+    result = json.loads(execution.KetQua) if execution.KetQua else None
     return ApiResponse.success_response(data=result, message="Tự động cập nhật lịch sử trả lãi thành công")
 
 
+@router.get("/auto-create-lich-su/dry-run", response_model=ApiResponse[Any])
+async def dry_run_auto_create_lich_su(
+    ngay: Optional[date] = None,
+    ma_hd: Optional[List[str]] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Mô phỏng job cộng dồn cho ngày `ngay` (mặc định hôm nay) mà không ghi vào DB
+
+    Trả về các kỳ sẽ bị cập nhật (giá trị cũ -> mới) và các kỳ sẽ được tạo của
+    từng hợp đồng; `ma_hd` (lặp lại được) để giới hạn phạm vi.
+    """
+    result = await run_in_threadpool(simulate_accrual, db, ngay, ma_hd)
+    return ApiResponse.trusted_response(data=result, message="Mô phỏng cộng dồn lịch sử trả lãi thành công")
+
+
+def _tat_toan_hop_dong(
+    db: Session, ma_hd: str, tien_lai: int, idempotency: Optional[IdempotencyContext]
+) -> Tuple[dict, Response]:
+    """tat_toan_hop_dong + Idempotency-Key + commit, chạy trong threadpool (retry_on_stale_data sleep đồng bộ)"""
+    with unit_of_work(db):
+        claim_idempotency_key(db, idempotency)
+        result = crud_lich_su.tat_toan_hop_dong(db=db, ma_hd=ma_hd, tien_lai=tien_lai)
+        return result, idempotent_response(db, idempotency, ApiResponse.success_response(
+            data=result, message="Tất toán hợp đồng thành công"
+        ))
+
+
 @router.post("/pay-full/{ma_hd}", response_model=ApiResponse[Any])
 async def pay_full_lich_su(
     ma_hd: str,
     tien_lai: int = 0,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    idempotency: Optional[IdempotencyContext] = Depends(idempotency_context)
 ):
     """Pay full payment history records for a specific contract.
 
@@ -151,7 +307,7 @@ async def pay_full_lich_su(
     history records similar to `pay_lich_su` logic and will NOT force full settlement.
     If `tien_lai` >= required interest, the behavior remains as before (full settlement).
     """
-    result = crud_lich_su.tat_toan_hop_dong(db=db, ma_hd=ma_hd, tien_lai=tien_lai)
+    result, response = await run_in_threadpool(_tat_toan_hop_dong, db, ma_hd, tien_lai, idempotency)
     
     # Broadcast WebSocket event cho tất toán
     await broadcast_lich_su_tra_lai_event(
@@ -168,4 +324,4 @@ async def pay_full_lich_su(
         message="Dashboard cần cập nhật sau tất toán"
     )
     
-    return ApiResponse.success_response(data=result, message="Tất toán hợp đồng thành công")
\ No newline at end of file
+    return response
\ No newline at end of file
@@ -19,4 +19,4 @@ async def get_all_no_phai_thu(
     db: Session = Depends(get_db)):
     """Get all no phai thu records"""
     result = crud_no_phai_thu.get_no_phai_thus(db=db, time=time)
-    return ApiResponse.success_response(data=result, message="Lấy danh sách nợ phải thu thành công")
\ No newline at end of file
+    return ApiResponse.trusted_response(data=result, message="Lấy danh sách nợ phải thu thành công")
\ No newline at end of file
@@ -1,14 +1,17 @@
 """
 TinChap API routes
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List, Any, Dict
+from typing import Any, Dict, Optional
 
-from app.core.database import get_db
+from app.core.database import get_db, unit_of_work
+from app.core.idempotency import IdempotencyContext, claim_idempotency_key, idempotency_context, idempotent_response
 from app.schemas.tin_chap import TinChapCreate, TinChapResponse, TinChapUpdate, TinChap
 from app.schemas.response import ApiResponse
 from app.crud import tin_chap as crud_tin_chap
+from app.utils.etag import etag_headers, not_modified_response
 from app.utils.id_generator import generate_tin_chap_id
 from app.websocket import manager, EventType, broadcast_tin_chap_event, broadcast_dashboard_update
 
@@ -21,10 +24,11 @@ router = APIRouter(
 @router.post("", response_model=ApiResponse[TinChap], status_code=201)
 async def create_tin_chap(tin_chap: TinChapCreate, db: Session = Depends(get_db)):
     """Create a new TinChap contract"""
-    ma_hd = generate_tin_chap_id(db)
-    result = crud_tin_chap.create_tin_chap(db=db, tin_chap=tin_chap, ma_hd=ma_hd)
-    # Convert SQLAlchemy model to Pydantic schema
-    tin_chap_response = TinChap.model_validate(result)
+    with unit_of_work(db):
+        ma_hd = generate_tin_chap_id(db)
+        result = crud_tin_chap.create_tin_chap(db=db, tin_chap=tin_chap, ma_hd=ma_hd)
+        # Convert SQLAlchemy model to Pydantic schema (trước commit: không phải load lại)
+        tin_chap_response = TinChap.model_validate(result)
     
     # Broadcast WebSocket event
     await broadcast_tin_chap_event(
@@ -46,6 +50,7 @@ async def create_tin_chap(tin_chap: TinChapCreate, db: Session = Depends(get_db)
 
 @router.get("", response_model=ApiResponse[Dict[str, Any]])
 async def get_all_tin_chap(
+    request: Request,
     status: str | None = None,
     page: int = 1,
     page_size: int = 10,
@@ -56,6 +61,20 @@ async def get_all_tin_chap(
     db: Session = Depends(get_db)
     ):
     """Get all TinChap contracts with filter/search/sort/pagination with totals"""
+    etag = crud_tin_chap.get_tin_chaps_etag(
+        db=db,
+        status=status,
+        page=page,
+        page_size=page_size,
+        search=search,
+        sort_by=sort_by,
+        sort_dir=sort_dir,
+        today_only=today_only,
+    )
+    cached = not_modified_response(request, etag)
+    if cached:
+        return cached
+
     result = crud_tin_chap.get_tin_chaps(
         db=db,
         status=status,
@@ -66,26 +85,34 @@ async def get_all_tin_chap(
         sort_dir=sort_dir,
         today_only=today_only,
     )
-    return ApiResponse.success_response(data=result, message="Lấy danh sách hợp đồng tín chấp thành công")
+    return ApiResponse.trusted_response(data=result, message="Lấy danh sách hợp đồng tín chấp thành công", headers=etag_headers(etag))
 
 
 @router.get("/{ma_hd}", response_model=ApiResponse[TinChapResponse])
-async def get_tin_chap_by_id(ma_hd: str, db: Session = Depends(get_db)):
-    """Get a specific TinChap contract by MaHD"""
+async def get_tin_chap_by_id(ma_hd: str, request: Request, db: Session = Depends(get_db)):
+    """Get a specific TinChap contract by MaHD (If-None-Match -> 304)"""
+    etag = crud_tin_chap.get_tin_chap_etag(db=db, ma_hd=ma_hd)
+    if not etag:
+        raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng tín chấp")
+    cached = not_modified_response(request, etag)
+    if cached:
+        return cached
+
     tin_chap = crud_tin_chap.get_tin_chap_with_history(db=db, ma_hd=ma_hd)
     if not tin_chap:
         raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng tín chấp")
-    return ApiResponse.success_response(data=tin_chap, message="Lấy thông tin hợp đồng tín chấp thành công")
+    return ApiResponse.trusted_response(data=tin_chap, message="Lấy thông tin hợp đồng tín chấp thành công", headers=etag_headers(etag))
 
 
 @router.put("/{ma_hd}", response_model=ApiResponse[TinChap])
 async def update_tin_chap(ma_hd: str, tin_chap_update: TinChapUpdate, db: Session = Depends(get_db)):
     """Update a TinChap contract"""
-    db_tin_chap = crud_tin_chap.update_tin_chap(db=db, ma_hd=ma_hd, tin_chap_update=tin_chap_update)
-    if not db_tin_chap:
-        raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng tín chấp")
-    # Convert SQLAlchemy model to Pydantic schema
-    tin_chap_response = TinChap.model_validate(db_tin_chap)
+    with unit_of_work(db):
+        db_tin_chap = crud_tin_chap.update_tin_chap(db=db, ma_hd=ma_hd, tin_chap_update=tin_chap_update)
+        if not db_tin_chap:
+            raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng tín chấp")
+        # Convert SQLAlchemy model to Pydantic schema (trước commit: không phải load lại)
+        tin_chap_response = TinChap.model_validate(db_tin_chap)
     
     # Broadcast WebSocket event
     await broadcast_tin_chap_event(
@@ -108,9 +135,10 @@ async def update_tin_chap(ma_hd: str, tin_chap_update: TinChapUpdate, db: Sessio
 @router.delete("/{ma_hd}", response_model=ApiResponse[Any])
 async def delete_tin_chap(ma_hd: str, db: Session = Depends(get_db)):
     """Delete a TinChap contract"""
-    success = crud_tin_chap.delete_tin_chap(db=db, ma_hd=ma_hd)
-    if not success:
-        raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng tín chấp")
+    with unit_of_work(db):
+        success = crud_tin_chap.delete_tin_chap(db=db, ma_hd=ma_hd)
+        if not success:
+            raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng tín chấp")
     
     # Broadcast WebSocket event
     await broadcast_tin_chap_event(
@@ -129,15 +157,28 @@ async def delete_tin_chap(ma_hd: str, db: Session = Depends(get_db)):
     
     return ApiResponse.success_response(data={"MaHD": ma_hd}, message="Xóa hợp đồng tín chấp thành công")
 
+def _tra_goc_tin_chap(
+    db: Session, ma_hd: str, so_tien_tra_goc: int, idempotency: Optional[IdempotencyContext]
+) -> Response:
+    """tra_goc_tin_chap + Idempotency-Key + commit, chạy trong threadpool (retry_on_stale_data sleep đồng bộ)"""
+    with unit_of_work(db):
+        claim_idempotency_key(db, idempotency)
+        success = crud_tin_chap.tra_goc_tin_chap(db=db, ma_hd=ma_hd, so_tien_tra_goc=so_tien_tra_goc)
+        if not success:
+            raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng tín chấp")
+        return idempotent_response(db, idempotency, ApiResponse.success_response(
+            data={"MaHD": ma_hd}, message="Trả gốc hợp đồng tín chấp thành công"
+        ))
+
+
 @router.put("/tra-goc/{ma_hd}", response_model=ApiResponse[Any])
 async def tra_goc_tin_chap(
     ma_hd: str, 
     so_tien_tra_goc: int,
-    db: Session = Depends(get_db)):
+    db: Session = Depends(get_db),
+    idempotency: Optional[IdempotencyContext] = Depends(idempotency_context)):
     """Trả gốc hợp đồng tín chấp"""
-    success = crud_tin_chap.tra_goc_tin_chap(db=db, ma_hd=ma_hd, so_tien_tra_goc=so_tien_tra_goc)
-    if not success:
-        raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng tín chấp")
+    response = await run_in_threadpool(_tra_goc_tin_chap, db, ma_hd, so_tien_tra_goc, idempotency)
     
     # Broadcast WebSocket event
     await broadcast_tin_chap_event(
@@ -147,4 +188,4 @@ async def tra_goc_tin_chap(
         message=f"Trả gốc hợp đồng tín chấp {ma_hd} thành công"
     )
     
-    return ApiResponse.success_response(data={"MaHD": ma_hd}, message="Trả gốc hợp đồng tín chấp thành công")
\ No newline at end of file
+    return response
\ No newline at end of file
@@ -1,14 +1,15 @@
 """
 TraGop API routes
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from typing import List, Any, Dict
+from typing import Any, Dict
 
-from app.core.database import get_db
+from app.core.database import get_db, unit_of_work
 from app.schemas.tra_gop import TraGopCreate, TraGopResponse, TraGopUpdate, TraGop
 from app.schemas.response import ApiResponse
 from app.crud import tra_gop as crud_tra_gop
+from app.utils.etag import etag_headers, not_modified_response
 from app.utils.id_generator import generate_tra_gop_id
 from app.websocket import manager, EventType, broadcast_tra_gop_event, broadcast_dashboard_update
 
@@ -21,10 +22,11 @@ router = APIRouter(
 @router.post("", response_model=ApiResponse[TraGop], status_code=201)
 async def create_tra_gop(tra_gop: TraGopCreate, db: Session = Depends(get_db)):
     """Create a new TraGop contract"""
-    ma_hd = generate_tra_gop_id(db)
-    result = crud_tra_gop.create_tra_gop(db=db, tra_gop=tra_gop, ma_hd=ma_hd)
-    # Convert SQLAlchemy model to Pydantic schema
-    tra_gop_response = TraGop.model_validate(result)
+    with unit_of_work(db):
+        ma_hd = generate_tra_gop_id(db)
+        result = crud_tra_gop.create_tra_gop(db=db, tra_gop=tra_gop, ma_hd=ma_hd)
+        # Convert SQLAlchemy model to Pydantic schema (trước commit: không phải load lại)
+        tra_gop_response = TraGop.model_validate(result)
     
     # Broadcast WebSocket event
     await broadcast_tra_gop_event(
@@ -46,6 +48,7 @@ async def create_tra_gop(tra_gop: TraGopCreate, db: Session = Depends(get_db)):
 
 @router.get("", response_model=ApiResponse[Dict[str, Any]])
 async def get_all_tra_gop(
+    request: Request,
     status: str | None = None,
     page: int = 1,
     page_size: int = 10,
@@ -56,6 +59,20 @@ async def get_all_tra_gop(
     db: Session = Depends(get_db)
 ):
     """Get all TraGop contracts with filter/search/sort/pagination with totals"""
+    etag = crud_tra_gop.get_tra_gops_etag(
+        db=db,
+        status=status,
+        page=page,
+        page_size=page_size,
+        search=search,
+        sort_by=sort_by,
+        sort_dir=sort_dir,
+        today_only=today_only,
+    )
+    cached = not_modified_response(request, etag)
+    if cached:
+        return cached
+
     result = crud_tra_gop.get_tra_gops(
         db=db,
         status=status,
@@ -66,26 +83,34 @@ async def get_all_tra_gop(
         sort_dir=sort_dir,
         today_only=today_only,
     )
-    return ApiResponse.success_response(data=result, message="Lấy danh sách hợp đồng trả góp thành công")
+    return ApiResponse.trusted_response(data=result, message="Lấy danh sách hợp đồng trả góp thành công", headers=etag_headers(etag))
 
 
 @router.get("/{ma_hd}", response_model=ApiResponse[TraGopResponse])
-async def get_tra_gop_by_id(ma_hd: str, db: Session = Depends(get_db)):
-    """Get a specific TraGop contract by MaHD"""
+async def get_tra_gop_by_id(ma_hd: str, request: Request, db: Session = Depends(get_db)):
+    """Get a specific TraGop contract by MaHD (If-None-Match -> 304)"""
+    etag = crud_tra_gop.get_tra_gop_etag(db=db, ma_hd=ma_hd)
+    if not etag:
+        raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng trả góp")
+    cached = not_modified_response(request, etag)
+    if cached:
+        return cached
+
     tra_gop = crud_tra_gop.get_tra_gop_with_history(db=db, ma_hd=ma_hd)
     if not tra_gop:
         raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng trả góp")
-    return ApiResponse.success_response(data=tra_gop, message="Lấy thông tin hợp đồng trả góp thành công")
+    return ApiResponse.trusted_response(data=tra_gop, message="Lấy thông tin hợp đồng trả góp thành công", headers=etag_headers(etag))
 
 
 @router.put("/{ma_hd}", response_model=ApiResponse[TraGop])
 async def update_tra_gop(ma_hd: str, tra_gop_update: TraGopUpdate, db: Session = Depends(get_db)):
     """Update a TraGop contract"""
-    db_tra_gop = crud_tra_gop.update_tra_gop(db=db, ma_hd=ma_hd, tra_gop_update=tra_gop_update)
-    if not db_tra_gop:
-        raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng trả góp")
-    # Convert SQLAlchemy model to Pydantic schema
-    tra_gop_response = TraGop.model_validate(db_tra_gop)
+    with unit_of_work(db):
+        db_tra_gop = crud_tra_gop.update_tra_gop(db=db, ma_hd=ma_hd, tra_gop_update=tra_gop_update)
+        if not db_tra_gop:
+            raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng trả góp")
+        # Convert SQLAlchemy model to Pydantic schema (trước commit: không phải load lại)
+        tra_gop_response = TraGop.model_validate(db_tra_gop)
     
     # Broadcast WebSocket event
     await broadcast_tra_gop_event(
@@ -108,9 +133,10 @@ async def update_tra_gop(ma_hd: str, tra_gop_update: TraGopUpdate, db: Session =
 @router.delete("/{ma_hd}", response_model=ApiResponse[Any])
 async def delete_tra_gop(ma_hd: str, db: Session = Depends(get_db)):
     """Delete a TraGop contract"""
-    success = crud_tra_gop.delete_tra_gop(db=db, ma_hd=ma_hd)
-    if not success:
-        raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng trả góp")
+    with unit_of_work(db):
+        success = crud_tra_gop.delete_tra_gop(db=db, ma_hd=ma_hd)
+        if not success:
+            raise HTTPException(status_code=404, detail="Không tìm thấy hợp đồng trả góp")
     
     # Broadcast WebSocket event
     await broadcast_tra_gop_event(
@@ -0,0 +1,18 @@
+"""
+Schemas cho thao tác gộp nhiều hợp đồng (tín chấp + trả góp)
+"""
+from typing import List
+
+from pydantic import BaseModel, Field
+
+MAX_BATCH_SIZE = 200
+
+
+class ContractBatchRequest(BaseModel):
+    """Danh sách mã hợp đồng cần lấy, có thể trộn TC và TG"""
+    MaHD: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=MAX_BATCH_SIZE,
+        description="Danh sách mã hợp đồng (TCxxx / TGxxx)",
+    )
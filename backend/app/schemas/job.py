@@ -0,0 +1,36 @@
+"""
+Job schemas: trạng thái scheduler và lịch sử thực thi job
+"""
+from pydantic import BaseModel, Field, ConfigDict
+from datetime import datetime
+from typing import Optional
+
+
+class JobExecution(BaseModel):
+    """Một lần thực thi job (bảng job_executions)"""
+    Id: int = Field(..., description="Id lần thực thi")
+    TenJob: str = Field(..., description="Tên job")
+    TrangThai: str = Field(..., description="Trạng thái thực thi")
+    KichHoat: str = Field(..., description="Nguồn kích hoạt (schedule/manual)")
+    Worker: str = Field(..., description="Worker đã chạy (hostname:pid)")
+    BatDau: datetime = Field(..., description="Thời điểm bắt đầu")
+    KetThuc: Optional[datetime] = Field(None, description="Thời điểm kết thúc")
+    ThoiGianMs: Optional[int] = Field(None, description="Thời gian chạy (ms)")
+    KetQua: Optional[str] = Field(None, description="Kết quả (JSON)")
+    Loi: Optional[str] = Field(None, description="Lỗi nếu có")
+    TienDo: Optional[str] = Field(None, description="Tiến độ gần nhất (JSON)")
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class JobStatus(BaseModel):
+    """Trạng thái một job đã đăng ký với scheduler"""
+    name: str = Field(..., description="Tên job")
+    description: str = Field(..., description="Mô tả")
+    cron: str = Field(..., description="Lịch cron")
+    timezone: str = Field(..., description="Múi giờ của lịch")
+    timeout_seconds: float = Field(..., description="Timeout (giây)")
+    scheduler_enabled: bool = Field(..., description="Scheduler đang chạy trên worker này")
+    next_run: Optional[datetime] = Field(None, description="Lần chạy kế tiếp (theo worker này)")
+    running: bool = Field(..., description="Job đang chạy trên worker này")
+    last_execution: Optional[JobExecution] = Field(None, description="Lần thực thi gần nhất (mọi worker)")
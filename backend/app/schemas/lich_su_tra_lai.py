@@ -1,8 +1,8 @@
 """
 LichSuTraLai schemas for API request/response validation
 """
-from pydantic import BaseModel, Field, ConfigDict
-from datetime import date
+from pydantic import BaseModel, Field, ConfigDict, model_validator
+from datetime import date, datetime
 from typing import Optional
 
 
@@ -13,7 +13,6 @@ class LichSuTraLaiBase(BaseModel):
     SoTien: int = Field(..., gt=0, description="Số tiền trả")
     NoiDung: Optional[str] = Field(None, description="Nội dung")
     TrangThaiThanhToan: str = Field(..., description="Trạng thái thanh toán")
-    TrangThaiNgayThanhToan: str = Field(..., description="Trạng thái ngày thanh toán")
     TienDaTra: int = Field(..., description="Tổng tiền đã trả")
 
 
@@ -29,10 +28,22 @@ class LichSuTraLaiUpdate(BaseModel):
     SoTien: Optional[int] = None
     NoiDung: Optional[str] = None
     TrangThaiThanhToan: Optional[str] = None
-    TrangThaiNgayThanhToan: Optional[str] = None
     TienDaTra: Optional[int] = None
 
 
+class LichSuTraLaiPayItem(BaseModel):
+    """Một khoản trong thanh toán hàng loạt: theo Stt (kỳ được chọn) hoặc MaHD"""
+    Stt: Optional[int] = Field(None, description="Số thứ tự kỳ được chọn")
+    MaHD: Optional[str] = Field(None, description="Mã hợp đồng (trả từ kỳ sớm nhất còn nợ)")
+    SoTien: int = Field(..., gt=0, description="Số tiền thanh toán")
+
+    @model_validator(mode="after")
+    def _stt_or_ma_hd(self):
+        if (self.Stt is None) == (self.MaHD is None):
+            raise ValueError("Cần đúng 1 trong 2: Stt hoặc MaHD")
+        return self
+
+
 class LichSuTraLai(BaseModel):
     """Schema for LichSuTraLai response - can serialize from SQLAlchemy model"""
     Stt: int = Field(..., description="Số thứ tự")
@@ -40,8 +51,29 @@ class LichSuTraLai(BaseModel):
     Ngay: date = Field(..., description="Ngày trả")
     SoTien: int = Field(..., description="Số tiền trả")
     NoiDung: Optional[str] = Field(None, description="Nội dung")
+    KyThu: Optional[int] = Field(None, description="Số kỳ")
     TrangThaiThanhToan: str = Field(..., description="Trạng thái thanh toán")
-    TrangThaiNgayThanhToan: str = Field(..., description="Trạng thái ngày thanh toán")
+    TrangThaiNgayThanhToan: str = Field(..., description="Trạng thái ngày thanh toán (tính theo Ngay so với hôm nay)")
     TienDaTra: int = Field(..., description="Tổng tiền đã trả")
     
     model_config = ConfigDict(from_attributes=True)
+
+
+class PaymentAllocation(BaseModel):
+    """Số tiền 1 lần thanh toán (LichSuId) đã phân bổ vào 1 kỳ (Stt)"""
+    Id: int
+    LichSuId: int = Field(..., description="Lần thanh toán (id nhật ký lich_su)")
+    Stt: int = Field(..., description="Kỳ nhận tiền")
+    MaHD: str = Field(..., description="Mã hợp đồng")
+    SoTien: int = Field(..., description="Số tiền phân bổ vào kỳ")
+    ThoiGian: datetime = Field(..., description="Thời điểm thanh toán")
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+LICH_SU_TRA_LAI_FIELDS = tuple(LichSuTraLai.model_fields)
+
+
+def lich_su_tra_lai_to_dict(row) -> dict:
+    """Trusted row-to-dict for LichSuTraLai rows loaded from the database (no validation)"""
+    return {field: getattr(row, field) for field in LICH_SU_TRA_LAI_FIELDS}
@@ -1,6 +1,8 @@
-from typing import Any, Optional, Generic, TypeVar
+from typing import Any, Optional, Generic, TypeVar, Dict
 from pydantic import BaseModel
 
+from app.core.responses import FastJSONResponse
+
 DataType = TypeVar('DataType')
 
 class ApiResponse(BaseModel, Generic[DataType]):
@@ -29,3 +31,26 @@ class ApiResponse(BaseModel, Generic[DataType]):
             message=None,
             error=error
         )
+
+    @classmethod
+    def trusted_response(
+        cls,
+        data: Any,
+        message: str = "Success",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> FastJSONResponse:
+        """
+        Create a successful response without re-validating data.
+
+        Only for data built straight from database rows (model_construct / row dicts):
+        the envelope is rendered by orjson and FastAPI's response_model validation is skipped.
+        """
+        return FastJSONResponse(
+            content={
+                "success": True,
+                "data": data,
+                "message": message,
+                "error": None
+            },
+            headers=headers
+        )
@@ -0,0 +1,777 @@
+"""
+Nightly accrual (cộng dồn) của lịch sử trả lãi
+
+Logic cho từng hợp đồng tách khỏi vòng lặp để có thể chạy:
+- tuần tự trong 1 session (crud.lich_su_tra_lai.auto_create_lich_su)
+- song song theo shard MaHD, mỗi shard 1 process, mỗi chunk commit riêng (run_accrual)
+
+Mỗi ngày có 1 dòng job_runs; hợp đồng xử lý xong được ghi checkpoint trong cùng
+transaction, nên chạy lại (restart container, cron + RUN_ON_STARTUP) chỉ xử lý
+các hợp đồng còn lại và không bao giờ cộng dồn 2 lần.
+
+Quy tắc cộng dồn là hàm thuần trên danh sách kỳ đã load (ORM hoặc PeriodState),
+nên cùng 1 code được dùng cho lần chạy thật và cho dry-run (simulate_accrual).
+"""
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, bindparam, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.core.database import SessionLocal
+from app.core.enums import TrangThaiThanhToan, TrangThaiJob
+from app.crud import job_run as crud_job_run
+from app.models.job_run import JobRun
+from app.models.lich_su_tra_lai import LichSuTraLai
+from app.models.tin_chap import TinChap
+from app.models.tra_gop import TraGop
+from app.services.metrics import JobMetrics
+from app.services.projection import invalidate_projection
+
+logger = logging.getLogger(__name__)
+
+ACCRUAL_WORKERS = int(os.getenv("ACCRUAL_WORKERS", "1"))
+ACCRUAL_CHUNK_SIZE = int(os.getenv("ACCRUAL_CHUNK_SIZE", "200"))
+ACCRUAL_CATCH_UP_MAX_DAYS = int(os.getenv("ACCRUAL_CATCH_UP_MAX_DAYS", "31"))
+ACCRUAL_PROGRESS_INTERVAL = float(os.getenv("ACCRUAL_PROGRESS_INTERVAL", "2"))
+ACCRUAL_JOB_NAME = "accrual"
+
+# Bộ đếm hợp đồng đã xử lý dùng chung giữa các process shard (gán qua initializer)
+_progress_counter = None
+
+
+def _first_on(periods: Sequence, ngay: date):
+    """Kỳ đầu tiên (theo Stt) có Ngay == ngay, hoặc None"""
+    return next((p for p in periods if p.Ngay == ngay), None)
+
+
+def _new_period(ma_hd: str, date_now: date, so_tien: int, noi_dung: str, ky_thu: int) -> dict:
+    return {
+        "MaHD": ma_hd,
+        "Ngay": date_now,
+        "SoTien": so_tien,
+        "NoiDung": noi_dung,
+        "KyThu": ky_thu,
+        "TrangThaiThanhToan": TrangThaiThanhToan.CHUA_THANH_TOAN.value,
+        "TienDaTra": 0,
+    }
+
+
+def accrue_tin_chap(contract: TinChap, periods: Sequence, date_now: date) -> dict:
+    """
+    Cộng dồn cho 1 hợp đồng tín chấp, thuần in-memory
+
+    Nếu hôm nay là ngày đóng lãi: dồn phần chưa trả của các kỳ cũ vào kỳ hôm nay
+    (cập nhật kỳ hôm nay nếu đã có, ngược lại tạo mới).
+
+    Args:
+        contract: Hợp đồng (chỉ đọc)
+        periods: Toàn bộ kỳ của hợp đồng theo Stt (ORM hoặc PeriodState), bị sửa tại chỗ
+        date_now: Ngày chạy
+
+    Returns:
+        dict: {"created": 0/1, "updated": 0/1, "new": [kỳ mới cần thêm (dict)]}
+    """
+    ma_hd = contract.MaHD
+    # Kiểm tra hôm nay có phải là ngày đóng lãi không
+    ky_dong = contract.KyDong
+    if (date_now.day - contract.NgayVay.day) % ky_dong != 0:
+        return {"created": 0, "updated": 0, "new": []}
+
+    # Tính số tiền cộng dồn từ tất cả các kỳ chưa trả
+    tong_tien_chua_tra = 0
+    lich_sus_chua_tra = [p for p in periods if p.SoTien > p.TienDaTra and p.SoTien != 0]
+
+    # Cập nhật tất cả các kỳ cũ: SoTien = 0
+    for ls in lich_sus_chua_tra:
+        tong_tien_chua_tra += (ls.SoTien - ls.TienDaTra)
+        ls.SoTien = 0
+        # Cập nhật NoiDung để bỏ phần cộng dồn
+        if ls.KyThu is not None:
+            ls.NoiDung = f"Trả lãi kỳ {ls.KyThu}"
+
+    # Cập nhật hoặc tạo bản ghi cho hôm nay với số tiền = lãi ngày + cộng dồn
+    existing_today = _first_on(periods, date_now)
+
+    so_tien_ky_moi = (contract.LaiSuat or 0) + tong_tien_chua_tra
+    if existing_today:
+        existing_today.SoTien = so_tien_ky_moi
+        # Cập nhật NoiDung thể hiện cộng dồn
+        existing_today.NoiDung = f"Trả lãi kỳ (cộng dồn {tong_tien_chua_tra})"
+        return {"created": 0, "updated": 1, "new": []}
+
+    new_period = _new_period(ma_hd, date_now, so_tien_ky_moi, f"Trả lãi kỳ 1 (cộng dồn {tong_tien_chua_tra})", 1)
+    return {"created": 1, "updated": 0, "new": [new_period]}
+
+
+def accrue_tra_gop(contract: TraGop, periods: Sequence, date_now: date) -> dict:
+    """
+    Cộng dồn cho 1 hợp đồng trả góp, thuần in-memory
+
+    Bước 1: nếu hôm nay đã có kỳ, dồn phần chưa trả của kỳ trước (Ngay - KyDong) vào kỳ hôm nay.
+    Bước 2: nếu hôm nay là ngày đóng lãi, bảo đảm kỳ hôm nay tồn tại và bao gồm cộng dồn.
+
+    Bước 2 chọn các kỳ chưa trả theo giá trị đầu vào (trước bước 1) nhưng cộng
+    dồn theo giá trị hiện tại - giữ đúng hành vi của bản cũ chạy trên DB với
+    autoflush=False.
+
+    Args:
+        contract: Hợp đồng (chỉ đọc)
+        periods: Toàn bộ kỳ của hợp đồng theo Stt (ORM hoặc PeriodState), bị sửa tại chỗ
+        date_now: Ngày chạy
+
+    Returns:
+        dict: {"created": số bản ghi tạo, "updated": số bản ghi cập nhật, "new": [kỳ mới (dict)]}
+    """
+    ma_hd = contract.MaHD
+    records_created = 0
+    records_updated = 0
+    ky_dong = contract.KyDong
+    # Giá trị (SoTien, TienDaTra) như trong DB trước khi hợp đồng này được xử lý
+    chua_tra_ban_dau = {id(p) for p in periods if p.SoTien > p.TienDaTra and p.SoTien != 0}
+
+    # Ngày của kỳ cuối cùng (None nếu hợp đồng chưa có lịch sử)
+    end_date = max((p.Ngay for p in periods), default=None)
+
+    # Bước 1: cập nhật kỳ hôm nay (chỉ khi hợp đồng chưa hết kỳ)
+    if end_date is not None and end_date >= date_now:
+        # Kiểm tra ngày hôm nay có phải là ngày đóng lãi không
+        check_ngay_dong_lai = _first_on(periods, date_now)
+        # Tìm kỳ có trạng thái "Đến hạn trả lãi" (kỳ cần cập nhật)
+        latest_ky = None
+        if check_ngay_dong_lai:
+            latest_ky = _first_on(periods, date_now - timedelta(days=ky_dong))
+
+        if check_ngay_dong_lai and latest_ky:
+            # Lưu số tiền gốc trước khi đặt = 0
+            so_tien_goc = latest_ky.SoTien
+            tong_tien_chua_tra = so_tien_goc - latest_ky.TienDaTra
+
+            # Cập nhật kỳ cũ: SoTien = 0
+            latest_ky.SoTien = 0
+
+            # Cập nhật kỳ hôm nay với số tiền cộng dồn
+            so_tien_moi_ky = (contract.SoTienVay + contract.LaiSuat) // contract.SoLanTra
+            check_ngay_dong_lai.SoTien = so_tien_moi_ky + tong_tien_chua_tra
+
+            # Cập nhật NoiDung
+            if latest_ky.KyThu is not None:
+                ky_so = latest_ky.KyThu + 1
+                check_ngay_dong_lai.KyThu = ky_so
+                check_ngay_dong_lai.NoiDung = f"Trả lãi kỳ {ky_so} (cộng dồn {tong_tien_chua_tra})"
+
+            records_updated += 1
+
+    # Bước 2: tạo kỳ hôm nay khi đến hạn mà chưa có
+    if (date_now.day - contract.NgayVay.day) % ky_dong != 0:
+        return {"created": records_created, "updated": records_updated, "new": []}
+
+    # Kiểm tra đã có lịch sử cho ngày hôm nay chưa
+    existing_today = _first_on(periods, date_now)
+
+    if existing_today:
+        # Nếu đã có, bảo đảm số tiền hôm nay bao gồm cộng dồn
+        # Tính số tiền cộng dồn từ các kỳ chưa trả (trước hôm nay)
+        tong_tien_chua_tra = 0
+        lich_sus_chua_tra = [p for p in periods if p.Ngay < date_now and id(p) in chua_tra_ban_dau]
+        for ls in lich_sus_chua_tra:
+            tong_tien_chua_tra += (ls.SoTien - ls.TienDaTra)
+            ls.SoTien = 0
+        so_tien_moi_ky = (contract.SoTienVay + contract.LaiSuat) // contract.SoLanTra
+        existing_today.SoTien = so_tien_moi_ky + tong_tien_chua_tra
+        records_updated += 1
+        return {"created": records_created, "updated": records_updated, "new": []}
+
+    # Tính số tiền cộng dồn từ tất cả các kỳ chưa trả
+    tong_tien_chua_tra = 0
+    lich_sus_chua_tra = [p for p in periods if id(p) in chua_tra_ban_dau]
+    # Cập nhật tất cả các kỳ cũ: SoTien = 0
+    for ls in lich_sus_chua_tra:
+        # Tính số tiền chưa trả TRƯỚC KHI set SoTien = 0
+        so_tien_chua_tra = ls.SoTien - ls.TienDaTra
+        if so_tien_chua_tra > 0:  # Chỉ cộng dồn nếu thực sự chưa trả đủ
+            tong_tien_chua_tra += so_tien_chua_tra
+        # Sau đó mới set SoTien = 0
+        ls.SoTien = 0
+        # Cập nhật NoiDung để bỏ phần cộng dồn
+        if ls.KyThu is not None:
+            ls.NoiDung = f"Trả lãi kỳ {ls.KyThu}"
+
+    # Tạo bản ghi mới cho hôm nay với số tiền = (Gốc+Lãi)/Số lần + cộng dồn
+    so_tien_moi_ky = (contract.SoTienVay + contract.LaiSuat) // contract.SoLanTra
+    if end_date is not None and end_date < date_now:
+        so_tien_ky_moi = tong_tien_chua_tra
+    else:
+        so_tien_ky_moi = so_tien_moi_ky + tong_tien_chua_tra
+
+    ky_so = len(lich_sus_chua_tra) + 1
+    new_period = _new_period(
+        ma_hd, date_now, so_tien_ky_moi,
+        f"Trả lãi kỳ {ky_so} (cộng dồn {tong_tien_chua_tra})", ky_so,
+    )
+    records_created += 1
+    return {"created": records_created, "updated": records_updated, "new": [new_period]}
+
+
+def accrue_contract(contract, periods: Sequence, date_now: date) -> dict:
+    """Chọn accrue_tin_chap / accrue_tra_gop theo loại hợp đồng"""
+    if isinstance(contract, TinChap):
+        return accrue_tin_chap(contract, periods, date_now)
+    return accrue_tra_gop(contract, periods, date_now)
+
+
+def next_due_date(contract, periods: Sequence, from_date: date) -> date:
+    """
+    Ngày sớm nhất >= from_date mà accrue_contract có thể thay đổi hợp đồng
+
+    - Ngày đóng lãi: (ngày.day - NgayVay.day) % KyDong == 0, cùng quy tắc với accrue_*
+    - Trả góp: thêm ngày của kỳ có sẵn sớm nhất >= from_date (bước 1 của accrue_tra_gop)
+
+    Các ngày khác accrue_* không làm gì, nên job chỉ cần xử lý hợp đồng có
+    NgayDenHanTiepTheo <= ngày chạy.
+    """
+    ngays = [p.Ngay for p in periods] if isinstance(contract, TraGop) else ()
+    return next_due_date_from_dates(contract, ngays, from_date)
+
+
+def next_due_date_from_dates(contract, ngays: Sequence[date], from_date: date) -> date:
+    """Như next_due_date nhưng nhận thẳng danh sách ngày của các kỳ (không cần ORM object)"""
+    ky_dong = contract.KyDong
+    if not ky_dong:
+        return from_date
+    candidate = from_date
+    limit = from_date + timedelta(days=366)
+    while candidate < limit and (candidate.day - contract.NgayVay.day) % ky_dong != 0:
+        candidate += timedelta(days=1)
+    if isinstance(contract, TraGop):
+        upcoming = [ngay for ngay in ngays if ngay >= from_date]
+        if upcoming:
+            candidate = min(candidate, min(upcoming))
+    return candidate
+
+
+def due_filter(model, date_now: date):
+    """Điều kiện WHERE: hợp đồng chưa tất toán và đến hạn xử lý vào date_now (dùng index NgayDenHanTiepTheo)"""
+    return and_(
+        model.TrangThai != "DA_TAT_TOAN",
+        or_(model.NgayDenHanTiepTheo.is_(None), model.NgayDenHanTiepTheo <= date_now),
+    )
+
+
+def save_next_due_dates(db: Session, next_due: List[Tuple[object, date]]) -> None:
+    """
+    Ghi NgayDenHanTiepTheo cho các hợp đồng (1 executemany mỗi bảng, không commit)
+
+    UPDATE thẳng trên bảng: không tăng Version vì dữ liệu hợp đồng trả về cho client không đổi.
+    """
+    for model in (TinChap, TraGop):
+        params = [
+            {"b_ma_hd": contract.MaHD, "b_ngay": ngay}
+            for contract, ngay in next_due
+            if isinstance(contract, model)
+        ]
+        if params:
+            table = model.__table__
+            db.execute(
+                update(table)
+                .where(table.c.MaHD == bindparam("b_ma_hd"))
+                .values(NgayDenHanTiepTheo=bindparam("b_ngay")),
+                params,
+            )
+
+
+def load_periods(db: Session, ma_hds: List[str]) -> Dict[str, List[LichSuTraLai]]:
+    """
+    Toàn bộ kỳ của các hợp đồng trong 1 query, nhóm theo MaHD, sắp theo Stt
+
+    populate_existing: ghi đè giá trị cũ trong identity map (sau UPDATE hàng loạt).
+    """
+    periods: Dict[str, List[LichSuTraLai]] = defaultdict(list)
+    if not ma_hds:
+        return periods
+    rows = (
+        db.query(LichSuTraLai)
+        .filter(LichSuTraLai.MaHD.in_(ma_hds))
+        .order_by(LichSuTraLai.MaHD, LichSuTraLai.Stt)
+        .populate_existing()
+        .all()
+    )
+    for row in rows:
+        periods[row.MaHD].append(row)
+    return periods
+
+
+def apply_accrual(db: Session, contract, periods: List[LichSuTraLai], date_now: date) -> dict:
+    """
+    Cộng dồn 1 hợp đồng trên các dòng ORM đã load và thêm kỳ mới vào session (không commit)
+
+    Returns:
+        dict: {"created": n, "updated": n}
+    """
+    result = accrue_contract(contract, periods, date_now)
+    for new_period in result["new"]:
+        db.add(LichSuTraLai(**new_period))
+    return {"created": result["created"], "updated": result["updated"]}
+
+
+def _split(items: List[str], parts: int) -> List[List[str]]:
+    """Chia danh sách đã sắp xếp thành `parts` đoạn liên tiếp (bỏ đoạn rỗng)"""
+    size, extra = divmod(len(items), parts)
+    result = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            result.append(items[start:end])
+        start = end
+    return result
+
+
+def _new_day_summary() -> dict:
+    return {
+        "contracts_processed": 0,
+        "records_created": 0,
+        "records_updated": 0,
+        "errors": [],
+    }
+
+
+def _accrual_phase(contract, counts: dict) -> str:
+    """Tên pha đo thời gian cho 1 lần cộng dồn: accrue_tc, accrue_tg_update hoặc accrue_tg_create"""
+    if isinstance(contract, TinChap):
+        return "accrue_tc"
+    return "accrue_tg_create" if counts["created"] else "accrue_tg_update"
+
+
+def _init_progress(counter) -> None:
+    """Initializer của process shard: nhận bộ đếm tiến độ dùng chung"""
+    global _progress_counter
+    _progress_counter = counter
+
+
+def _add_progress(counter, n: int) -> None:
+    if counter is not None:
+        with counter.get_lock():
+            counter.value += n
+
+
+def _run_shard(runs: List[Tuple[int, date]], ma_hds: List[str], chunk_size: int, counter=None) -> dict:
+    """
+    Xử lý 1 shard MaHD trong process hiện tại cho các ngày trong `runs` (theo thứ tự ngày)
+
+    Mỗi chunk dùng 1 session riêng và commit 1 lần cho tất cả các ngày. Với từng
+    ngày: cộng dồn từng hợp đồng chưa xong trong 1 SAVEPOINT kèm checkpoint
+    (TrangThaiNgayThanhToan được tính khi đọc, không cần cập nhật); hợp đồng lỗi chỉ bị
+    rollback một mình, không có checkpoint và bị bỏ qua ở các ngày sau (để không
+    xử lý lệch thứ tự ngày) - lần chạy sau sẽ thử lại.
+
+    Args:
+        runs: [(job_run_id, ngày)] sắp xếp tăng dần theo ngày
+        ma_hds: MaHD của shard (đã sắp xếp)
+        chunk_size: Số hợp đồng mỗi lần commit
+        counter: multiprocessing.Value cộng thêm số hợp đồng sau mỗi chunk (tiến độ);
+            trong process shard mặc định là bộ đếm nhận qua _init_progress
+
+    Returns:
+        dict: {"days": {job_run_id: tổng hợp của ngày}, "chunks_committed": n, "metrics": đo đạc của process}
+    """
+    summary = {"days": {job_run_id: _new_day_summary() for job_run_id, _ in runs}, "chunks_committed": 0}
+    counter = counter if counter is not None else _progress_counter
+    metrics = JobMetrics()
+    with metrics.activate():
+        for start in range(0, len(ma_hds), chunk_size):
+            chunk = ma_hds[start:start + chunk_size]
+            db = SessionLocal()
+            try:
+                with metrics.span("load_contracts"):
+                    contracts = (
+                        db.query(TinChap).filter(TinChap.MaHD.in_(chunk)).all()
+                        + db.query(TraGop).filter(TraGop.MaHD.in_(chunk)).all()
+                    )
+                contracts.sort(key=lambda contract: contract.MaHD)
+                chunk_days = {job_run_id: _new_day_summary() for job_run_id, _ in runs}
+                failed = set()
+                next_due = {c.MaHD: c.NgayDenHanTiepTheo for c in contracts}
+                for job_run_id, date_now in runs:
+                    day = chunk_days[job_run_id]
+                    # Hợp đồng có thể đã được lần chạy khác checkpoint trong lúc shard này chạy
+                    with metrics.span("load_checkpoints"):
+                        done = crud_job_run.filter_done_ma_hds(db, job_run_id, chunk)
+                    pending = [
+                        c for c in contracts
+                        if c.MaHD not in done
+                        and c.MaHD not in failed
+                        and (next_due[c.MaHD] is None or next_due[c.MaHD] <= date_now)
+                    ]
+
+                    with metrics.span("load_periods"):
+                        periods = load_periods(db, [c.MaHD for c in pending])
+                    advanced = []
+                    for contract in pending:
+                        savepoint = db.begin_nested()
+                        try:
+                            started = time.perf_counter()
+                            counts = apply_accrual(db, contract, periods[contract.MaHD], date_now)
+                            metrics.add_span(_accrual_phase(contract, counts), started)
+                            with metrics.span("flush"):
+                                crud_job_run.add_checkpoint(db, job_run_id, contract.MaHD)
+                                savepoint.commit()
+                        except Exception as e:
+                            savepoint.rollback()
+                            failed.add(contract.MaHD)
+                            day["errors"].append({"MaHD": contract.MaHD, "error": str(e)})
+                            continue
+                        started = time.perf_counter()
+                        next_due[contract.MaHD] = next_due_date(contract, periods[contract.MaHD], date_now + timedelta(days=1))
+                        advanced.append((contract, next_due[contract.MaHD]))
+                        metrics.add_span("next_due", started)
+                        day["contracts_processed"] += 1
+                        day["records_created"] += counts["created"]
+                        day["records_updated"] += counts["updated"]
+                    with metrics.span("commit"):
+                        save_next_due_dates(db, advanced)
+                        crud_job_run.add_job_run_counters(
+                            db,
+                            job_run_id,
+                            contracts_done=day["contracts_processed"],
+                            records_created=day["records_created"],
+                            records_updated=day["records_updated"],
+                        )
+                with metrics.span("commit"):
+                    db.commit()
+            except Exception as e:
+                db.rollback()
+                # Cả chunk bị rollback: không ngày nào được xem là hoàn thành cho chunk này
+                for job_run_id, _ in runs:
+                    summary["days"][job_run_id]["errors"].append({"MaHD": f"{chunk[0]}..{chunk[-1]}", "error": str(e)})
+                continue
+            finally:
+                db.close()
+                _add_progress(counter, len(chunk))
+
+            for job_run_id, day in chunk_days.items():
+                for key, value in day.items():
+                    summary["days"][job_run_id][key] += value
+            summary["chunks_committed"] += 1
+    summary["metrics"] = metrics.as_dict()
+    return summary
+
+
+def get_catch_up_dates(db: Session, today: date) -> List[date]:
+    """
+    Các ngày cần chạy bù: từ sau ngày chạy thành công gần nhất tới `today`
+
+    Chưa từng chạy thành công -> chỉ `today`. Tối đa ACCRUAL_CATCH_UP_MAX_DAYS ngày
+    (các ngày cũ nhất trước); phần còn lại được xử lý ở lần gọi sau.
+    """
+    last_success = db.execute(
+        select(func.max(JobRun.NgayChay)).where(
+            JobRun.TenJob == ACCRUAL_JOB_NAME,
+            JobRun.TrangThai == TrangThaiJob.HOAN_THANH.value,
+            JobRun.NgayChay <= today,
+        )
+    ).scalar()
+    if last_success is None:
+        return [today]
+    days = []
+    current = last_success + timedelta(days=1)
+    while current <= today and len(days) < ACCRUAL_CATCH_UP_MAX_DAYS:
+        days.append(current)
+        current += timedelta(days=1)
+    return days
+
+
+def run_accrual(
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    date_now: Optional[date] = None,
+    catch_up: bool = False,
+    progress: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Chạy job cộng dồn hằng đêm theo shard MaHD (idempotent, resume được)
+
+    1. Xác định các ngày cần chạy: date_now, hoặc (catch_up) mọi ngày từ sau lần
+       chạy thành công gần nhất tới date_now
+    2. Lấy/tạo dòng job_runs cho từng ngày; ngày đã HOAN_THANH thì bỏ qua
+    3. Chỉ lấy các hợp đồng có NgayDenHanTiepTheo <= ngày chạy cuối (hoặc NULL),
+       nên chi phí tỉ lệ với số hợp đồng đến hạn chứ không với cả sổ
+    4. Chia các hợp đồng còn việc thành `workers` shard theo MaHD; mỗi shard chạy
+       trong 1 process với session riêng, đi qua hợp đồng 1 lần và phát lại các
+       ngày theo thứ tự cho từng chunk (chỉ những ngày hợp đồng đến hạn), commit
+       theo chunk và đẩy NgayDenHanTiepTheo sang ngày đến hạn kế tiếp
+
+    Args:
+        workers: Số process (mặc định ACCRUAL_WORKERS); 1 = chạy ngay trong process hiện tại
+        chunk_size: Số hợp đồng mỗi lần commit (mặc định ACCRUAL_CHUNK_SIZE)
+        date_now: Ngày chạy (mặc định hôm nay)
+        catch_up: Chạy bù các ngày bị lỡ (scheduler/backend ngừng hoạt động)
+        progress: Hàm nhận {"contracts_total", "contracts_done", "dates"}, gọi mỗi
+            ACCRUAL_PROGRESS_INTERVAL giây trong lúc các shard chạy và 1 lần khi xong
+
+    Returns:
+        dict: Tổng hợp kết quả (tổng và theo từng ngày)
+    """
+    started = time.perf_counter()
+    workers = max(1, workers or ACCRUAL_WORKERS)
+    chunk_size = max(1, chunk_size or ACCRUAL_CHUNK_SIZE)
+    date_now = date_now or date.today()
+    metrics = JobMetrics()
+
+    db = SessionLocal()
+    try:
+        with metrics.activate(), metrics.span("plan"):
+            dates = get_catch_up_dates(db, date_now) if catch_up else [date_now]
+            # Chỉ các hợp đồng đến hạn trong khoảng ngày chạy (index NgayDenHanTiepTheo)
+            ma_hds = sorted(
+                list(db.execute(select(TinChap.MaHD).where(due_filter(TinChap, dates[-1]))).scalars())
+                + list(db.execute(select(TraGop.MaHD).where(due_filter(TraGop, dates[-1]))).scalars())
+            ) if dates else []
+
+            runs: List[Tuple[int, date]] = []
+            already_completed: List[date] = []
+            pending = set()
+            skipped: Dict[int, int] = {}
+            resumed = False
+            for run_date in dates:
+                job_run = crud_job_run.get_or_create_job_run(db, ACCRUAL_JOB_NAME, run_date)
+                if job_run.TrangThai == TrangThaiJob.HOAN_THANH.value:
+                    already_completed.append(run_date)
+                    continue
+                resumed = resumed or job_run.SoLanChay > 0
+                done = crud_job_run.get_done_ma_hds(db, job_run.Id)
+                pending.update(ma_hd for ma_hd in ma_hds if ma_hd not in done)
+                skipped[job_run.Id] = len(done)
+                job_run.TrangThai = TrangThaiJob.DANG_CHAY.value
+                job_run.SoLanChay += 1
+                job_run.SoHopDong = len(set(ma_hds) | done)
+                job_run.KetThuc = None
+                runs.append((job_run.Id, run_date))
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Lỗi khi tự động cập nhật lịch sử: {str(e)}")
+    finally:
+        db.close()
+
+    if not runs:
+        logger.info(f"Accrual {date_now}: đã hoàn thành trước đó, bỏ qua")
+        return {
+            "success": True,
+            "message": f"Job cộng dồn ngày {date_now} đã hoàn thành trước đó",
+            "dates": [],
+            "already_completed": [d.isoformat() for d in already_completed],
+            "days": [],
+            "contracts_processed": 0,
+            "records_created": 0,
+            "records_updated": 0,
+            "chunks_committed": 0,
+            "errors": [],
+        }
+
+    shards = _split(sorted(pending), workers)
+    # Mỗi shard tự đo trong process của nó; "shards" là thời gian chờ (wall-clock) tất cả shard
+    # spawn: process con không kế thừa connection pool / thread của uvicorn
+    context = multiprocessing.get_context("spawn")
+    with metrics.span("shards"):
+        if progress is None and len(shards) <= 1:
+            results = [_run_shard(runs, shard, chunk_size) for shard in shards]
+        else:
+            counter = context.Value("i", 0) if progress is not None else None
+            if len(shards) <= 1:
+                executor = ThreadPoolExecutor(max_workers=1)
+                futures = [executor.submit(_run_shard, runs, shard, chunk_size, counter) for shard in shards]
+            else:
+                executor = ProcessPoolExecutor(
+                    max_workers=len(shards),
+                    mp_context=context,
+                    initializer=_init_progress,
+                    initargs=(counter,),
+                )
+                futures = [executor.submit(_run_shard, runs, shard, chunk_size) for shard in shards]
+            with executor:
+                progress_dates = [run_date.isoformat() for _, run_date in runs]
+                not_done = futures
+                while True:
+                    _, not_done = wait(not_done, timeout=ACCRUAL_PROGRESS_INTERVAL if progress else None)
+                    if progress is not None:
+                        progress({
+                            "contracts_total": len(pending),
+                            "contracts_done": counter.value,
+                            "dates": progress_dates,
+                        })
+                    if not not_done:
+                        break
+                results = [future.result() for future in futures]
+
+    days = {job_run_id: _new_day_summary() for job_run_id, _ in runs}
+    chunks_committed = 0
+    for result in results:
+        chunks_committed += result["chunks_committed"]
+        metrics.merge(result["metrics"])
+        for job_run_id, day in result["days"].items():
+            for key, value in day.items():
+                days[job_run_id][key] += value
+    metrics_dict = metrics.as_dict()
+    db = SessionLocal()
+    try:
+        chi_so = json.dumps(metrics_dict)
+        for job_run_id, _ in runs:
+            crud_job_run.finish_job_run(db, job_run_id, so_loi=len(days[job_run_id]["errors"]), chi_so=chi_so)
+        db.commit()
+        invalidate_projection()
+    finally:
+        db.close()
+
+    day_list = [
+        {
+            "job_run_id": job_run_id,
+            "NgayChay": run_date.isoformat(),
+            "contracts_skipped": skipped[job_run_id],
+            **days[job_run_id],
+        }
+        for job_run_id, run_date in runs
+    ]
+    totals = {
+        key: sum(day[key] for day in day_list)
+        for key in ("contracts_processed", "records_created", "records_updated")
+    }
+    errors = [{"NgayChay": day["NgayChay"], **error} for day in day_list for error in day["errors"]]
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(
+        f"Accrual {runs[0][1]}..{runs[-1][1]} ({len(runs)} ngày): {totals['contracts_processed']} lượt xử lý, "
+        f"{len(shards)} shard, {len(errors)} lỗi, {elapsed_ms} ms"
+    )
+    logger.info(
+        "Accrual phases: "
+        + ", ".join(f"{name} {span['ms']} ms" for name, span in metrics_dict["spans"].items())
+        + f"; {metrics_dict['sql']['statements']} SQL, {metrics_dict['sql']['rows_read']} dòng đọc, "
+        f"{metrics_dict['sql']['rows_written']} dòng ghi, RSS đỉnh {metrics_dict['peak_rss_kb']} KB"
+    )
+    return {
+        "success": not errors,
+        "message": f"Đã xử lý {len(runs)} ngày, {len(pending)}/{len(ma_hds)} hợp đồng",
+        "resumed": resumed,
+        "dates": [run_date.isoformat() for _, run_date in runs],
+        "already_completed": [d.isoformat() for d in already_completed],
+        "days": day_list,
+        **totals,
+        "chunks_committed": chunks_committed,
+        "errors": errors,
+        "workers": len(shards),
+        "chunk_size": chunk_size,
+        "elapsed_ms": elapsed_ms,
+        "metrics": metrics_dict,
+    }
+
+
+@dataclass(slots=True)
+class PeriodState:
+    """Bản sao 1 kỳ lịch sử trả lãi (không gắn session) cho dry-run"""
+    Stt: int
+    MaHD: str
+    Ngay: date
+    SoTien: int
+    TienDaTra: int
+    NoiDung: str
+    KyThu: Optional[int]
+    TrangThaiThanhToan: str
+
+
+_SIMULATED_FIELDS = ("SoTien", "NoiDung", "KyThu")
+
+
+def simulate_accrual(db: Session, date_now: Optional[date] = None, ma_hds: Optional[List[str]] = None) -> dict:
+    """
+    Dry-run job cộng dồn của 1 ngày: không ghi gì vào DB
+
+    Load các hợp đồng chưa tất toán đến hạn vào date_now và toàn bộ kỳ của chúng
+    1 lần (2 + 1 query), áp dụng quy tắc cộng dồn trong bộ nhớ và trả về
+    chênh lệch theo từng hợp đồng. Hợp đồng đã có checkpoint của ngày đó bị bỏ qua
+    (giống lần chạy thật).
+
+    Args:
+        date_now: Ngày mô phỏng (mặc định hôm nay)
+        ma_hds: Chỉ mô phỏng các hợp đồng này (None = tất cả)
+
+    Returns:
+        dict: {"NgayChay", "contracts": [{"MaHD", "updates", "creates"}], tổng hợp}
+    """
+    started = time.perf_counter()
+    date_now = date_now or date.today()
+
+    tc_query = db.query(TinChap).filter(due_filter(TinChap, date_now))
+    tg_query = db.query(TraGop).filter(due_filter(TraGop, date_now))
+    if ma_hds is not None:
+        tc_query = tc_query.filter(TinChap.MaHD.in_(ma_hds))
+        tg_query = tg_query.filter(TraGop.MaHD.in_(ma_hds))
+    contracts = sorted(tc_query.all() + tg_query.all(), key=lambda contract: contract.MaHD)
+
+    job_run_id = db.execute(
+        select(JobRun.Id).where(JobRun.TenJob == ACCRUAL_JOB_NAME, JobRun.NgayChay == date_now)
+    ).scalar()
+    done = crud_job_run.get_done_ma_hds(db, job_run_id) if job_run_id is not None else set()
+    pending = [contract for contract in contracts if contract.MaHD not in done]
+
+    periods: Dict[str, List[PeriodState]] = defaultdict(list)
+    if pending:
+        rows = db.execute(
+            select(
+                LichSuTraLai.Stt,
+                LichSuTraLai.MaHD,
+                LichSuTraLai.Ngay,
+                LichSuTraLai.SoTien,
+                LichSuTraLai.TienDaTra,
+                LichSuTraLai.NoiDung,
+                LichSuTraLai.KyThu,
+                LichSuTraLai.TrangThaiThanhToan,
+            )
+            .where(LichSuTraLai.MaHD.in_([contract.MaHD for contract in pending]))
+            .order_by(LichSuTraLai.MaHD, LichSuTraLai.Stt)
+        )
+        for row in rows:
+            periods[row.MaHD].append(PeriodState(*row))
+
+    results = []
+    totals = {"records_created": 0, "records_updated": 0}
+    for contract in pending:
+        contract_periods = periods[contract.MaHD]
+        before = {p.Stt: tuple(getattr(p, name) for name in _SIMULATED_FIELDS) for p in contract_periods}
+        counts = accrue_contract(contract, contract_periods, date_now)
+        totals["records_created"] += counts["created"]
+        totals["records_updated"] += counts["updated"]
+
+        updates = []
+        for p in contract_periods:
+            changes = {
+                name: [old, getattr(p, name)]
+                for name, old in zip(_SIMULATED_FIELDS, before[p.Stt])
+                if old != getattr(p, name)
+            }
+            if changes:
+                updates.append({"Stt": p.Stt, "Ngay": p.Ngay, "changes": changes})
+        if updates or counts["new"]:
+            results.append({"MaHD": contract.MaHD, "updates": updates, "creates": counts["new"]})
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"Accrual dry-run {date_now}: {len(pending)} hợp đồng, {len(results)} có thay đổi, {elapsed_ms} ms")
+    return {
+        "NgayChay": date_now,
+        "contracts_total": len(contracts),
+        "contracts_skipped": len(contracts) - len(pending),
+        "contracts_changed": len(results),
+        **totals,
+        "rows_changed": sum(len(item["updates"]) for item in results),
+        "contracts": results,
+        "elapsed_ms": elapsed_ms,
+    }
@@ -0,0 +1,306 @@
+"""
+Import hàng loạt hợp đồng (tín chấp + trả góp) từ CSV hoặc NDJSON
+
+Mỗi dòng là 1 hợp đồng với cột LoaiHopDong (TC / TG) và các trường giống
+POST /tin-chap, POST /tra-gop (SoLanTra chỉ dùng cho TG):
+
+    LoaiHopDong,HoTen,NgayVay,SoTienVay,KyDong,LaiSuat,SoLanTra
+    TC,Nguyễn Văn A,2024-01-15,10000000,10,50000,
+    TG,Trần Thị B,2025-03-01,20000000,7,4000000,30
+
+Các dòng được xử lý theo batch, mỗi batch 1 transaction:
+1. Validate từng dòng bằng TinChapCreate / TraGopCreate (lỗi ghi theo số dòng)
+2. Cấp trước 1 khối MaHD cho mỗi loại (1 câu nextval trên sequence của loại đó)
+3. Tính lịch kỳ thanh toán (build_payment_schedule) và NgayDenHanTiepTheo
+4. Ghi hợp đồng, kỳ lịch sử trả lãi và dòng lich_su bằng COPY FROM STDIN
+
+Kết quả giống như tạo từng hợp đồng qua API rồi gọi POST /lich-su-tra-lai.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import time
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from app.core.database import unit_of_work
+from app.core.enums import TrangThaiThanhToan
+from app.models.tin_chap import TinChap
+from app.models.tra_gop import TraGop
+from app.schemas.tin_chap import TinChapCreate
+from app.schemas.tra_gop import TraGopCreate
+from app.services.accrual import next_due_date_from_dates
+from app.services.projection import invalidate_projection
+from app.utils.calculations import build_payment_schedule
+from app.utils.id_generator import allocate_ma_hd_range
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_FORMATS = ("csv", "ndjson")
+
+# NULL trong COPY ... (FORMAT csv, NULL '\N'): chuỗi rỗng vẫn là chuỗi rỗng
+_COPY_NULL = r"\N"
+
+_LOAI = {
+    "TC": (TinChap, TinChapCreate, "Tạo hợp đồng tín chấp"),
+    "TG": (TraGop, TraGopCreate, "Tạo hợp đồng trả góp"),
+}
+
+_CONTRACT_COLUMNS = {
+    "TC": ("MaHD", "HoTen", "NgayVay", "SoTienVay", "KyDong", "LaiSuat", "SoTienTraGoc", "TrangThai", "NgayDenHanTiepTheo"),
+    "TG": ("MaHD", "HoTen", "NgayVay", "SoTienVay", "KyDong", "SoLanTra", "LaiSuat", "TrangThai", "NgayDenHanTiepTheo"),
+}
+_PERIOD_COLUMNS = ("MaHD", "Ngay", "SoTien", "NoiDung", "KyThu", "TrangThaiThanhToan", "TienDaTra")
+_AUDIT_COLUMNS = ("ma_hd", "ho_ten", "ngay", "so_tien", "hanh_dong", "loai_hop_dong")
+
+
+def detect_format(content_type: Optional[str] = None, filename: Optional[str] = None) -> str:
+    """Đoán định dạng (csv / ndjson) từ Content-Type hoặc đuôi file, mặc định csv"""
+    hint = (content_type or "").lower()
+    name = (filename or "").lower()
+    if "ndjson" in hint or "jsonl" in hint or "json" in hint or name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "csv"
+
+
+def parse_rows(lines: Iterable[str], fmt: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Đọc từng dòng dữ liệu: (số dòng trong file, dict hoặc None, lỗi hoặc None)
+
+    Ô rỗng (CSV) và giá trị null (NDJSON) được bỏ đi để validate báo "Field required".
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            cleaned = {key.strip(): value.strip() for key, value in row.items() if key and value not in (None, "")}
+            if cleaned:
+                yield reader.line_num, cleaned, None
+        return
+
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"JSON không hợp lệ: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "Mỗi dòng phải là 1 object JSON"
+            continue
+        yield line_no, {key: value for key, value in row.items() if value is not None}, None
+
+
+def validate_row(row: dict):
+    """(loai_hop_dong, schema đã validate) hoặc raise ValueError với thông báo lỗi"""
+    loai = str(row.get("LoaiHopDong", "")).strip().upper()
+    if loai not in _LOAI:
+        raise ValueError("LoaiHopDong phải là TC hoặc TG")
+    _, schema, _ = _LOAI[loai]
+    try:
+        return loai, schema.model_validate(row)
+    except ValidationError as e:
+        raise ValueError("; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+        ))
+
+
+def _copy(db: Session, table: str, columns: Tuple[str, ...], rows: List[tuple]) -> None:
+    """COPY table (columns) FROM STDIN với dữ liệu CSV sinh trong bộ nhớ (trong transaction của db)"""
+    if not rows:
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(_COPY_NULL if value is None else value for value in row)
+    buffer.seek(0)
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{_COPY_NULL}')", buffer)
+    finally:
+        cursor.close()
+
+
+def _load_batch(db: Session, contracts: List[Tuple[int, str, object]], date_now: date) -> Dict[str, object]:
+    """
+    Ghi 1 batch hợp đồng đã validate (không commit)
+
+    Lịch trả lãi được dựng trước khi cấp mã: dòng nào không dựng được lịch (vd: ngày
+    kỳ vượt quá năm 9999) chỉ bị báo lỗi riêng, không làm hỏng cả batch.
+
+    Returns:
+        dict: {"ma_hds": {số dòng: MaHD}, "periods": n, "expired_tra_gop": [MaHD trả góp đã quá kỳ cuối],
+               "errors": [{"row", "error"}]}
+    """
+    errors: List[Dict[str, object]] = []
+    prepared = {"TC": [], "TG": []}
+    for line_no, loai, data in contracts:
+        if loai == "TC":
+            so_lan_tra = 0
+            so_tien_moi_ky = data.LaiSuat
+        else:
+            so_lan_tra = data.SoLanTra
+            so_tien_moi_ky = (data.SoTienVay + data.LaiSuat) // so_lan_tra
+        try:
+            lich = build_payment_schedule(loai, data.NgayVay, data.KyDong, so_tien_moi_ky, so_lan_tra, date_now)
+        except (OverflowError, ValueError) as e:
+            errors.append({"row": line_no, "error": f"Không tạo được lịch trả lãi: {e}"})
+            continue
+        prepared[loai].append((line_no, data, lich))
+    if not prepared["TC"] and not prepared["TG"]:
+        return {"ma_hds": {}, "periods": 0, "expired_tra_gop": [], "errors": errors}
+
+    trang_thai = TrangThaiThanhToan.CHUA_THANH_TOAN.value
+    contract_rows = {"TC": [], "TG": []}
+    period_rows: List[tuple] = []
+    audit_rows: List[tuple] = []
+    ma_hds: Dict[int, str] = {}
+    expired_tra_gop: List[str] = []
+
+    for loai in ("TC", "TG"):
+        model, _, hanh_dong = _LOAI[loai]
+        items = prepared[loai]
+        if not items:
+            continue
+        for (line_no, data, lich), ma_hd in zip(items, allocate_ma_hd_range(db, loai, len(items))):
+            ma_hds[line_no] = ma_hd
+            contract = model(MaHD=ma_hd, NgayVay=data.NgayVay, KyDong=data.KyDong)
+            # Như create_lich_su: chưa có kỳ nào thì NgayDenHanTiepTheo để NULL
+            ngay_den_han = next_due_date_from_dates(contract, lich.ngay, date_now) if len(lich) else None
+            if loai == "TC":
+                contract_rows[loai].append((
+                    ma_hd, data.HoTen, data.NgayVay, data.SoTienVay, data.KyDong, data.LaiSuat, 0, trang_thai, ngay_den_han,
+                ))
+            else:
+                contract_rows[loai].append((
+                    ma_hd, data.HoTen, data.NgayVay, data.SoTienVay, data.KyDong, data.SoLanTra, data.LaiSuat, trang_thai, ngay_den_han,
+                ))
+                if len(lich) and lich.ngay[-1] < date_now:
+                    expired_tra_gop.append(ma_hd)
+            period_rows.extend(
+                (ma_hd, ngay, so_tien, f"Trả lãi kỳ {ky_thu}", ky_thu, trang_thai, 0)
+                for ngay, ky_thu, so_tien in zip(lich.ngay, lich.ky_thu, lich.so_tien)
+            )
+            audit_rows.append((ma_hd, data.HoTen, date_now, data.SoTienVay, hanh_dong, loai))
+
+    _copy(db, "tin_chap", _CONTRACT_COLUMNS["TC"], contract_rows["TC"])
+    _copy(db, "tra_gop", _CONTRACT_COLUMNS["TG"], contract_rows["TG"])
+    _copy(db, "lich_su_tra_lai", _PERIOD_COLUMNS, period_rows)
+    _copy(db, "lich_su", _AUDIT_COLUMNS, audit_rows)
+    return {"ma_hds": ma_hds, "periods": len(period_rows), "expired_tra_gop": expired_tra_gop, "errors": errors}
+
+
+def import_contracts(
+    db: Session,
+    lines: Iterable[str],
+    fmt: str = "csv",
+    batch_size: Optional[int] = None,
+) -> dict:
+    """
+    Import hợp đồng từ các dòng CSV (có header) hoặc NDJSON
+
+    Dòng lỗi validate bị bỏ qua và báo trong `errors` ({"row": số dòng, "error": ...});
+    batch lỗi khi ghi DB bị rollback cả batch, mọi dòng của batch được báo lỗi.
+
+    Args:
+        lines: Các dòng của file (str)
+        fmt: "csv" hoặc "ndjson"
+        batch_size: Số dòng mỗi batch/transaction (mặc định IMPORT_BATCH_SIZE)
+
+    Returns:
+        dict: Số dòng đọc/nhập/lỗi, số kỳ đã tạo, MaHD theo số dòng, lỗi, thời gian và số dòng/giây
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Định dạng không hỗ trợ: {fmt} (csv hoặc ndjson)")
+    batch_size = max(1, batch_size or IMPORT_BATCH_SIZE)
+    started = time.perf_counter()
+    date_now = date.today()
+
+    rows_read = 0
+    imported: Dict[int, str] = {}
+    periods_created = 0
+    errors: List[dict] = []
+    batches = 0
+    expired_tra_gop: List[str] = []
+
+    def flush(batch: List[Tuple[int, dict]]) -> None:
+        nonlocal periods_created, batches
+        valid = []
+        for line_no, row in batch:
+            try:
+                loai, data = validate_row(row)
+            except ValueError as e:
+                errors.append({"row": line_no, "error": str(e)})
+                continue
+            valid.append((line_no, loai, data))
+        if not valid:
+            return
+        try:
+            result = _load_batch(db, valid, date_now)
+            db.commit()
+            invalidate_projection()
+        except Exception as e:
+            db.rollback()
+            # DBAPIError: chỉ lấy thông báo của driver, bỏ câu SQL + tham số
+            message = str(getattr(e, "orig", None) or e).strip().splitlines()[0]
+            errors.extend({"row": line_no, "error": f"Lỗi ghi batch: {message}"} for line_no, _, _ in valid)
+            return
+        errors.extend(result["errors"])
+        if result["ma_hds"]:
+            batches += 1
+        imported.update(result["ma_hds"])
+        periods_created += result["periods"]
+        expired_tra_gop.extend(result["expired_tra_gop"])
+
+    batch: List[Tuple[int, dict]] = []
+    for line_no, row, error in parse_rows(lines, fmt):
+        rows_read += 1
+        if error:
+            errors.append({"row": line_no, "error": error})
+            continue
+        batch.append((line_no, row))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    flush(batch)
+
+    if expired_tra_gop:
+        # Như create_lich_su: trả góp đã quá kỳ cuối thì cộng dồn ngay cho hôm nay
+        # (chỉ các hợp đồng vừa nhập)
+        # Import trong hàm: app.crud.lich_su_tra_lai import app.services.accrual
+        from app.crud.lich_su_tra_lai import auto_create_lich_su
+        try:
+            with unit_of_work(db):
+                auto_create_lich_su(db, ma_hds=expired_tra_gop)
+        except Exception:
+            # Hợp đồng đã được ghi; job cộng dồn hằng đêm sẽ xử lý tiếp
+            logger.exception("Import hợp đồng: cộng dồn trả góp quá hạn thất bại")
+
+    elapsed = time.perf_counter() - started
+    errors.sort(key=lambda error: error["row"])
+    result = {
+        "success": not errors,
+        "rows_read": rows_read,
+        "rows_imported": len(imported),
+        "rows_failed": len(errors),
+        "periods_created": periods_created,
+        "batches_committed": batches,
+        "batch_size": batch_size,
+        "ma_hd": {str(line_no): ma_hd for line_no, ma_hd in sorted(imported.items())},
+        "errors": errors,
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "rows_per_second": round(rows_read / elapsed, 1) if elapsed > 0 else None,
+    }
+    logger.info(
+        f"Import hợp đồng: {result['rows_imported']}/{rows_read} dòng, {periods_created} kỳ, "
+        f"{len(errors)} lỗi, {result['elapsed_ms']} ms ({result['rows_per_second']} dòng/s)"
+    )
+    return result
@@ -0,0 +1,114 @@
+"""
+Đo đạc cho job chạy nền: thời gian theo từng pha, số câu SQL, số dòng đọc/ghi, bộ nhớ đỉnh
+
+    metrics = JobMetrics()
+    with metrics.activate():
+        with metrics.span("load_contracts"):
+            ...
+    metrics.as_dict()
+
+Câu SQL được đếm qua event after_cursor_execute của SQLAlchemy, chỉ khi có
+JobMetrics đang active trong context hiện tại (ContextVar), nên các request API
+chạy song song trên cùng engine không bị tính vào.
+"""
+import resource
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_active: ContextVar[Optional["JobMetrics"]] = ContextVar("job_metrics", default=None)
+
+_READ_VERBS = {"SELECT", "WITH"}
+_WRITE_VERBS = {"INSERT", "UPDATE", "DELETE"}
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    metrics = _active.get()
+    if metrics is not None:
+        metrics.record_statement(statement, cursor.rowcount)
+
+
+def peak_rss_kb() -> int:
+    """Bộ nhớ RSS đỉnh của process hiện tại (KB, Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class JobMetrics:
+    """
+    Bộ đếm cho 1 lần chạy job trong 1 process; gộp kết quả của các process khác bằng merge()
+
+    peak_rss_kb là RSS đỉnh của cả process (ru_maxrss), lấy max khi gộp.
+    """
+
+    def __init__(self):
+        self.spans_ms: Dict[str, float] = defaultdict(float)
+        self.span_counts: Counter = Counter()
+        self.statements: Counter = Counter()
+        self.rows_read = 0
+        self.rows_written = 0
+        self.peak_rss_kb = 0
+
+    @contextmanager
+    def activate(self) -> Iterator["JobMetrics"]:
+        """Đếm câu SQL của context hiện tại vào bộ đếm này (lồng nhau được)"""
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+            self.peak_rss_kb = max(self.peak_rss_kb, peak_rss_kb())
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Cộng thời gian của khối lệnh vào pha `name`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, started)
+
+    def add_span(self, name: str, started: float) -> None:
+        """Cộng thời gian từ `started` (time.perf_counter()) tới giờ vào pha `name`"""
+        self.spans_ms[name] += (time.perf_counter() - started) * 1000
+        self.span_counts[name] += 1
+
+    def record_statement(self, statement: str, rowcount: int) -> None:
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+        self.statements[verb] += 1
+        if rowcount is None or rowcount < 0:
+            return
+        if verb in _READ_VERBS:
+            self.rows_read += rowcount
+        elif verb in _WRITE_VERBS:
+            self.rows_written += rowcount
+
+    def merge(self, other: dict) -> None:
+        """Gộp kết quả as_dict() của process khác (worker) vào bộ đếm này"""
+        for name, span in other["spans"].items():
+            self.spans_ms[name] += span["ms"]
+            self.span_counts[name] += span["count"]
+        self.statements.update(other["sql"]["by_type"])
+        self.rows_read += other["sql"]["rows_read"]
+        self.rows_written += other["sql"]["rows_written"]
+        self.peak_rss_kb = max(self.peak_rss_kb, other["peak_rss_kb"])
+
+    def as_dict(self) -> dict:
+        return {
+            "spans": {
+                name: {"ms": round(ms, 2), "count": self.span_counts[name]}
+                for name, ms in self.spans_ms.items()
+            },
+            "sql": {
+                "statements": sum(self.statements.values()),
+                "by_type": dict(self.statements),
+                "rows_read": self.rows_read,
+                "rows_written": self.rows_written,
+            },
+            "peak_rss_kb": self.peak_rss_kb,
+        }
@@ -0,0 +1,214 @@
+"""
+Dự báo dòng tiền thu vào của toàn bộ hợp đồng đang hoạt động (theo ngày và theo tuần)
+
+Mỗi ngày trong khoảng [hôm nay, hôm nay + days - 1]:
+- Kỳ đã có trong lich_su_tra_lai (trả góp: cả lịch; tín chấp: kỳ hôm nay và kỳ trả trước):
+  phần còn nợ SoTien - TienDaTra
+- Tín chấp, ngày đóng lãi chưa có kỳ (job cộng dồn sẽ tạo, cùng quy tắc
+  (ngày.day - NgayVay.day) % KyDong == 0): LaiSuat
+
+Phần chưa trả của các kỳ trước hôm nay được báo riêng (overdue): job cộng dồn dồn
+chúng vào kỳ kế tiếp, không phải tiền mới.
+
+Tính theo mảng cho cả sổ: hợp đồng tín chấp được gom theo (NgayVay.day, KyDong), mỗi
+nhóm cộng tổng LaiSuat vào các ngày đóng lãi của nhóm - O(số nhóm x số ngày + số hợp đồng)
+thay vì dựng lịch cho từng hợp đồng. Kết quả được cache trong process tới lần thanh toán /
+thay đổi hợp đồng / chạy job cộng dồn tiếp theo (invalidate_projection) hoặc sang ngày mới.
+"""
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from app.core.enums import TrangThaiThanhToan
+from app.models.lich_su_tra_lai import LichSuTraLai
+from app.models.tin_chap import TinChap
+from app.models.tra_gop import TraGop
+
+logger = logging.getLogger(__name__)
+
+PROJECTION_DAYS = 90
+PROJECTION_MAX_DAYS = 366
+
+# Hợp đồng đã tất toán (giá trị enum; "DA_TAT_TOAN" là giá trị cũ, giống due_filter)
+_DA_TAT_TOAN = (TrangThaiThanhToan.DA_TAT_TOAN.value, "DA_TAT_TOAN")
+
+_cache: Dict[Tuple[date, int], dict] = {}
+_cache_lock = threading.Lock()
+_generation = 0  # Tăng mỗi lần invalidate: kết quả tính trước đó không được ghi vào cache
+
+
+def invalidate_projection() -> None:
+    """Xóa cache dự báo (gọi sau khi thanh toán, thay đổi hợp đồng / lịch, chạy job cộng dồn)"""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        _cache.clear()
+
+
+def project_tin_chap_interest(
+    start: date,
+    days: int,
+    contracts: Iterable[Tuple[str, date, int, int]],
+    existing: Iterable[Tuple[str, date]],
+) -> List[int]:
+    """
+    Tổng LaiSuat của các kỳ tín chấp sẽ được tạo, theo ngày (hàm thuần)
+
+    Args:
+        start: Ngày đầu
+        days: Số ngày
+        contracts: (MaHD, NgayVay, KyDong, LaiSuat) của các hợp đồng tín chấp đang hoạt động
+        existing: (MaHD, Ngay) các kỳ tín chấp đã có trong khoảng (đã tính theo phần còn nợ)
+
+    Returns:
+        Mảng days phần tử: tiền lãi dự kiến của ngày start + i
+    """
+    doms = [(start + timedelta(days=i)).day for i in range(days)]
+    totals = [0] * days
+
+    # Gom theo (ngày trong tháng của NgayVay, KyDong): cùng nhóm thì cùng các ngày đóng lãi
+    groups: Dict[Tuple[int, int], int] = defaultdict(int)
+    by_ma_hd: Dict[str, Tuple[int, int, int]] = {}
+    for ma_hd, ngay_vay, ky_dong, lai_suat in contracts:
+        if not ky_dong or ky_dong <= 0 or not lai_suat:
+            continue
+        groups[(ngay_vay.day, ky_dong)] += lai_suat
+        by_ma_hd[ma_hd] = (ngay_vay.day, ky_dong, lai_suat)
+
+    for (ngay_vay_day, ky_dong), lai_suat in groups.items():
+        for i, dom in enumerate(doms):
+            if (dom - ngay_vay_day) % ky_dong == 0:
+                totals[i] += lai_suat
+
+    # Ngày đóng lãi đã có kỳ: kỳ đó đã được tính theo phần còn nợ, bỏ LaiSuat dự kiến
+    for ma_hd, ngay in set(existing):
+        contract = by_ma_hd.get(ma_hd)
+        i = (ngay - start).days
+        if contract is None or not 0 <= i < days:
+            continue
+        ngay_vay_day, ky_dong, lai_suat = contract
+        if (ngay.day - ngay_vay_day) % ky_dong == 0:
+            totals[i] -= lai_suat
+    return totals
+
+
+def bucket_weekly(start: date, values: Sequence[int]) -> List[Tuple[date, date, int]]:
+    """Cộng mảng theo ngày thành các tuần (thứ Hai - Chủ nhật), tuần đầu/cuối có thể thiếu ngày"""
+    weeks: List[Tuple[date, date, int]] = []
+    for i, value in enumerate(values):
+        ngay = start + timedelta(days=i)
+        if not weeks or ngay.weekday() == 0:
+            weeks.append((ngay, ngay, 0))
+        tu_ngay, _, total = weeks[-1]
+        weeks[-1] = (tu_ngay, ngay, total + value)
+    return weeks
+
+
+def _outstanding_by_day(db: Session, model, start: date, end: date) -> Tuple[List[Tuple[date, int]], int]:
+    """
+    Phần còn nợ của các kỳ (hợp đồng model đang hoạt động) theo ngày trong [start, end]
+    và tổng phần còn nợ trước start - 1 query GROUP BY
+    """
+    con_no = func.sum(func.greatest(LichSuTraLai.SoTien - LichSuTraLai.TienDaTra, 0))
+    # Mọi kỳ trước start gom vào 1 nhóm (ngày start - 1), kỳ từ start trở đi giữ ngày của kỳ
+    ngay = func.greatest(LichSuTraLai.Ngay, start - timedelta(days=1))
+    rows = db.execute(
+        select(ngay, con_no)
+        .join(model, model.MaHD == LichSuTraLai.MaHD)
+        .where(model.TrangThai.notin_(_DA_TAT_TOAN), LichSuTraLai.Ngay <= end)
+        .group_by(ngay)
+    ).all()
+    overdue = sum(total or 0 for ngay, total in rows if ngay < start)
+    return [(ngay, total or 0) for ngay, total in rows if ngay >= start], overdue
+
+
+def compute_projection(db: Session, start: Optional[date] = None, days: int = PROJECTION_DAYS) -> dict:
+    """
+    Dự báo tiền thu vào từng ngày / tuần trong `days` ngày từ `start` (không dùng cache)
+
+    5 query: phần còn nợ theo ngày (tín chấp, trả góp), hợp đồng tín chấp đang hoạt động,
+    các kỳ tín chấp đã có trong khoảng, số hợp đồng trả góp.
+    """
+    started = time.perf_counter()
+    start = start or date.today()
+    end = start + timedelta(days=days - 1)
+
+    series = {}
+    overdue = {}
+    for key, model in (("tin_chap", TinChap), ("tra_gop", TraGop)):
+        values = [0] * days
+        rows, overdue[key] = _outstanding_by_day(db, model, start, end)
+        for ngay, total in rows:
+            values[(ngay - start).days] += total
+        series[key] = values
+
+    active_tc = TinChap.TrangThai.notin_(_DA_TAT_TOAN)
+    contracts = db.execute(
+        select(TinChap.MaHD, TinChap.NgayVay, TinChap.KyDong, TinChap.LaiSuat).where(active_tc)
+    ).all()
+    existing = db.execute(
+        select(LichSuTraLai.MaHD, LichSuTraLai.Ngay)
+        .join(TinChap, TinChap.MaHD == LichSuTraLai.MaHD)
+        .where(active_tc, and_(LichSuTraLai.Ngay >= start, LichSuTraLai.Ngay <= end))
+    ).all()
+    interest = project_tin_chap_interest(start, days, contracts, existing)
+    series["tin_chap"] = [a + b for a, b in zip(series["tin_chap"], interest)]
+    so_tra_gop = db.execute(select(func.count()).select_from(TraGop).where(TraGop.TrangThai.notin_(_DA_TAT_TOAN))).scalar()
+
+    totals = [a + b for a, b in zip(series["tin_chap"], series["tra_gop"])]
+    daily = [
+        {"Ngay": start + timedelta(days=i), "tin_chap": tc, "tra_gop": tg, "total": total}
+        for i, (tc, tg, total) in enumerate(zip(series["tin_chap"], series["tra_gop"], totals))
+    ]
+    weekly = [
+        {"TuNgay": tu_ngay, "DenNgay": den_ngay, "tin_chap": tc, "tra_gop": tg, "total": tc + tg}
+        for (tu_ngay, den_ngay, tc), (_, _, tg) in zip(
+            bucket_weekly(start, series["tin_chap"]), bucket_weekly(start, series["tra_gop"])
+        )
+    ]
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"Dự báo dòng tiền {start} +{days} ngày: {len(contracts)} tín chấp, {so_tra_gop} trả góp, {elapsed_ms} ms")
+    return {
+        "TuNgay": start,
+        "DenNgay": end,
+        "days": days,
+        "contracts": {"tin_chap": len(contracts), "tra_gop": so_tra_gop},
+        "total": {"tin_chap": sum(series["tin_chap"]), "tra_gop": sum(series["tra_gop"]), "total": sum(totals)},
+        "overdue": {**overdue, "total": overdue["tin_chap"] + overdue["tra_gop"]},
+        "daily": daily,
+        "weekly": weekly,
+        "computed_at": datetime.datetime.now(),
+        "elapsed_ms": elapsed_ms,
+    }
+
+
+def get_projection(db: Session, days: int = PROJECTION_DAYS) -> dict:
+    """
+    compute_projection từ hôm nay, cache theo (hôm nay, days) tới lần invalidate_projection tiếp theo
+
+    Returns:
+        dict như compute_projection, thêm "cached": True nếu lấy từ cache
+    """
+    key = (date.today(), days)
+    with _cache_lock:
+        cached = _cache.get(key)
+        generation = _generation
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    result = compute_projection(db, key[0], days)
+    with _cache_lock:
+        # Có thanh toán trong lúc tính: kết quả có thể đã cũ, không cache
+        if generation == _generation:
+            # Chỉ giữ các kết quả của hôm nay
+            for stale in [k for k in _cache if k[0] != key[0]]:
+                del _cache[stale]
+            _cache[key] = result
+    return {**result, "cached": False}
@@ -0,0 +1,421 @@
+"""
+Scheduler chạy job định kỳ ngay trong app FastAPI
+
+- Lịch dạng cron 5 trường (phút giờ ngày tháng thứ), theo giờ Asia/Ho_Chi_Minh
+- Mỗi lần chạy lấy Postgres advisory lock theo tên job: nhiều worker/instance
+  cùng bật scheduler thì chỉ 1 worker thực thi, các worker khác bỏ qua
+- Có timeout cho từng job và ghi lịch sử vào bảng job_executions
+- submit() chạy job nền và trả về Id ngay; tiến độ và kết quả được ghi vào
+  job_executions và phát qua WebSocket (job_progress / job_completed)
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+import socket
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+
+from app.core.database import SessionLocal, engine
+from app.core.idempotency import purge_expired_idempotency_keys
+from app.core.enums import TrangThaiThucThiJob
+from app.crud import job_run as crud_job_run
+from app.schemas.job import JobExecution as JobExecutionSchema
+from app.services.accrual import run_accrual
+from app.websocket import manager, EventType, broadcast_job_event
+
+logger = logging.getLogger(__name__)
+
+try:
+    from zoneinfo import ZoneInfo
+    SCHEDULER_TZ = ZoneInfo("Asia/Ho_Chi_Minh")
+except Exception:
+    # Việt Nam không có giờ mùa hè: UTC+7 cố định nếu thiếu tzdata
+    SCHEDULER_TZ = datetime.timezone(datetime.timedelta(hours=7), "Asia/Ho_Chi_Minh")
+
+
+def scheduler_today() -> datetime.date:
+    """
+    Ngày nghiệp vụ theo SCHEDULER_TZ (giờ chạy cron), không theo múi giờ của container
+
+    Container mặc định UTC: lúc 00:00 giờ Việt Nam date.today() vẫn là ngày hôm trước.
+    """
+    return datetime.datetime.now(SCHEDULER_TZ).date()
+
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "false").lower() in ("1", "true", "yes")
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class CronSchedule:
+    """
+    Lịch cron 5 trường: phút (0-59) giờ (0-23) ngày (1-31) tháng (1-12) thứ (0-6, 0 = Chủ nhật)
+
+    Hỗ trợ `*`, số, danh sách `a,b`, khoảng `a-b` và bước `*/n`, `a-b/n`.
+    Như cron: nếu cả ngày và thứ đều bị giới hạn thì khớp một trong hai.
+    """
+
+    _RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Biểu thức cron phải có 5 trường: '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse_field(part, low, high) for part, (low, high) in zip(parts, self._RANGES)
+        )
+        self._day_restricted = parts[2] != "*"
+        self._weekday_restricted = parts[4] != "*"
+
+    @staticmethod
+    def _parse_field(part: str, low: int, high: int) -> Set[int]:
+        values: Set[int] = set()
+        for item in part.split(","):
+            base, _, step_text = item.partition("/")
+            step = int(step_text) if step_text else 1
+            if base == "*":
+                start, end = low, high
+            elif "-" in base:
+                start_text, end_text = base.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = int(base)
+                end = high if step_text else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Giá trị cron ngoài khoảng {low}-{high}: '{item}'")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime.datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.isoweekday() % 7) in self.weekdays
+        if self._day_restricted and self._weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        """Thời điểm khớp lịch đầu tiên sau `moment` (cùng tzinfo với moment)"""
+        candidate = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = candidate + datetime.timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"Biểu thức cron không bao giờ khớp: '{self.expression}'")
+
+
+def advisory_lock_key(name: str) -> int:
+    """Khóa advisory (bigint) ổn định theo tên job"""
+    return int.from_bytes(hashlib.sha1(f"job:{name}".encode("utf-8")).digest()[:8], "big", signed=True)
+
+
+@dataclass
+class ScheduledJob:
+    """Một job đã đăng ký với scheduler"""
+    name: str
+    schedule: CronSchedule
+    func: Callable[[Callable[[dict], None]], object]
+    timeout_seconds: float
+    description: str = ""
+    next_run: Optional[datetime.datetime] = None
+    running: bool = field(default=False)
+
+
+class JobScheduler:
+    """
+    Scheduler asyncio: mỗi job 1 task ngủ tới lần chạy kế tiếp rồi thực thi job
+    (hàm đồng bộ) trong thread pool dưới advisory lock
+    """
+
+    def __init__(self, tz: datetime.tzinfo = SCHEDULER_TZ):
+        self.tz = tz
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._supervisors: Set[asyncio.Task] = set()
+
+    def register(
+        self,
+        name: str,
+        cron: str,
+        func: Callable[[Callable[[dict], None]], object],
+        timeout_seconds: float = 3600,
+        description: str = "",
+    ) -> ScheduledJob:
+        """
+        Đăng ký job `func` chạy theo lịch cron (giờ Asia/Ho_Chi_Minh)
+
+        func nhận 1 tham số progress(dict) để báo tiến độ trong lúc chạy
+        """
+        job = ScheduledJob(
+            name=name,
+            schedule=CronSchedule(cron),
+            func=func,
+            timeout_seconds=timeout_seconds,
+            description=description,
+        )
+        self.jobs[name] = job
+        return job
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        """Bắt đầu các vòng lặp lịch (gọi trong startup event)"""
+        if self._tasks:
+            return
+        for job in self.jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"job:{job.name}"))
+        logger.info(f"⏰ Scheduler started ({WORKER_ID}): {', '.join(self.jobs) or 'không có job'}")
+
+    async def stop(self) -> None:
+        """Dừng các vòng lặp lịch (job đang chạy trong thread vẫn chạy nốt)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self, job: ScheduledJob) -> None:
+        while True:
+            now = datetime.datetime.now(self.tz)
+            job.next_run = job.schedule.next_after(now)
+            await asyncio.sleep(max(0.0, (job.next_run - datetime.datetime.now(self.tz)).total_seconds()))
+            try:
+                await self.run_job(job.name, trigger="schedule")
+            except Exception:
+                logger.exception(f"❌ Job {job.name} lỗi ngoài dự kiến")
+
+    async def submit(self, name: str, trigger: str = "manual") -> Optional[int]:
+        """
+        Bắt đầu job dưới advisory lock và trả về ngay, job chạy nền tới khi xong
+
+        Returns:
+            Id của dòng job_executions, hoặc None nếu worker khác đang giữ lock
+        """
+        started = await self._start(name, trigger)
+        return started[0] if started else None
+
+    async def run_job(
+        self,
+        name: str,
+        trigger: str = "manual",
+        job_func: Optional[Callable[[Callable[[dict], None]], object]] = None,
+    ) -> Optional[int]:
+        """
+        Thực thi job ngay dưới advisory lock và chờ tới khi xong (hoặc quá timeout)
+
+        Args:
+            job_func: Thay hàm đã đăng ký cho lần chạy này (vd: tham số của endpoint cũ),
+                vẫn dưới cùng advisory lock và ghi vào job_executions như job
+
+        Returns:
+            Id của dòng job_executions, hoặc None nếu worker khác đang giữ lock
+        """
+        started = await self._start(name, trigger, job_func)
+        if not started:
+            return None
+        execution_id, supervisor = started
+        await supervisor
+        return execution_id
+
+    async def _start(
+        self,
+        name: str,
+        trigger: str,
+        job_func: Optional[Callable[[Callable[[dict], None]], object]] = None,
+    ) -> Optional[Tuple[int, asyncio.Task]]:
+        job = self.jobs[name]
+        loop = asyncio.get_running_loop()
+        started: asyncio.Future = loop.create_future()
+        # Lock được giữ trong thread tới khi job thật sự kết thúc, kể cả khi đã
+        # quá timeout, để worker khác không chạy chồng lên.
+        worker = asyncio.create_task(asyncio.to_thread(self._execute_locked, job, trigger, loop, started, job_func))
+        try:
+            execution_id = await started
+        except Exception:
+            await asyncio.gather(worker, return_exceptions=True)
+            raise
+        if execution_id is None:
+            await worker
+            logger.info(f"⏭️  Job {name}: worker khác đang chạy, bỏ qua")
+            return None
+
+        job.running = True
+        supervisor = asyncio.create_task(self._supervise(job, execution_id, worker), name=f"job:{name}:{execution_id}")
+        # Giữ tham chiếu tới task nền để không bị GC khi submit() đã trả về
+        self._supervisors.add(supervisor)
+        supervisor.add_done_callback(self._supervisors.discard)
+        return execution_id, supervisor
+
+    async def _supervise(self, job: ScheduledJob, execution_id: int, worker: asyncio.Task) -> None:
+        """Chờ job trong thread, đánh dấu quá thời gian nếu cần rồi phát sự kiện job_completed"""
+        try:
+            await asyncio.wait_for(asyncio.shield(worker), timeout=job.timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.error(f"⏱️  Job {job.name} quá {job.timeout_seconds}s")
+            await asyncio.to_thread(
+                self._finish, execution_id, TrangThaiThucThiJob.QUA_THOI_GIAN.value, loi=f"Quá {job.timeout_seconds} giây"
+            )
+            worker.add_done_callback(lambda _: setattr(job, "running", False))
+        else:
+            job.running = False
+        try:
+            execution = await asyncio.to_thread(self._load_execution, execution_id)
+            if execution:
+                await broadcast_job_event(
+                    manager,
+                    EventType.JOB_COMPLETED,
+                    execution,
+                    message=f"Job {job.name}: {execution['TrangThai']}",
+                )
+        except Exception:
+            logger.exception(f"⚠️  Không phát được sự kiện hoàn thành job {job.name}")
+
+    @staticmethod
+    def _load_execution(execution_id: int) -> Optional[dict]:
+        db = SessionLocal()
+        try:
+            execution = crud_job_run.get_job_execution(db, execution_id)
+            if not execution:
+                return None
+            return JobExecutionSchema.model_validate(execution).model_dump(mode="json")
+        finally:
+            db.close()
+
+    def _progress_reporter(self, job: ScheduledJob, execution_id: int, loop) -> Callable[[dict], None]:
+        """Hàm job gọi (trong thread) để ghi tiến độ vào job_executions.TienDo và phát job_progress"""
+        def report(progress: dict) -> None:
+            # Tiến độ chỉ để theo dõi: lỗi ghi không được làm hỏng job
+            db = SessionLocal()
+            try:
+                crud_job_run.update_job_execution_progress(
+                    db, execution_id, json.dumps(progress, default=str, ensure_ascii=False)
+                )
+            except Exception:
+                logger.exception(f"⚠️  Không ghi được tiến độ job {job.name}")
+            finally:
+                db.close()
+            asyncio.run_coroutine_threadsafe(
+                broadcast_job_event(
+                    manager,
+                    EventType.JOB_PROGRESS,
+                    {"Id": execution_id, "TenJob": job.name, "TienDo": progress},
+                ),
+                loop,
+            )
+        return report
+
+    def _execute_locked(
+        self,
+        job: ScheduledJob,
+        trigger: str,
+        loop,
+        started: asyncio.Future,
+        job_func: Optional[Callable[[Callable[[dict], None]], object]] = None,
+    ) -> None:
+        """Chạy trong thread: lấy lock, ghi lịch sử, gọi job, nhả lock"""
+        def notify(execution_id: Optional[int] = None, error: Optional[BaseException] = None) -> None:
+            def _set() -> None:
+                if started.done():
+                    return
+                if error is not None:
+                    started.set_exception(error)
+                else:
+                    started.set_result(execution_id)
+            loop.call_soon_threadsafe(_set)
+
+        key = advisory_lock_key(job.name)
+        try:
+            conn = engine.connect()
+        except Exception as e:
+            notify(error=e)
+            raise
+        with conn:
+            try:
+                acquired = conn.execute(select(func.pg_try_advisory_lock(key))).scalar()
+                conn.commit()
+            except Exception as e:
+                notify(error=e)
+                raise
+            if not acquired:
+                notify(None)
+                return
+            try:
+                db = SessionLocal()
+                try:
+                    execution_id = crud_job_run.create_job_execution(db, job.name, trigger, WORKER_ID).Id
+                finally:
+                    db.close()
+            except Exception as e:
+                conn.execute(select(func.pg_advisory_unlock(key)))
+                conn.commit()
+                notify(error=e)
+                raise
+            notify(execution_id)
+
+            try:
+                logger.info(f"▶️  Job {job.name} bắt đầu ({trigger}, execution {execution_id})")
+                try:
+                    result = (job_func or job.func)(self._progress_reporter(job, execution_id, loop))
+                except Exception as e:
+                    logger.exception(f"❌ Job {job.name} lỗi")
+                    self._finish(execution_id, TrangThaiThucThiJob.LOI.value, loi=str(e))
+                    return
+                self._finish(
+                    execution_id,
+                    TrangThaiThucThiJob.THANH_CONG.value,
+                    ket_qua=json.dumps(result, default=str, ensure_ascii=False),
+                    only_if_running=True,
+                )
+                logger.info(f"✅ Job {job.name} hoàn thành (execution {execution_id})")
+            finally:
+                conn.execute(select(func.pg_advisory_unlock(key)))
+                conn.commit()
+
+    @staticmethod
+    def _finish(
+        execution_id: int,
+        trang_thai: str,
+        ket_qua: Optional[str] = None,
+        loi: Optional[str] = None,
+        only_if_running: bool = False,
+    ) -> None:
+        db = SessionLocal()
+        try:
+            if only_if_running:
+                # Đã bị đánh dấu quá thời gian: giữ trạng thái đó, chỉ bổ sung kết quả
+                execution = crud_job_run.get_job_execution(db, execution_id)
+                if execution and execution.TrangThai == TrangThaiThucThiJob.QUA_THOI_GIAN.value:
+                    trang_thai, loi = execution.TrangThai, execution.Loi
+            crud_job_run.finish_job_execution(db, execution_id, trang_thai, ket_qua=ket_qua, loi=loi)
+        finally:
+            db.close()
+
+
+scheduler = JobScheduler()
+scheduler.register(
+    "accrual",
+    os.getenv("ACCRUAL_CRON", "0 0 * * *"),
+    lambda progress: run_accrual(date_now=scheduler_today(), catch_up=True, progress=progress),
+    timeout_seconds=float(os.getenv("ACCRUAL_TIMEOUT_SECONDS", "3600")),
+    description="Cộng dồn lịch sử trả lãi hằng ngày (có chạy bù ngày bị lỡ)",
+)
+scheduler.register(
+    "idempotency-cleanup",
+    os.getenv("IDEMPOTENCY_CLEANUP_CRON", "30 * * * *"),
+    purge_expired_idempotency_keys,
+    timeout_seconds=300,
+    description="Xóa Idempotency-Key quá IDEMPOTENCY_TTL_HOURS",
+)
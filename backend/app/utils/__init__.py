@@ -5,7 +5,9 @@ from app.utils.id_generator import generate_tin_chap_id, generate_tra_gop_id
 from app.utils.calculations import (
     calculate_monthly_payment,
     calculate_total_payment,
-    calculate_remaining_amount
+    calculate_remaining_amount,
+    LichThanhToan,
+    build_payment_schedule,
 )
 
 __all__ = [
@@ -14,5 +16,7 @@ __all__ = [
     "calculate_monthly_payment",
     "calculate_total_payment",
     "calculate_remaining_amount",
+    "LichThanhToan",
+    "build_payment_schedule",
 ]
 
@@ -0,0 +1,98 @@
+"""
+Phân bổ 1 khoản thanh toán vào các kỳ (waterfall), hàm thuần không truy cập DB
+
+Dùng chung cho pay_lich_su (tín chấp và trả góp), pay_lich_su_batch và
+tat_toan_hop_dong: caller chọn các kỳ theo thứ tự trả (theo Ngay), đưa vào 2 mảng
+song song (SoTien, TienDaTra) rồi ghi lại kết quả lên các kỳ nhận tiền.
+"""
+from dataclasses import dataclass
+from typing import List, Sequence
+
+from app.core.enums import TrangThaiThanhToan
+
+
+@dataclass(slots=True)
+class PhanBoThanhToan:
+    """
+    Kết quả phân bổ: các mảng song song theo kỳ (gồm cả các kỳ thêm ở cuối)
+
+    Chỉ các kỳ trong chi_so nhận tiền; tien_da_tra / trang_thai của các kỳ khác giữ nguyên giá trị đầu vào.
+    """
+    tien_da_tra: List[int]  # TienDaTra mới
+    nop_vao_ky: List[int]  # Số tiền vào từng kỳ (0 = không nhận tiền)
+    trang_thai: List[str]  # TrangThaiThanhToan mới của kỳ nhận tiền, "" với kỳ khác
+    chi_so: List[int]  # Vị trí các kỳ nhận tiền, tăng dần
+    so_ky_them: int  # Số kỳ thêm sau kỳ cuối (so_tien_ky_them)
+    da_phan_bo: int
+    con_du: int
+
+
+def allocate_waterfall(
+    so_tien_ky: Sequence[int],
+    tien_da_tra: Sequence[int],
+    so_tien: int,
+    so_tien_ky_them: int = 0,
+) -> PhanBoThanhToan:
+    """
+    Rót so_tien vào các kỳ theo thứ tự: mỗi kỳ nhận tối đa phần còn nợ (SoTien - TienDaTra),
+    kỳ đã đủ (hoặc trả dư) bị bỏ qua, dừng khi hết tiền
+
+    Args:
+        so_tien_ky: SoTien của các kỳ, theo thứ tự trả
+        tien_da_tra: TienDaTra của các kỳ (cùng độ dài)
+        so_tien: Số tiền cần phân bổ
+        so_tien_ky_them: > 0: còn tiền sau kỳ cuối thì thêm kỳ mới có SoTien này (trả trước
+            tín chấp); 0: phần còn lại là con_du
+
+    Returns:
+        PhanBoThanhToan; trạng thái kỳ nhận tiền: DONG_DU nếu đã đủ, ngược lại THANH_TOAN_MOT_PHAN.
+        O(số kỳ) để sao chép mảng, vòng phân bổ dừng ngay khi hết tiền.
+    """
+    if len(so_tien_ky) != len(tien_da_tra):
+        raise ValueError("so_tien_ky và tien_da_tra phải cùng độ dài")
+    so_tien_ky = list(so_tien_ky)
+    moi = list(tien_da_tra)
+    nop = [0] * len(moi)
+    trang_thai = [""] * len(moi)
+    chi_so: List[int] = []
+    con_lai = max(0, so_tien)
+
+    i = 0
+    while con_lai > 0 and i < len(moi):
+        thieu = so_tien_ky[i] - moi[i]
+        if thieu > 0:
+            vao = thieu if thieu < con_lai else con_lai
+            moi[i] += vao
+            nop[i] = vao
+            con_lai -= vao
+            chi_so.append(i)
+        i += 1
+
+    so_ky_them = 0
+    if con_lai > 0 and so_tien_ky_them > 0:
+        # Số kỳ mới cần để hết tiền: các kỳ đủ + 1 kỳ một phần (nếu lẻ)
+        so_ky_du, le = divmod(con_lai, so_tien_ky_them)
+        so_ky_them = so_ky_du + (1 if le else 0)
+        dau = len(moi)
+        so_tien_ky.extend([so_tien_ky_them] * so_ky_them)
+        moi.extend([so_tien_ky_them] * so_ky_du + ([le] if le else []))
+        nop.extend(moi[dau:])
+        trang_thai.extend([""] * so_ky_them)
+        chi_so.extend(range(dau, dau + so_ky_them))
+        con_lai = 0
+
+    dong_du = TrangThaiThanhToan.DONG_DU.value
+    mot_phan = TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value
+    for i in chi_so:
+        trang_thai[i] = dong_du if moi[i] >= so_tien_ky[i] else mot_phan
+
+    so_tien = max(0, so_tien)
+    return PhanBoThanhToan(
+        tien_da_tra=moi,
+        nop_vao_ky=nop,
+        trang_thai=trang_thai,
+        chi_so=chi_so,
+        so_ky_them=so_ky_them,
+        da_phan_bo=so_tien - con_lai,
+        con_du=con_lai,
+    )
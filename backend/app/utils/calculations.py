@@ -1,6 +1,10 @@
 """
 Utility functions for financial calculations
 """
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import List
 
 
 def calculate_monthly_payment(principal: int, interest_amount: int, months: int) -> int:
@@ -42,3 +46,55 @@ def calculate_remaining_amount(principal: int, interest_amount: int, months: int
     remaining = total_amount - paid_amount
     return max(0, remaining)
 
+
+@dataclass(slots=True)
+class LichThanhToan:
+    """Lịch các kỳ thanh toán của 1 hợp đồng: các mảng song song, cùng độ dài"""
+    ngay: List[date]
+    ky_thu: List[int]
+    so_tien: List[int]
+
+    def __len__(self) -> int:
+        return len(self.ngay)
+
+
+def build_payment_schedule(
+    loai_hop_dong: str,
+    ngay_vay: date,
+    ky_dong: int,
+    so_tien_moi_ky: int,
+    so_lan_tra: int,
+    date_now: date,
+) -> LichThanhToan:
+    """
+    Tính lịch kỳ thanh toán khi tạo lịch sử trả lãi (hàm thuần, không truy cập DB)
+
+    - Trả Góp (TG): đủ so_lan_tra kỳ từ NgayVay, cách nhau ky_dong ngày. Nếu kỳ cuối đã
+      quá hạn: các kỳ = 0, kỳ cuối = tổng cộng dồn; ngược lại các kỳ quá hạn = 0 và
+      các kỳ còn lại = so_tien_moi_ky * (số kỳ quá hạn + 1)
+    - Tín Chấp (TC): các kỳ NgayVay + ky_dong, + 2*ky_dong, ... tới hôm nay (KyThu từ 0),
+      hoặc 1 kỳ ngày NgayVay nếu vay hôm nay; các kỳ = 0, kỳ cuối = tổng cộng dồn
+
+    Số kỳ quá hạn tính bằng bisect trên mảng ngày (đã tăng dần) nên cả hàm là O(số kỳ).
+    """
+    step = timedelta(days=ky_dong)
+    if loai_hop_dong == "TG":
+        ngay = [ngay_vay + step * i for i in range(so_lan_tra)]
+        ky_thu = list(range(1, so_lan_tra + 1))
+        if not ngay:
+            return LichThanhToan(ngay, ky_thu, [])
+        if ngay[-1] < date_now:
+            so_tien = [0] * (so_lan_tra - 1) + [so_tien_moi_ky * so_lan_tra]
+        else:
+            so_ky_qua_han = bisect_left(ngay, date_now)
+            so_tien = [0] * so_ky_qua_han + [so_tien_moi_ky * (so_ky_qua_han + 1)] * (so_lan_tra - so_ky_qua_han)
+        return LichThanhToan(ngay, ky_thu, so_tien)
+
+    if ngay_vay == date_now:
+        ngay, ky_thu = [ngay_vay], [1]
+    else:
+        so_ky = max(0, (date_now - ngay_vay).days // ky_dong)
+        ngay = [ngay_vay + step * (i + 1) for i in range(so_ky)]
+        ky_thu = list(range(so_ky))
+    so_tien = [0] * (len(ngay) - 1) + [so_tien_moi_ky * len(ngay)] if ngay else []
+    return LichThanhToan(ngay, ky_thu, so_tien)
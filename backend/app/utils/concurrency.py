@@ -0,0 +1,91 @@
+"""
+Concurrency helpers for payment posting (row locks + optimistic retries)
+
+Payments follow a read-modify-write pattern on TienDaTra / SoTienTraGoc / NoiDung:
+- lock_contract: SELECT ... FOR UPDATE on the contract row, so tellers posting to the
+  same contract run one after another (other contracts are not blocked)
+- retry_on_stale_data: writers that do not take the lock (accrual job, PUT with
+  If-Match) are caught by the Version column (StaleDataError) -> rollback and retry
+"""
+import functools
+import os
+import random
+import time
+from typing import Dict, List
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+# Số lần thử lại khi dòng đã bị transaction khác sửa (Version không khớp)
+PAYMENT_RETRY_ATTEMPTS = int(os.getenv("PAYMENT_RETRY_ATTEMPTS", "5"))
+PAYMENT_RETRY_BACKOFF = float(os.getenv("PAYMENT_RETRY_BACKOFF", "0.05"))
+
+
+def lock_contract(db: Session, model, ma_hd: str):
+    """
+    Load a contract with SELECT ... FOR UPDATE (held until commit/rollback)
+
+    populate_existing: a copy already in the session is overwritten with the
+    locked row, so the read-modify-write starts from the latest values.
+
+    Returns:
+        Contract object or None if not found
+    """
+    return (
+        db.query(model)
+        .filter(model.MaHD == ma_hd)
+        .with_for_update()
+        .populate_existing()
+        .first()
+    )
+
+
+def lock_contracts(db: Session, model, ma_hds: List[str]) -> Dict[str, object]:
+    """
+    Like lock_contract for many contracts in one query
+
+    Rows are locked in MaHD order, so two batches touching the same contracts
+    cannot deadlock each other.
+
+    Returns:
+        {MaHD: contract} for the contracts that exist
+    """
+    if not ma_hds:
+        return {}
+    return {
+        contract.MaHD: contract
+        for contract in (
+            db.query(model)
+            .filter(model.MaHD.in_(ma_hds))
+            .order_by(model.MaHD)
+            .with_for_update()
+            .populate_existing()
+        )
+    }
+
+
+def retry_on_stale_data(func):
+    """
+    Retry a crud function (first argument: db) when its flush hits a Version conflict
+
+    The session is rolled back before each retry, so the function must re-read
+    everything it writes and be the first writer of its unit_of_work (the
+    rollback discards the whole transaction). After PAYMENT_RETRY_ATTEMPTS conflicts: 409.
+    """
+    @functools.wraps(func)
+    def wrapper(db: Session, *args, **kwargs):
+        for attempt in range(1, PAYMENT_RETRY_ATTEMPTS + 1):
+            try:
+                return func(db, *args, **kwargs)
+            except StaleDataError:
+                db.rollback()
+                if attempt == PAYMENT_RETRY_ATTEMPTS:
+                    break
+                # Backoff ngẫu nhiên để 2 bên xung đột không thử lại cùng lúc
+                time.sleep(PAYMENT_RETRY_BACKOFF * attempt * random.uniform(0.5, 1.5))
+        raise HTTPException(
+            status_code=409,
+            detail="Dữ liệu hợp đồng đang được cập nhật đồng thời, vui lòng thử lại",
+        )
+    return wrapper
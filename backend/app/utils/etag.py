@@ -0,0 +1,82 @@
+"""
+ETag helpers for conditional GET (If-None-Match -> 304)
+"""
+import hashlib
+from datetime import date
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import select, func
+
+from app.models.lich_su_tra_lai import LichSuTraLai
+
+
+def build_etag(*parts) -> str:
+    """
+    Build a weak ETag from version parts and today's date
+
+    TrangThaiNgayThanhToan is computed from date.today() when rows are read, so the
+    same row versions give a different response after midnight: the date is part
+    of every ETag.
+
+    Args:
+        parts: Values that change whenever the response changes (row versions, counts, ...)
+
+    Returns:
+        Weak ETag, e.g. W/"3f2a..."
+    """
+    raw = "|".join(str(part) for part in (date.today(), *parts))
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header against an ETag
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def _opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return any(_opaque(tag) == _opaque(etag) for tag in if_none_match.split(","))
+
+
+def not_modified_response(request: Request, etag: str) -> Optional[Response]:
+    """
+    Return a 304 response if the client's cached copy is still current, else None
+    """
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    return None
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    """
+    Headers for a full response; no-cache makes the browser revalidate every time
+    """
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def lich_su_version_subquery(ma_hd_column):
+    """
+    Correlated scalar subquery fingerprinting the lịch sử trả lãi of a contract
+
+    count + sum(Version) + max(Stt) changes on every insert, update and delete
+    of the contract's periods.
+    """
+    return (
+        select(
+            func.concat(
+                func.count(LichSuTraLai.Stt), ":",
+                func.coalesce(func.sum(LichSuTraLai.Version), 0), ":",
+                func.coalesce(func.max(LichSuTraLai.Stt), 0),
+            )
+        )
+        .where(LichSuTraLai.MaHD == ma_hd_column)
+        .scalar_subquery()
+    )
@@ -1,44 +1,55 @@
 """
 ID Generator utility functions
+
+MaHD = <prefix><số thứ tự>, số thứ tự lấy từ sequence riêng của mỗi loại
+(tin_chap_ma_hd_seq, tra_gop_ma_hd_seq): 2 transaction đồng thời không bao giờ nhận
+cùng 1 số và không phải đọc bảng hợp đồng. Số đã cấp cho transaction bị rollback
+không được dùng lại (MaHD có thể nhảy số).
 """
+from typing import List
+
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from app.models import TinChap, TraGop
+
+from app.models.tin_chap import MA_HD_SEQUENCE as TIN_CHAP_SEQUENCE
+from app.models.tra_gop import MA_HD_SEQUENCE as TRA_GOP_SEQUENCE
+
+_SEQUENCES = {"TC": TIN_CHAP_SEQUENCE, "TG": TRA_GOP_SEQUENCE}
+
+
+def format_ma_hd(prefix: str, number: int) -> str:
+    """TC1 -> TC001 (ít nhất 3 chữ số, số lớn hơn giữ nguyên: TC1000)"""
+    return f"{prefix}{number:03d}"
+
+
+def allocate_ma_hd_range(db: Session, prefix: str, count: int) -> List[str]:
+    """
+    Cấp trước 1 khối `count` MaHD (dùng cho import hàng loạt)
+
+    1 câu lệnh (nextval trên generate_series), không khóa, không đọc bảng hợp đồng.
+    Các số tăng dần nhưng có thể không liền nhau khi request khác cấp mã cùng lúc.
+    """
+    if count <= 0:
+        return []
+    numbers = db.execute(
+        select(_SEQUENCES[prefix].next_value()).select_from(func.generate_series(1, count))
+    ).scalars().all()
+    return [format_ma_hd(prefix, number) for number in sorted(numbers)]
 
 
 def generate_tin_chap_id(db: Session) -> str:
     """
     Generate TinChap contract ID in format TCXXX
-    XXX is an auto-incrementing integer
+    XXX is the next value of tin_chap_ma_hd_seq
     """
-    # Get the last TinChap record
-    last_record = db.query(TinChap).order_by(TinChap.MaHD.desc()).first()
-    
-    if last_record:
-        # Extract the number from the last MaHD (e.g., TC001 -> 001)
-        last_number = int(last_record.MaHD[2:])
-        new_number = last_number + 1
-    else:
-        new_number = 1
-    
     # Format with leading zeros (e.g., TC001, TC002, ..., TC100)
-    return f"TC{new_number:03d}"
+    return format_ma_hd("TC", db.execute(select(TIN_CHAP_SEQUENCE.next_value())).scalar_one())
 
 
 def generate_tra_gop_id(db: Session) -> str:
     """
     Generate TraGop contract ID in format TGXXX
-    XXX is an auto-incrementing integer
+    XXX is the next value of tra_gop_ma_hd_seq
     """
-    # Get the last TraGop record
-    last_record = db.query(TraGop).order_by(TraGop.MaHD.desc()).first()
-    
-    if last_record:
-        # Extract the number from the last MaHD (e.g., TG001 -> 001)
-        last_number = int(last_record.MaHD[2:])
-        new_number = last_number + 1
-    else:
-        new_number = 1
-    
     # Format with leading zeros (e.g., TG001, TG002, ..., TG100)
-    return f"TG{new_number:03d}"
-
+    return format_ma_hd("TG", db.execute(select(TRA_GOP_SEQUENCE.next_value())).scalar_one())
@@ -12,7 +12,7 @@ def create_lich_su(
     loai_hop_dong: str
 ) -> dict:
     """
-    Tạo bản ghi lịch sử
+    Tạo bản ghi lịch sử (không commit: được ghi cùng transaction với thao tác)
     """
     lich_su = LichSu(
         ma_hd=ma_hd,
@@ -22,8 +22,6 @@ def create_lich_su(
         hanh_dong=hanh_dong,
         loai_hop_dong=loai_hop_dong)
     db.add(lich_su)
-    db.commit()
-    db.refresh(lich_su)
     return lich_su
 
 def delete_lich_su(
@@ -31,10 +29,9 @@ def delete_lich_su(
     ma_hd: str
 ) -> bool:
     """
-    Xóa bản ghi lịch sử
+    Xóa bản ghi lịch sử (không commit)
     """
     lich_su = db.query(LichSu).filter(LichSu.ma_hd == ma_hd).all()
     for l in lich_su:
         db.delete(l)
-    db.commit()
     return True
\ No newline at end of file
@@ -11,7 +11,8 @@ from app.websocket.events import (
     broadcast_tra_gop_event,
     broadcast_lich_su_tra_lai_event,
     broadcast_dashboard_update,
-    broadcast_no_phai_thu_update
+    broadcast_no_phai_thu_update,
+    broadcast_job_event
 )
 from app.websocket.router import router
 
@@ -27,6 +28,7 @@ __all__ = [
     "broadcast_lich_su_tra_lai_event",
     "broadcast_dashboard_update",
     "broadcast_no_phai_thu_update",
+    "broadcast_job_event",
     "router"
 ]
 
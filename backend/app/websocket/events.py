@@ -35,6 +35,10 @@ class EventType(str, Enum):
     DASHBOARD_UPDATED = "dashboard_updated"
     NO_PHAI_THU_UPDATED = "no_phai_thu_updated"
     
+    # Job events
+    JOB_PROGRESS = "job_progress"
+    JOB_COMPLETED = "job_completed"
+    
     # System events
     SYSTEM_NOTIFICATION = "system_notification"
     ERROR = "error"
@@ -167,3 +171,19 @@ async def broadcast_no_phai_thu_update(
     await manager.broadcast(event_message, exclude_client=exclude_client)
     logger.info(f"📡 Broadcasted no_phai_thu update")
 
+
+async def broadcast_job_event(
+    manager,
+    event_type: EventType,
+    job_data: Dict[str, Any],
+    message: Optional[str] = None,
+    exclude_client: Optional[str] = None
+):
+    """Broadcast background job progress/completion events"""
+    event_message = create_event_message(
+        event_type=event_type,
+        data=job_data,
+        message=message
+    )
+    await manager.broadcast(event_message, exclude_client=exclude_client)
+    logger.info(f"📡 Broadcasted {event_type.value}")
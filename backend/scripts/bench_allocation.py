@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark + kiểm tra thuộc tính: phân bổ thanh toán (allocate_waterfall)
+
+1. Kiểm tra thuộc tính trên --cases trường hợp ngẫu nhiên (không cần database):
+   - Giống vòng lặp cũ của pay_lich_su / tat_toan_hop_dong (bản sao old_waterfall)
+   - Bảo toàn tiền: da_phan_bo + con_du = so_tien, sum(nop_vao_ky) = da_phan_bo
+   - Không kỳ nào nhận quá phần còn nợ; kỳ đủ / trả dư không nhận tiền
+   - Thứ tự: kỳ nhận tiền sau chỉ khi mọi kỳ còn nợ trước nó đã đủ
+   - Kỳ thêm (so_tien_ky_them): chỉ khi các kỳ có sẵn đã đủ, tất cả đủ trừ kỳ cuối
+2. Đo thời gian cho hợp đồng có --periods kỳ: vòng lặp cũ trên object (như ORM)
+   so với allocate_waterfall + ghi lại kết quả lên các kỳ nhận tiền.
+   Số tiền trả: 1 kỳ, nửa số kỳ, toàn bộ.
+
+Usage:
+    python scripts/bench_allocation.py [--cases 20000] [--periods 1000 5000 20000] [--repeat 5] [--seed 1]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.enums import TrangThaiThanhToan
+from app.utils.allocation import allocate_waterfall
+
+DONG_DU = TrangThaiThanhToan.DONG_DU.value
+MOT_PHAN = TrangThaiThanhToan.THANH_TOAN_MOT_PHAN.value
+
+
+def old_waterfall(periods, so_tien):
+    """Bản sao vòng lặp cũ (nhánh trả góp của pay_lich_su): sửa tại chỗ, trả về tổng đã phân bổ"""
+    so_tien_con_lai_de_phan_bo = so_tien
+    tong_da_thanh_toan = 0
+    for period in periods:
+        if so_tien_con_lai_de_phan_bo <= 0:
+            break
+        con_lai_ky = max(0, period.SoTien - period.TienDaTra)
+        if con_lai_ky <= 0:
+            continue
+        nop_vao_ky = min(so_tien_con_lai_de_phan_bo, con_lai_ky)
+        period.TienDaTra += nop_vao_ky
+        tong_da_thanh_toan += nop_vao_ky
+        so_tien_con_lai_de_phan_bo -= nop_vao_ky
+        if period.TienDaTra >= period.SoTien:
+            period.TrangThaiThanhToan = DONG_DU
+        else:
+            period.TrangThaiThanhToan = MOT_PHAN
+    return tong_da_thanh_toan
+
+
+def new_waterfall(periods, so_tien):
+    """allocate_waterfall + ghi kết quả lên các kỳ nhận tiền (như _apply_allocation)"""
+    phan_bo = allocate_waterfall([p.SoTien for p in periods], [p.TienDaTra for p in periods], so_tien)
+    for i in phan_bo.chi_so:
+        period = periods[i]
+        period.TienDaTra = phan_bo.tien_da_tra[i]
+        period.TrangThaiThanhToan = phan_bo.trang_thai[i]
+    return phan_bo.da_phan_bo
+
+
+def make_periods(due, paid):
+    return [SimpleNamespace(SoTien=d, TienDaTra=p, TrangThaiThanhToan="") for d, p in zip(due, paid)]
+
+
+def random_case(rng):
+    n = rng.choice([0, 1, 2, 5, 20, 200])
+    due = [rng.choice([0, rng.randint(1, 100), 1000]) for _ in range(n)]
+    # Có cả kỳ đã đủ và kỳ trả dư (SoTien bị cộng dồn về 0 sau khi đã trả một phần)
+    paid = [rng.choice([0, 0, d, rng.randint(0, d + 50)]) for d in due]
+    so_tien = rng.choice([0, 1, rng.randint(1, 500), rng.randint(1, 200_000), sum(due) + 7])
+    them = rng.choice([0, 0, rng.randint(1, 100)])
+    return due, paid, so_tien, them
+
+
+def check_properties(cases, seed):
+    rng = random.Random(seed)
+    for case in range(cases):
+        due, paid, so_tien, them = random_case(rng)
+        r = allocate_waterfall(due, paid, so_tien, them)
+        n = len(due)
+        where = f"case {case}: due={due[:10]}... paid={paid[:10]}... so_tien={so_tien} them={them}"
+
+        assert r.da_phan_bo + r.con_du == so_tien, where
+        assert sum(r.nop_vao_ky) == r.da_phan_bo, where
+        assert len(r.tien_da_tra) == len(r.nop_vao_ky) == len(r.trang_thai) == n + r.so_ky_them, where
+        assert r.chi_so == [i for i, v in enumerate(r.nop_vao_ky) if v > 0], where
+        for i in range(n):
+            assert r.tien_da_tra[i] == paid[i] + r.nop_vao_ky[i], where
+            assert r.nop_vao_ky[i] <= max(0, due[i] - paid[i]), where
+        # Thứ tự waterfall: trước kỳ nhận tiền cuối cùng, mọi kỳ có sẵn đều đủ
+        if r.chi_so:
+            last = r.chi_so[-1]
+            assert all(r.tien_da_tra[i] >= due[i] for i in range(min(last, n))), where
+        if r.con_du:
+            assert them == 0 and all(r.tien_da_tra[i] >= due[i] for i in range(n)), where
+        if r.so_ky_them:
+            assert them > 0 and all(r.tien_da_tra[i] >= due[i] for i in range(n)), where
+            extra = r.tien_da_tra[n:]
+            assert all(v == them for v in extra[:-1]) and 0 < extra[-1] <= them, where
+
+        # Giống vòng lặp cũ (không có kỳ thêm)
+        if them == 0:
+            periods = make_periods(due, paid)
+            tong = old_waterfall(periods, so_tien)
+            assert tong == r.da_phan_bo, where
+            assert [p.TienDaTra for p in periods] == r.tien_da_tra, where
+            assert [p.TrangThaiThanhToan for p in periods] == r.trang_thai, where
+    print(f"Kiểm tra thuộc tính: {cases} trường hợp OK")
+
+
+def best_of(repeat, setup, func):
+    """Thời gian tốt nhất (ms) của func(setup()) trong `repeat` lần, không tính setup"""
+    best = float("inf")
+    for _ in range(repeat):
+        args = setup()
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def bench(sizes, repeat, seed):
+    rng = random.Random(seed)
+    print(f"\n{'kỳ':>7} {'số tiền':>10} {'cũ (ms)':>10} {'mới (ms)':>10} {'x':>6}")
+    for n in sizes:
+        due = [rng.randint(1, 100) * 1000 for _ in range(n)]
+        # Nửa đầu đã trả đủ (như hợp đồng đang chạy), phần còn lại chưa trả
+        paid = [d if i < n // 2 else 0 for i, d in enumerate(due)]
+        con_no = sum(due[n // 2:])
+        for label, so_tien in (("1 kỳ", due[n // 2]), ("nửa", con_no // 2), ("toàn bộ", con_no)):
+            setup = lambda: (make_periods(due, paid), so_tien)
+            old_ms = best_of(repeat, setup, old_waterfall)
+            new_ms = best_of(repeat, setup, new_waterfall)
+            print(f"{n:>7} {label:>10} {old_ms:>10.3f} {new_ms:>10.3f} {old_ms / new_ms:>6.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=20000)
+    parser.add_argument("--periods", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    check_properties(args.cases, args.seed)
+    bench(args.periods, args.repeat, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Measure bytes on the wire and end-to-end latency of the biggest endpoints
+with identity / gzip / br encodings against a running backend.
+
+Usage:
+    python scripts/bench_compression.py [--base-url http://localhost:8088] [--runs 10]
+"""
+import argparse
+import statistics
+import time
+
+import requests
+
+ENDPOINTS = [
+    "/lich-su",
+    "/no-phai-thu?time=all",
+    "/tin-chap?page_size=50",
+    "/tra-gop?page_size=50",
+]
+
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+def measure(session: requests.Session, url: str, encoding: str, runs: int) -> dict:
+    """Fetch url `runs` times, return wire size and latency percentiles"""
+    latencies = []
+    wire_bytes = 0
+    content_encoding = ""
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = session.get(url, headers={"Accept-Encoding": encoding}, stream=True)
+        raw = response.raw.read(decode_content=False)
+        if encoding == "br" and response.headers.get("Content-Encoding") == "br":
+            import brotli
+            brotli.decompress(raw)  # client-side decode is part of end-to-end latency
+        elif response.headers.get("Content-Encoding") == "gzip":
+            import gzip
+            gzip.decompress(raw)
+        latencies.append((time.perf_counter() - start) * 1000)
+        wire_bytes = len(raw)
+        content_encoding = response.headers.get("Content-Encoding", "identity")
+        response.close()
+    latencies.sort()
+    return {
+        "bytes": wire_bytes,
+        "content_encoding": content_encoding,
+        "p50": statistics.median(latencies),
+        "max": latencies[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8088")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    session = requests.Session()
+    print(f"{'endpoint':<26} {'encoding':<9} {'bytes':>10} {'ratio':>6} {'p50 ms':>8} {'max ms':>8}")
+    for path in ENDPOINTS:
+        baseline = None
+        for encoding in ENCODINGS:
+            result = measure(session, args.base_url + path, encoding, args.runs)
+            baseline = baseline or result["bytes"]
+            ratio = result["bytes"] / baseline if baseline else 1.0
+            print(
+                f"{path:<26} {result['content_encoding']:<9} {result['bytes']:>10,} "
+                f"{ratio:>6.2f} {result['p50']:>8.1f} {result['max']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
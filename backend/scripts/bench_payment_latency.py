@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark: độ trễ p50 / p99 của các request ghi (qua API, TestClient trong process)
+
+Tạo --contracts hợp đồng (POST /tin-chap, /tra-gop + POST /lich-su-tra-lai) rồi gửi
+--payments request lần lượt: POST /lich-su-tra-lai/pay/{stt} cho mọi hợp đồng và
+PUT /tin-chap/tra-goc/{ma_hd} cho tín chấp. Với mỗi loại request in p50 / p99 / max,
+số COMMIT và số câu SQL trung bình mỗi request (đếm bằng event của engine).
+
+Chỉ dùng API nên chạy được trên mọi phiên bản để so sánh trước / sau. Ghi thẳng vào
+database theo POSTGRES_* trong môi trường; hợp đồng test bị xóa sau khi chạy.
+
+Usage:
+    python scripts/bench_payment_latency.py [--contracts 20] [--payments 1000] [--seed 1]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.core.database import engine
+from app.main import app
+
+counters = {"commits": 0, "statements": 0}
+
+
+@event.listens_for(engine, "commit")
+def _count_commit(conn):
+    counters["commits"] += 1
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counters["statements"] += 1
+
+
+def percentile(values, p):
+    """Percentile theo nearest-rank"""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))]
+
+
+def timed(samples, name, send):
+    """Gửi 1 request, ghi (ms, số commit, số câu SQL) vào samples[name]"""
+    commits, statements = counters["commits"], counters["statements"]
+    started = time.perf_counter()
+    response = send()
+    elapsed = (time.perf_counter() - started) * 1000
+    if response.status_code >= 400:
+        raise RuntimeError(f"{name}: HTTP {response.status_code} {response.text[:200]}")
+    samples[name].append((elapsed, counters["commits"] - commits, counters["statements"] - statements))
+    return response.json()["data"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contracts", type=int, default=20)
+    parser.add_argument("--payments", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    client = TestClient(app)
+    samples = defaultdict(list)
+    ngay_vay = (date.today() - timedelta(days=30)).isoformat()
+    contracts = []  # (MaHD, Stt kỳ đầu tiên)
+
+    try:
+        for i in range(args.contracts):
+            if i % 2 == 0:
+                contract = timed(samples, "POST /tin-chap", lambda: client.post("/tin-chap", json={
+                    "HoTen": f"Bench {i}", "NgayVay": ngay_vay, "SoTienVay": 100_000_000, "KyDong": 1, "LaiSuat": 10_000,
+                }))
+            else:
+                contract = timed(samples, "POST /tra-gop", lambda: client.post("/tra-gop", json={
+                    "HoTen": f"Bench {i}", "NgayVay": ngay_vay, "SoTienVay": 100_000_000, "KyDong": 1,
+                    "SoLanTra": 400, "LaiSuat": 20_000_000,
+                }))
+            ma_hd = contract["MaHD"]
+            timed(samples, "POST /lich-su-tra-lai", lambda: client.post("/lich-su-tra-lai", params={"ma_hd": ma_hd}))
+            periods = client.get(f"/lich-su-tra-lai/contract/{ma_hd}").json()["data"]
+            contracts.append((ma_hd, min(periods, key=lambda period: (period["Ngay"], period["Stt"]))["Stt"]))
+
+        for _ in range(args.payments):
+            ma_hd, stt = rng.choice(contracts)
+            if ma_hd.startswith("TC") and rng.random() < 0.3:
+                amount = rng.randint(1, 50) * 10_000
+                timed(samples, "PUT /tin-chap/tra-goc", lambda: client.put(
+                    f"/tin-chap/tra-goc/{ma_hd}", params={"so_tien_tra_goc": amount}
+                ))
+            else:
+                amount = rng.randint(1, 30) * 500
+                timed(samples, "POST /lich-su-tra-lai/pay", lambda: client.post(
+                    f"/lich-su-tra-lai/pay/{stt}", params={"so_tien": amount}
+                ))
+    finally:
+        for ma_hd, _ in contracts:
+            client.delete(f"/lich-su-tra-lai/contract/{ma_hd}")
+            client.delete(f"/tin-chap/{ma_hd}" if ma_hd.startswith("TC") else f"/tra-gop/{ma_hd}")
+
+    print(f"{'request':<28} {'n':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'commit':>7} {'SQL':>6}")
+    for name, rows in samples.items():
+        latencies = [row[0] for row in rows]
+        print(
+            f"{name:<28} {len(rows):>6} {statistics.median(latencies):>8.2f} {percentile(latencies, 99):>8.2f} "
+            f"{max(latencies):>8.2f} {statistics.mean(row[1] for row in rows):>7.2f} "
+            f"{statistics.mean(row[2] for row in rows):>6.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
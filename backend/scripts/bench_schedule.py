@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Benchmark: tạo lịch sử trả lãi cho hợp đồng vay lùi ngày 1, 2 và 5 năm, KyDong = 1
+
+So sánh đường cũ (vòng lặp dict + sum() đếm kỳ quá hạn trong vòng lặp -> O(n²) với
+Trả Góp, 1 ORM object + db.add cho mỗi kỳ) với đường mới (build_payment_schedule
+trả về mảng ngày/số tiền, ghi bằng 1 INSERT nhiều dòng).
+
+- Tín Chấp: NgayVay lùi N năm, các kỳ tới hôm nay
+- Trả Góp: NgayVay lùi N năm, SoLanTra kéo dài thêm 1 năm sau hôm nay (có kỳ chưa đến hạn)
+
+Mặc định chỉ đo phần tính lịch (không cần database). --db đo thêm phần ghi
+vào Postgres (trong transaction, rollback sau mỗi lần đo).
+
+Usage:
+    python scripts/bench_schedule.py [--years 1 2 5] [--repeat 5] [--db]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+
+from app.core.enums import TrangThaiThanhToan
+from app.models.lich_su_tra_lai import LichSuTraLai
+from app.utils.calculations import build_payment_schedule
+
+SO_TIEN_MOI_KY = 50_000
+
+
+def old_schedule(loai_hop_dong, ngay_vay, ky_dong, so_tien_moi_ky, so_lan_tra, date_now, ma_hd):
+    """Bản sao logic cũ của create_lich_su (bước 5 + 7): trả về list ORM object chưa add"""
+    danh_sach_ky = []
+    if loai_hop_dong == "TG":
+        ngay_ky_hien_tai = ngay_vay
+        for ky_thu in range(0, so_lan_tra):
+            ky_thu += 1
+            danh_sach_ky.append({"ngay": ngay_ky_hien_tai, "ky_thu": ky_thu, "so_tien_ky": so_tien_moi_ky})
+            ngay_ky_hien_tai += timedelta(days=ky_dong)
+    else:
+        ngay_ky_hien_tai = ngay_vay + timedelta(days=ky_dong)
+        ky_thu = 0
+        if ngay_vay == date_now:
+            ky_thu += 1
+            danh_sach_ky.append({"ngay": ngay_vay, "ky_thu": ky_thu, "so_tien_ky": so_tien_moi_ky})
+        while ngay_ky_hien_tai <= date_now:
+            danh_sach_ky.append({"ngay": ngay_ky_hien_tai, "ky_thu": ky_thu, "so_tien_ky": so_tien_moi_ky})
+            ngay_ky_hien_tai += timedelta(days=ky_dong)
+            ky_thu += 1
+
+    so_ky = len(danh_sach_ky)
+    end_date = danh_sach_ky[-1]["ngay"]
+    lich_sus = []
+    for idx, ky in enumerate(danh_sach_ky):
+        if loai_hop_dong == "TG":
+            if end_date < date_now:
+                so_tien = 0 if idx < so_ky - 1 else so_tien_moi_ky * so_ky
+            elif ky["ngay"] < date_now:
+                so_tien = 0
+            else:
+                so_ky_qua_han = sum(1 for k in danh_sach_ky if k["ngay"] < date_now)
+                so_tien = so_tien_moi_ky * (so_ky_qua_han + 1)
+        else:
+            so_tien = 0 if idx < so_ky - 1 else so_tien_moi_ky * so_ky
+        lich_sus.append(LichSuTraLai(
+            MaHD=ma_hd,
+            Ngay=ky["ngay"],
+            SoTien=so_tien,
+            NoiDung=f"Trả lãi kỳ {ky['ky_thu']}",
+            TrangThaiThanhToan=TrangThaiThanhToan.CHUA_THANH_TOAN.value,
+            TienDaTra=0,
+        ))
+    return lich_sus
+
+
+def new_rows(loai_hop_dong, ngay_vay, ky_dong, so_tien_moi_ky, so_lan_tra, date_now, ma_hd):
+    """Đường mới: lịch dạng mảng -> list dict tham số cho executemany"""
+    lich = build_payment_schedule(loai_hop_dong, ngay_vay, ky_dong, so_tien_moi_ky, so_lan_tra, date_now)
+    trang_thai = TrangThaiThanhToan.CHUA_THANH_TOAN.value
+    return [
+        {
+            "MaHD": ma_hd,
+            "Ngay": ngay,
+            "SoTien": so_tien,
+            "NoiDung": f"Trả lãi kỳ {ky_thu}",
+            "TrangThaiThanhToan": trang_thai,
+            "TienDaTra": 0,
+        }
+        for ngay, ky_thu, so_tien in zip(lich.ngay, lich.ky_thu, lich.so_tien)
+    ]
+
+
+def best_of(repeat, func):
+    """Thời gian tốt nhất (ms) của `repeat` lần gọi func()"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def scenarios(years, today):
+    for n in years:
+        ngay_vay = today - timedelta(days=365 * n)
+        days = (today - ngay_vay).days
+        yield f"TC {n} năm", ("TC", ngay_vay, 1, SO_TIEN_MOI_KY, 0, today, "TCBENCH")
+        yield f"TG {n} năm", ("TG", ngay_vay, 1, SO_TIEN_MOI_KY, days + 365, today, "TGBENCH")
+
+
+def bench_compute(years, repeat, today):
+    print("Tính lịch (không DB)")
+    print(f"{'':10} {'kỳ':>6} {'cũ (ms)':>10} {'mới (ms)':>10} {'x':>7}")
+    for label, args in scenarios(years, today):
+        old_rows = old_schedule(*args)
+        rows = new_rows(*args)
+        assert [(r.Ngay, r.SoTien, r.NoiDung) for r in old_rows] == [
+            (r["Ngay"], r["SoTien"], r["NoiDung"]) for r in rows
+        ], f"{label}: kết quả khác nhau"
+        old_ms = best_of(repeat, lambda: old_schedule(*args))
+        new_ms = best_of(repeat, lambda: new_rows(*args))
+        print(f"{label:10} {len(rows):>6} {old_ms:>10.2f} {new_ms:>10.2f} {old_ms / new_ms:>7.1f}")
+
+
+def bench_db(years, repeat, today):
+    from app.core.database import SessionLocal
+
+    def run_old(db, args):
+        for lich_su in old_schedule(*args):
+            db.add(lich_su)
+        db.flush()
+
+    def run_new(db, args):
+        db.execute(insert(LichSuTraLai.__table__), new_rows(*args))
+
+    def timed(func, args):
+        best = float("inf")
+        for _ in range(repeat):
+            db = SessionLocal()
+            try:
+                started = time.perf_counter()
+                func(db, args)
+                best = min(best, time.perf_counter() - started)
+            finally:
+                db.rollback()
+                db.close()
+        return best * 1000
+
+    print("\nTính lịch + ghi Postgres (rollback sau mỗi lần)")
+    print(f"{'':10} {'kỳ':>6} {'cũ (ms)':>10} {'mới (ms)':>10} {'x':>7}")
+    for label, args in scenarios(years, today):
+        so_ky = len(build_payment_schedule(*args[:6]))
+        old_ms = timed(run_old, args)
+        new_ms = timed(run_new, args)
+        print(f"{label:10} {so_ky:>6} {old_ms:>10.2f} {new_ms:>10.2f} {old_ms / new_ms:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 2, 5])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", action="store_true", help="Đo cả phần ghi vào Postgres")
+    args = parser.parse_args()
+
+    today = date.today()
+    bench_compute(args.years, args.repeat, today)
+    if args.db:
+        bench_db(args.years, args.repeat, today)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: serialization cost of one TinChap detail response with a 200-period history
+
+So sánh đường cũ (model_validate từng dòng -> model_dump -> validate lại trong
+ApiResponse[TinChapResponse] -> jsonable_encoder + JSONResponse) với đường trusted
+(row-to-dict + model_construct + orjson). Không cần database.
+
+Usage:
+    python scripts/bench_serialization.py [--periods 200] [--repeat 200]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.models.lich_su_tra_lai import LichSuTraLai
+from app.models.tin_chap import TinChap
+from app.schemas.lich_su_tra_lai import LichSuTraLai as LichSuTraLaiSchema, lich_su_tra_lai_to_dict
+from app.schemas.response import ApiResponse
+from app.schemas.tin_chap import TinChapResponse
+
+
+def build_rows(periods: int):
+    """Transient ORM rows shaped like a real contract"""
+    ngay_vay = date(2025, 1, 1)
+    tin_chap = TinChap(
+        MaHD="TC001", HoTen="Nguyễn Văn A", NgayVay=ngay_vay, SoTienVay=10_000_000,
+        KyDong=1, LaiSuat=50_000, SoTienTraGoc=0, TrangThai="Thanh toán một phần", Version=1,
+    )
+    lich_sus = [
+        LichSuTraLai(
+            Stt=i + 1, MaHD="TC001", Ngay=ngay_vay + timedelta(days=i), SoTien=50_000,
+            NoiDung=f"Trả lãi kỳ {i + 1} |Số tiền thanh toán: 50,000 VNĐ",
+            TrangThaiThanhToan="Đóng đủ", TienDaTra=50_000, Version=1,
+        )
+        for i in range(periods)
+    ]
+    return tin_chap, lich_sus
+
+
+def _fields(tin_chap, lich_su_list):
+    return dict(
+        MaHD=tin_chap.MaHD, HoTen=tin_chap.HoTen, NgayVay=tin_chap.NgayVay, SoTienVay=tin_chap.SoTienVay,
+        KyDong=tin_chap.KyDong, LaiSuat=tin_chap.LaiSuat, SoTienTraGoc=tin_chap.SoTienTraGoc,
+        TrangThai=tin_chap.TrangThai, LichSuTraLai=lich_su_list,
+        LaiDaTra=0, GocConLai=tin_chap.SoTienVay, LaiConLai=0,
+    )
+
+
+def validated_path(tin_chap, lich_sus) -> bytes:
+    """Đường cũ: validate từng dòng, validate lại ở response_model, jsonable_encoder + JSONResponse"""
+    lich_su_list = [LichSuTraLaiSchema.model_validate(ls).model_dump() for ls in lich_sus]
+    response = ApiResponse.success_response(data=TinChapResponse(**_fields(tin_chap, lich_su_list)), message="OK")
+    validated = ApiResponse[TinChapResponse].model_validate(response.model_dump())
+    return JSONResponse(content=jsonable_encoder(validated)).body
+
+
+def trusted_path(tin_chap, lich_sus) -> bytes:
+    """Đường mới: row-to-dict + model_construct + orjson"""
+    lich_su_list = [lich_su_tra_lai_to_dict(ls) for ls in lich_sus]
+    data = TinChapResponse.model_construct(**_fields(tin_chap, lich_su_list))
+    return ApiResponse.trusted_response(data=data, message="OK").body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--periods", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    tin_chap, lich_sus = build_rows(args.periods)
+    assert json.loads(validated_path(tin_chap, lich_sus)) == json.loads(trusted_path(tin_chap, lich_sus))
+
+    print(f"TinChap detail, {args.periods} periods, {args.repeat} runs")
+    results = {}
+    for name, fn in [("validated", validated_path), ("trusted", trusted_path)]:
+        best = min(timeit.repeat(lambda: fn(tin_chap, lich_sus), number=args.repeat, repeat=5)) / args.repeat
+        results[name] = best
+        print(f"  {name:<10} {best * 1e3:8.3f} ms/contract  ({len(fn(tin_chap, lich_sus)):,} bytes)")
+    print(f"  speedup    {results['validated'] / results['trusted']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
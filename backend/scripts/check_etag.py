@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Kiểm tra ETag của GET /tin-chap, /tra-gop (chi tiết + danh sách) đổi khi sang ngày mới
+
+TrangThaiNgayThanhToan (CHUA_DEN_HAN / DEN_HAN / QUA_HAN) được tính từ date.today()
+lúc đọc: cùng Version nhưng khác ngày thì response khác, ETag cũ không được trả 304.
+
+Với mỗi endpoint: lấy ETag hôm nay, gửi lại If-None-Match -> 304; giả lập ngày mai
+(thay date trong app.utils.etag) -> 200 với ETag khác. Chỉ đọc, cần có ít nhất 1 hợp
+đồng mỗi loại trong database theo POSTGRES_*.
+
+Usage:
+    python scripts/check_etag.py
+"""
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+import app.utils.etag as etag_module
+from app.core.database import SessionLocal
+from app.main import app
+from app.models.tin_chap import TinChap
+from app.models.tra_gop import TraGop
+
+
+class _Tomorrow(date):
+    @classmethod
+    def today(cls):
+        return date.today() + timedelta(days=1)
+
+
+def check(client, path):
+    response = client.get(path)
+    assert response.status_code == 200, f"{path}: HTTP {response.status_code}"
+    etag = response.headers["ETag"]
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304, f"{path}: không trả 304 cùng ngày"
+
+    etag_module.date = _Tomorrow
+    try:
+        response = client.get(path, headers={"If-None-Match": etag})
+    finally:
+        etag_module.date = date
+    assert response.status_code == 200, f"{path}: ngày mai vẫn trả {response.status_code} với ETag hôm qua"
+    assert response.headers["ETag"] != etag, f"{path}: ETag không đổi khi sang ngày mới"
+    print(f"OK {path}")
+
+
+def main():
+    db = SessionLocal()
+    try:
+        tin_chap = db.query(TinChap.MaHD).first()
+        tra_gop = db.query(TraGop.MaHD).first()
+    finally:
+        db.close()
+    if not tin_chap or not tra_gop:
+        sys.exit("Cần ít nhất 1 hợp đồng tín chấp và 1 hợp đồng trả góp")
+
+    client = TestClient(app)
+    for path in ("/tin-chap", f"/tin-chap/{tin_chap.MaHD}", "/tra-gop", f"/tra-gop/{tra_gop.MaHD}"):
+        check(client, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Kiểm tra Idempotency-Key của POST /lich-su-tra-lai/pay/{stt} và PUT /tin-chap/tra-goc/{ma_hd}
+
+Tạo 1 hợp đồng tín chấp qua API rồi kiểm tra:
+- request đầu: 200, dòng idempotency_keys đã commit cùng thanh toán; gửi lại: response y hệt
+  (Idempotency-Replayed), tiền chỉ được ghi 1 lần
+- cùng key, khác body: 422; request lỗi (404): key không được lưu
+- khi transaction khác đang giữ khóa của key (pg_advisory_xact_lock): 409, không ghi tiền
+- --threads request cùng key gửi đồng thời: đúng 1 lần thanh toán, còn lại 409 hoặc replay
+- dòng giữ chỗ cũ (StatusCode NULL) được request mới ghi đè
+
+Ghi thẳng vào database theo POSTGRES_*; hợp đồng test bị xóa sau khi chạy.
+
+Usage:
+    python scripts/check_idempotency.py [--threads 10]
+"""
+import argparse
+import datetime
+import hashlib
+import os
+import sys
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+from app.core.database import SessionLocal
+from app.main import app
+from app.models.idempotency_key import IdempotencyKey
+from app.models.lich_su_tra_lai import LichSuTraLai
+from app.models.tin_chap import TinChap
+
+
+def new_key():
+    return f"check-{uuid.uuid4()}"
+
+
+def stored_status(key):
+    db = SessionLocal()
+    try:
+        row = db.get(IdempotencyKey, key)
+        return "missing" if row is None else row.StatusCode
+    finally:
+        db.close()
+
+
+def da_tra(ma_hd):
+    db = SessionLocal()
+    try:
+        tien_da_tra = db.execute(
+            select(func.coalesce(func.sum(LichSuTraLai.TienDaTra), 0)).where(LichSuTraLai.MaHD == ma_hd)
+        ).scalar()
+        return tien_da_tra, db.get(TinChap, ma_hd).SoTienTraGoc
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=10)
+    args = parser.parse_args()
+
+    client = TestClient(app)
+    response = client.post("/tin-chap", json={
+        "HoTen": "Check idempotency", "NgayVay": (date.today() - timedelta(days=5)).isoformat(),
+        "SoTienVay": 100_000_000, "KyDong": 1, "LaiSuat": 1_000_000,
+    })
+    assert response.status_code == 201, response.text
+    ma_hd = response.json()["data"]["MaHD"]
+    keys = []
+    try:
+        assert client.post("/lich-su-tra-lai", params={"ma_hd": ma_hd}).status_code == 201
+        stt = client.get(f"/lich-su-tra-lai/contract/{ma_hd}").json()["data"][0]["Stt"]
+        pay = f"/lich-su-tra-lai/pay/{stt}"
+
+        # 1. Lần đầu + gửi lại
+        key = new_key()
+        keys.append(key)
+        before = da_tra(ma_hd)
+        first = client.post(pay, params={"so_tien": 1000}, headers={"Idempotency-Key": key})
+        assert first.status_code == 200, first.text
+        assert stored_status(key) == 200, "key chưa được commit cùng thanh toán"
+        replay = client.post(pay, params={"so_tien": 1000}, headers={"Idempotency-Key": key})
+        assert replay.status_code == 200 and replay.headers.get("Idempotency-Replayed") == "true"
+        assert replay.content == first.content, "response gửi lại khác lần đầu"
+        assert da_tra(ma_hd)[0] - before[0] == 1000, "gửi lại làm thanh toán 2 lần"
+        print("OK replay")
+
+        # 2. Khác body / request lỗi
+        assert client.post(pay, params={"so_tien": 2000}, headers={"Idempotency-Key": key}).status_code == 422
+        key = new_key()
+        keys.append(key)
+        missing = client.post("/lich-su-tra-lai/pay/2147483000", params={"so_tien": 1000}, headers={"Idempotency-Key": key})
+        assert missing.status_code == 404 and stored_status(key) == "missing"
+        print("OK 422 / 404 không lưu key")
+
+        # 3. Transaction khác đang giữ key
+        key = new_key()
+        keys.append(key)
+        lock_key = int.from_bytes(hashlib.sha1(f"idempotency:{key}".encode("utf-8")).digest()[:8], "big", signed=True)
+        holder = SessionLocal()
+        try:
+            holder.execute(select(func.pg_advisory_xact_lock(lock_key)))
+            before = da_tra(ma_hd)
+            busy = client.post(pay, params={"so_tien": 1000}, headers={"Idempotency-Key": key})
+            assert busy.status_code == 409 and da_tra(ma_hd) == before, f"HTTP {busy.status_code}"
+        finally:
+            holder.rollback()
+            holder.close()
+        assert client.post(pay, params={"so_tien": 1000}, headers={"Idempotency-Key": key}).status_code == 200
+        print("OK 409 khi key đang được xử lý")
+
+        # 4. Đồng thời, cùng key (pay và tra-goc)
+        for path, params, index in ((pay, {"so_tien": 500}, 0), (f"/tin-chap/tra-goc/{ma_hd}", {"so_tien_tra_goc": 700}, 1)):
+            key = new_key()
+            keys.append(key)
+            before = da_tra(ma_hd)
+            barrier = threading.Barrier(args.threads)
+            method = "post" if path == pay else "put"
+
+            def send(_):
+                local = TestClient(app)
+                barrier.wait()
+                response = getattr(local, method)(path, params=params, headers={"Idempotency-Key": key})
+                return response.status_code, response.headers.get("Idempotency-Replayed") == "true"
+
+            with ThreadPoolExecutor(args.threads) as pool:
+                outcomes = Counter(pool.map(send, range(args.threads)))
+            assert outcomes[(200, False)] == 1, f"{path}: {dict(outcomes)}"
+            assert set(outcomes) <= {(200, False), (200, True), (409, False)}, f"{path}: {dict(outcomes)}"
+            delta = da_tra(ma_hd)[index] - before[index]
+            assert delta == next(iter(params.values())), f"{path}: ghi {delta} thay vì 1 lần"
+            print(f"OK {args.threads} request đồng thời {method.upper()} {path.split('/')[1]}: {dict(outcomes)}")
+
+        # 5. Dòng giữ chỗ cũ (StatusCode NULL)
+        key = new_key()
+        keys.append(key)
+        db = SessionLocal()
+        try:
+            db.add(IdempotencyKey(Key=key, DauVanTay=b"\0" * 32, NgayTao=datetime.datetime.now()))
+            db.commit()
+        finally:
+            db.close()
+        assert client.post(pay, params={"so_tien": 1000}, headers={"Idempotency-Key": key}).status_code == 200
+        assert stored_status(key) == 200
+        print("OK dòng StatusCode NULL được ghi đè")
+    finally:
+        db = SessionLocal()
+        try:
+            db.query(IdempotencyKey).filter(IdempotencyKey.Key.in_(keys)).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        client.delete(f"/lich-su-tra-lai/contract/{ma_hd}")
+        client.delete(f"/tin-chap/{ma_hd}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Kiểm tra GET /dashboard/projection: kỳ đã có nằm đúng ngày của kỳ, không vào overdue
+
+Tạo 1 hợp đồng trả góp (NgayVay hôm nay, các kỳ đều ở tương lai) và 1 hợp đồng tín
+chấp vay hôm qua, KyDong 1 ngày (có kỳ đến hạn hôm nay) qua API. So sánh
+compute_projection trước / sau:
+- mỗi kỳ trả góp tăng daily[Ngay].tra_gop đúng SoTien, total.tra_gop tăng tổng các kỳ
+- kỳ tín chấp hôm nay tính vào daily[hôm nay].tin_chap (không bị trừ LaiSuat)
+- overdue không đổi
+
+Ghi thẳng vào database theo POSTGRES_*; hợp đồng test bị xóa sau khi chạy.
+
+Usage:
+    python scripts/check_projection.py
+"""
+import os
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from app.core.database import SessionLocal
+from app.main import app
+from app.services.projection import compute_projection
+
+DAYS = 90
+
+
+def projection():
+    db = SessionLocal()
+    try:
+        return compute_projection(db, days=DAYS)
+    finally:
+        db.close()
+
+
+def create_contract(client, path, payload):
+    response = client.post(path, json=payload)
+    assert response.status_code == 201, f"POST {path}: HTTP {response.status_code} {response.text[:200]}"
+    ma_hd = response.json()["data"]["MaHD"]
+    response = client.post("/lich-su-tra-lai", params={"ma_hd": ma_hd})
+    assert response.status_code == 201, f"POST /lich-su-tra-lai {ma_hd}: HTTP {response.status_code}"
+    return ma_hd
+
+
+def main():
+    client = TestClient(app)
+    today = date.today()
+    ky_dong = 1
+    ngay_vay_tc = today - timedelta(days=ky_dong)
+    before = projection()
+    contracts = []
+    try:
+        contracts.append(create_contract(client, "/tra-gop", {
+            "HoTen": "Check projection TG", "NgayVay": today.isoformat(), "SoTienVay": 3_000_000,
+            "KyDong": 7, "SoLanTra": 7, "LaiSuat": 80_000,
+        }))
+        contracts.append(create_contract(client, "/tin-chap", {
+            "HoTen": "Check projection TC", "NgayVay": ngay_vay_tc.isoformat(),
+            "SoTienVay": 10_000_000, "KyDong": ky_dong, "LaiSuat": 50_000,
+        }))
+        ma_tg, ma_tc = contracts
+        after = projection()
+
+        expected = defaultdict(lambda: {"tin_chap": 0, "tra_gop": 0})
+        for ma_hd, key in ((ma_tg, "tra_gop"), (ma_tc, "tin_chap")):
+            for period in client.get(f"/lich-su-tra-lai/contract/{ma_hd}").json()["data"]:
+                ngay = date.fromisoformat(period["Ngay"])
+                assert ngay >= today, f"{ma_hd}: kỳ {ngay} trước hôm nay"
+                if ngay <= today + timedelta(days=DAYS - 1):
+                    expected[ngay][key] += period["SoTien"] - period["TienDaTra"]
+        assert any(ngay > today for ngay in expected), "Hợp đồng trả góp không có kỳ tương lai"
+        assert expected[today]["tin_chap"] > 0, "Hợp đồng tín chấp không có kỳ hôm nay"
+
+        for row_before, row_after in zip(before["daily"], after["daily"]):
+            ngay = row_after["Ngay"]
+            for key in ("tin_chap", "tra_gop"):
+                delta = row_after[key] - row_before[key]
+                want = expected[ngay][key]
+                # Ngày đóng lãi tín chấp chưa có kỳ (cùng quy tắc ngày trong tháng với job cộng dồn):
+                # LaiSuat dự kiến của hợp đồng mới
+                if key == "tin_chap" and not want and (ngay.day - ngay_vay_tc.day) % ky_dong == 0:
+                    want = 50_000
+                assert delta == want, f"{ngay} {key}: tăng {delta:,}, cần {want:,}"
+        assert after["overdue"] == before["overdue"], f"overdue đổi: {before['overdue']} -> {after['overdue']}"
+        tong_tg = sum(value["tra_gop"] for value in expected.values())
+        assert after["total"]["tra_gop"] - before["total"]["tra_gop"] == tong_tg, "total.tra_gop không khớp"
+        print(f"OK {ma_tg}: {tong_tg:,} VNĐ trên {sum(1 for v in expected.values() if v['tra_gop'])} ngày")
+        print(f"OK {ma_tc}: kỳ hôm nay {expected[today]['tin_chap']:,} VNĐ")
+    finally:
+        for ma_hd in contracts:
+            client.delete(f"/lich-su-tra-lai/contract/{ma_hd}")
+            client.delete(f"/tin-chap/{ma_hd}" if ma_hd.startswith("TC") else f"/tra-gop/{ma_hd}")
+
+
+if __name__ == "__main__":
+    main()
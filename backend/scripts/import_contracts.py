@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Import hàng loạt hợp đồng TC + TG từ file CSV hoặc NDJSON (cùng logic với POST /contracts/import)
+
+Ghi thẳng vào database theo POSTGRES_* trong môi trường, không cần backend đang chạy.
+Cột: LoaiHopDong (TC/TG), HoTen, NgayVay, SoTienVay, KyDong, LaiSuat, SoLanTra (TG).
+
+Usage:
+    python scripts/import_contracts.py contracts.csv [--format csv|ndjson] [--batch-size 1000]
+        [--errors errors.json] [--mapping mapping.csv]
+
+Exit code 1 nếu có dòng lỗi (các dòng hợp lệ vẫn được nhập).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import SessionLocal
+from app.services.contract_import import IMPORT_FORMATS, detect_format, import_contracts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="File CSV (có header) hoặc NDJSON")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="Mặc định đoán theo đuôi file")
+    parser.add_argument("--batch-size", type=int, default=None, help="Số dòng mỗi transaction (IMPORT_BATCH_SIZE)")
+    parser.add_argument("--errors", help="Ghi danh sách lỗi (JSON) ra file này")
+    parser.add_argument("--mapping", help="Ghi bảng số dòng -> MaHD đã cấp (CSV) ra file này")
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(filename=args.path)
+    db = SessionLocal()
+    try:
+        with open(args.path, encoding="utf-8-sig", newline="") as f:
+            result = import_contracts(db, f, fmt, args.batch_size)
+    finally:
+        db.close()
+
+    print(
+        f"{result['rows_imported']}/{result['rows_read']} dòng đã nhập, {result['rows_failed']} lỗi, "
+        f"{result['periods_created']} kỳ lịch sử trả lãi, {result['batches_committed']} batch"
+    )
+    print(f"{result['elapsed_ms']} ms, {result['rows_per_second']} dòng/giây")
+
+    if args.mapping:
+        with open(args.mapping, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["row", "MaHD"])
+            writer.writerows(result["ma_hd"].items())
+    if args.errors:
+        with open(args.errors, "w", encoding="utf-8") as f:
+            json.dump(result["errors"], f, ensure_ascii=False, indent=2)
+    for error in result["errors"][:20]:
+        print(f"  dòng {error['row']}: {error['error']}", file=sys.stderr)
+    if len(result["errors"]) > 20:
+        print(f"  ... và {len(result['errors']) - 20} lỗi khác", file=sys.stderr)
+    sys.exit(1 if result["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
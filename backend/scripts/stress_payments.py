@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Stress test: nhiều giao dịch viên thanh toán song song trên cùng vài hợp đồng
+
+Tạo --contracts hợp đồng (nửa TC, nửa TG, NgayVay lùi 30 ngày, KyDong = 1) rồi chạy
+--payments thao tác trên --threads thread, mỗi thread 1 session riêng (như các request
+API chạy song song): pay_lich_su cho TC/TG và tra_goc_tin_chap cho TC, chọn ngẫu nhiên.
+
+Sau khi chạy, kiểm tra tổng có khớp không (lost update => lệch):
+- Mỗi hợp đồng: SUM(TienDaTra) của lịch sử trả lãi = tổng da_thanh_toan các lần pay thành công
+- TC: SoTienTraGoc = tổng số tiền các lần trả gốc thành công
+- Không có 2 kỳ cùng (MaHD, Ngay)
+- Bảng lich_su (nhật ký): số dòng và tổng tiền khớp các thao tác thành công
+- Bảng payment_allocation: SUM(SoTien) = SUM(TienDaTra)
+
+Ghi thẳng vào database theo POSTGRES_* trong môi trường; hợp đồng test bị xóa
+sau khi chạy (trừ khi --keep).
+
+Usage:
+    python scripts/stress_payments.py [--contracts 4] [--threads 12] [--payments 2000] [--seed 1] [--keep]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from sqlalchemy import func
+
+from app.core.database import SessionLocal, unit_of_work
+from app.crud import lich_su_tra_lai as crud_lich_su
+from app.crud import tin_chap as crud_tin_chap
+from app.crud import tra_gop as crud_tra_gop
+from app.models.lich_su import LichSu
+from app.models.lich_su_tra_lai import LichSuTraLai
+from app.models.payment_allocation import PaymentAllocation
+from app.models.tin_chap import TinChap
+from app.schemas.tin_chap import TinChapCreate
+from app.schemas.tra_gop import TraGopCreate
+from app.utils.id_generator import generate_tin_chap_id, generate_tra_gop_id
+
+LAI_MOI_KY = 10_000
+
+
+def create_contracts(count, today):
+    """Tạo hợp đồng test, trả về [(MaHD, Stt kỳ đầu tiên)]"""
+    ngay_vay = today - timedelta(days=30)
+    contracts = []
+    db = SessionLocal()
+    try:
+        for i in range(count):
+            with unit_of_work(db):
+                if i % 2 == 0:
+                    ma_hd = generate_tin_chap_id(db)
+                    crud_tin_chap.create_tin_chap(db, TinChapCreate(
+                        HoTen=f"Stress {i}", NgayVay=ngay_vay, SoTienVay=100_000_000, KyDong=1, LaiSuat=LAI_MOI_KY,
+                    ), ma_hd)
+                else:
+                    ma_hd = generate_tra_gop_id(db)
+                    crud_tra_gop.create_tra_gop(db, TraGopCreate(
+                        HoTen=f"Stress {i}", NgayVay=ngay_vay, SoTienVay=100_000_000, KyDong=1,
+                        SoLanTra=400, LaiSuat=20_000_000,
+                    ), ma_hd)
+                crud_lich_su.create_lich_su(db, ma_hd)
+            first = (
+                db.query(LichSuTraLai)
+                .filter(LichSuTraLai.MaHD == ma_hd)
+                .order_by(LichSuTraLai.Ngay.asc(), LichSuTraLai.Stt.asc())
+                .first()
+            )
+            contracts.append((ma_hd, first.Stt))
+    finally:
+        db.close()
+    return contracts
+
+
+def run_operations(contracts, threads, payments, seed):
+    """Chạy song song, trả về (sổ thao tác thành công, Counter lỗi)"""
+    rng = random.Random(seed)
+    operations = []
+    for _ in range(payments):
+        ma_hd, stt = rng.choice(contracts)
+        if ma_hd.startswith("TC") and rng.random() < 0.3:
+            operations.append(("tra_goc", ma_hd, stt, rng.randint(1, 50) * 10_000))
+        else:
+            operations.append(("pay", ma_hd, stt, rng.randint(1, 30) * 500))
+
+    ledger = defaultdict(lambda: {"pay": 0, "pay_count": 0, "pay_audit": 0, "tra_goc": 0, "tra_goc_count": 0})
+    errors = Counter()
+    lock = threading.Lock()
+    local = threading.local()
+    sessions = []
+
+    def session():
+        if not hasattr(local, "db"):
+            local.db = SessionLocal()
+            with lock:
+                sessions.append(local.db)
+        return local.db
+
+    def run(operation):
+        kind, ma_hd, stt, amount = operation
+        db = session()
+        try:
+            if kind == "pay":
+                with unit_of_work(db):
+                    result = crud_lich_su.pay_lich_su(db, stt, amount)
+                with lock:
+                    ledger[ma_hd]["pay"] += result["da_thanh_toan"]
+                    ledger[ma_hd]["pay_audit"] += amount
+                    ledger[ma_hd]["pay_count"] += 1
+            else:
+                with unit_of_work(db):
+                    if not crud_tin_chap.tra_goc_tin_chap(db, ma_hd, amount):
+                        raise RuntimeError("tra_goc_tin_chap trả về False")
+                with lock:
+                    ledger[ma_hd]["tra_goc"] += amount
+                    ledger[ma_hd]["tra_goc_count"] += 1
+        except HTTPException as e:
+            db.rollback()
+            with lock:
+                errors[f"HTTP {e.status_code}: {e.detail}"] += 1
+        except Exception as e:
+            db.rollback()
+            with lock:
+                errors[f"{type(e).__name__}: {str(e).splitlines()[0]}"] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(run, operations))
+    elapsed = time.perf_counter() - started
+    for db in sessions:
+        db.close()
+    return ledger, errors, elapsed
+
+
+def verify(contracts, ledger):
+    """So sánh database với sổ thao tác, trả về danh sách chênh lệch"""
+    problems = []
+    db = SessionLocal()
+    try:
+        for ma_hd, _ in contracts:
+            expected = ledger[ma_hd]
+            da_tra = db.query(func.coalesce(func.sum(LichSuTraLai.TienDaTra), 0)).filter(LichSuTraLai.MaHD == ma_hd).scalar()
+            if da_tra != expected["pay"]:
+                problems.append(f"{ma_hd}: SUM(TienDaTra) = {da_tra:,}, tổng đã phân bổ = {expected['pay']:,}")
+
+            allocated = db.query(func.coalesce(func.sum(PaymentAllocation.SoTien), 0)).filter(
+                PaymentAllocation.MaHD == ma_hd
+            ).scalar()
+            if allocated != da_tra:
+                problems.append(f"{ma_hd}: SUM(payment_allocation) = {allocated:,}, SUM(TienDaTra) = {da_tra:,}")
+
+            duplicates = (
+                db.query(LichSuTraLai.Ngay)
+                .filter(LichSuTraLai.MaHD == ma_hd)
+                .group_by(LichSuTraLai.Ngay)
+                .having(func.count() > 1)
+                .count()
+            )
+            if duplicates:
+                problems.append(f"{ma_hd}: {duplicates} ngày có nhiều hơn 1 kỳ")
+
+            if ma_hd.startswith("TC"):
+                tra_goc = db.query(TinChap.SoTienTraGoc).filter(TinChap.MaHD == ma_hd).scalar()
+                if tra_goc != expected["tra_goc"]:
+                    problems.append(f"{ma_hd}: SoTienTraGoc = {tra_goc:,}, tổng đã trả gốc = {expected['tra_goc']:,}")
+
+            audit = dict(
+                db.query(LichSu.hanh_dong, func.count())
+                .filter(LichSu.ma_hd == ma_hd, LichSu.hanh_dong.like("Thanh toán lãi%"))
+                .group_by(LichSu.hanh_dong)
+                .all()
+            )
+            audit_sum = db.query(func.coalesce(func.sum(LichSu.so_tien), 0)).filter(
+                LichSu.ma_hd == ma_hd, LichSu.hanh_dong.like("Thanh toán lãi%")
+            ).scalar()
+            if sum(audit.values()) != expected["pay_count"] or audit_sum != expected["pay_audit"]:
+                problems.append(
+                    f"{ma_hd}: nhật ký thanh toán {sum(audit.values())} dòng / {audit_sum:,} VNĐ, "
+                    f"mong đợi {expected['pay_count']} dòng / {expected['pay_audit']:,} VNĐ"
+                )
+            tra_goc_audit = db.query(func.count()).select_from(LichSu).filter(
+                LichSu.ma_hd == ma_hd, LichSu.hanh_dong == "Trả gốc hợp đồng tín chấp"
+            ).scalar()
+            if tra_goc_audit != expected["tra_goc_count"]:
+                problems.append(f"{ma_hd}: nhật ký trả gốc {tra_goc_audit} dòng, mong đợi {expected['tra_goc_count']}")
+    finally:
+        db.close()
+    return problems
+
+
+def cleanup(contracts):
+    db = SessionLocal()
+    try:
+        for ma_hd, _ in contracts:
+            with unit_of_work(db):
+                crud_lich_su.delete_lich_sus_by_contract(db, ma_hd)
+                if ma_hd.startswith("TC"):
+                    crud_tin_chap.delete_tin_chap(db, ma_hd)
+                else:
+                    crud_tra_gop.delete_tra_gop(db, ma_hd)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contracts", type=int, default=4, help="Số hợp đồng (ít hợp đồng -> nhiều xung đột)")
+    parser.add_argument("--threads", type=int, default=12, help="Mỗi thread giữ 1 connection (pool mặc định tối đa 15)")
+    parser.add_argument("--payments", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="Giữ lại hợp đồng test")
+    args = parser.parse_args()
+
+    contracts = create_contracts(args.contracts, date.today())
+    print(f"{len(contracts)} hợp đồng: {', '.join(ma_hd for ma_hd, _ in contracts)}")
+    try:
+        ledger, errors, elapsed = run_operations(contracts, args.threads, args.payments, args.seed)
+        succeeded = sum(v["pay_count"] + v["tra_goc_count"] for v in ledger.values())
+        print(
+            f"{args.payments} thao tác trên {args.threads} thread: {succeeded} thành công, "
+            f"{sum(errors.values())} lỗi, {elapsed:.2f} s ({args.payments / elapsed:.0f} thao tác/giây)"
+        )
+        for error, count in errors.most_common():
+            print(f"  {count} x {error}")
+        problems = verify(contracts, ledger)
+    finally:
+        if not args.keep:
+            cleanup(contracts)
+
+    if problems:
+        print(f"LỆCH ({len(problems)}):")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("OK: tổng tiền khớp")
+
+
+if __name__ == "__main__":
+    main()
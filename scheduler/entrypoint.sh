@@ -11,7 +11,7 @@ touch "$LOG_FILE"
 # Persist selected environment variables for cron executions
 # Cron runs with a minimal environment, so we export the variables we need
 ENV_SNAPSHOT="/app/.container_env"
-env | grep -E '^(URL_API_BACKEND|TRA_GOP_API_URL|TRA_LAI_TIN_CHAP_API_URL|RUN_ON_STARTUP)=' > "$ENV_SNAPSHOT" 2>/dev/null || true
+env | grep -E '^(URL_API_BACKEND|TRA_GOP_API_URL|TRA_LAI_TIN_CHAP_API_URL|ACCRUAL_JOB_URL|JOB_EXECUTIONS_URL|POLL_INTERVAL|POLL_TIMEOUT|RUN_ON_STARTUP)=' > "$ENV_SNAPSHOT" 2>/dev/null || true
 
 log_start() {
   echo "$(date '+%Y-%m-%d %H:%M:%S %Z'): $1" | tee -a "$LOG_FILE"
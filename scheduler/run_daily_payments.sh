@@ -25,18 +25,17 @@ fi
 # API endpoints from environment variables (after sourcing)
 TRA_GOP_URL="${TRA_GOP_API_URL}"
 TIN_CHAP_URL="${TRA_LAI_TIN_CHAP_API_URL}"
-
-call_api() {
-    label="$1"
+# Submit-and-poll: POST ACCRUAL_JOB_URL trả 202 + Id, sau đó poll JOB_EXECUTIONS_URL/<Id>
+ACCRUAL_URL="${ACCRUAL_JOB_URL}"
+EXECUTIONS_URL="${JOB_EXECUTIONS_URL:-${URL_API_BACKEND}/jobs/executions}"
+POLL_INTERVAL="${POLL_INTERVAL:-10}"
+POLL_TIMEOUT="${POLL_TIMEOUT:-3600}"
+
+# http_request METHOD URL LABEL: sets http_code and body, returns curl exit code
+http_request() {
+    method="$1"
     url="$2"
-
-    if [ -z "$url" ]; then
-        log "WARN: $label URL is not configured, skipping"
-        return 0
-    fi
-
-    log "$label URL: $url"
-    log "Calling $label API..."
+    label="$3"
 
     set +e
     # Retry up to 5 times with exponential backoff to tolerate backend cold starts
@@ -44,10 +43,16 @@ call_api() {
     max_attempts=5
     backoff=2
     while true; do
-        response=$(curl -s -w "HTTPSTATUS:%{http_code}" -X 'POST' \
-          "${url}" \
-          -H 'accept: application/json' \
-          -d '')
+        if [ "$method" = "POST" ]; then
+            response=$(curl -s -w "HTTPSTATUS:%{http_code}" -X 'POST' \
+              "${url}" \
+              -H 'accept: application/json' \
+              -d '')
+        else
+            response=$(curl -s -w "HTTPSTATUS:%{http_code}" \
+              "${url}" \
+              -H 'accept: application/json')
+        fi
         curl_exit=$?
         if [ $curl_exit -eq 0 ]; then
             break
@@ -69,6 +74,33 @@ call_api() {
 
     http_code=$(echo "$response" | tr -d '\n' | sed -e 's/.*HTTPSTATUS://')
     body=$(echo "$response" | sed -e 's/HTTPSTATUS\:.*//g')
+    return 0
+}
+
+# The image has no jq: pull single fields out of $body with sed
+# json_string NAME: value of "NAME":"..."
+json_string() {
+    echo "$body" | tr -d '\n' | sed -n "s/.*\"$1\": *\"\([^\"]*\)\".*/\1/p"
+}
+
+# json_number NAME: value of "NAME":123 (also inside an escaped JSON string such as TienDo)
+json_number() {
+    echo "$body" | tr -d '\n' | sed -n "s/.*\"$1\\\\*\": *\([0-9][0-9]*\).*/\1/p"
+}
+
+call_api() {
+    label="$1"
+    url="$2"
+
+    if [ -z "$url" ]; then
+        log "WARN: $label URL is not configured, skipping"
+        return 0
+    fi
+
+    log "$label URL: $url"
+    log "Calling $label API..."
+
+    http_request POST "$url" "$label" || return $?
 
     log "$label HTTP Status: $http_code"
     log "$label Response: $body"
@@ -82,13 +114,81 @@ call_api() {
     return 0
 }
 
-log "Current time (Asia/Ho_Chi_Minh): $(TZ='Asia/Ho_Chi_Minh' date '+%Y-%m-%d %H:%M:%S %Z')"
+# Submit job rồi poll trạng thái tới khi xong, không giữ 1 request HTTP suốt thời gian job chạy
+submit_and_poll() {
+    label="$1"
+    url="$2"
+
+    log "$label URL: $url"
+    log "Submitting $label job..."
+
+    http_request POST "$url" "$label" || return $?
+    log "$label HTTP Status: $http_code"
+
+    # 202: job mới; 409: job đang chạy (lần khác đã submit) -> poll lần thực thi đó
+    if [ "$http_code" -ne 202 ] && [ "$http_code" -ne 409 ]; then
+        log "$label Response: $body"
+        log "ERROR: $label submit failed (status $http_code)"
+        return 1
+    fi
+
+    execution_id=$(json_number Id)
+    if [ -z "$execution_id" ]; then
+        log "$label Response: $body"
+        log "ERROR: $label response has no execution Id"
+        return 1
+    fi
+    if [ "$http_code" -eq 409 ]; then
+        log "$label job is already running, polling execution $execution_id"
+    else
+        log "$label job submitted, execution $execution_id"
+    fi
+
+    status_url="${EXECUTIONS_URL}/${execution_id}"
+    waited=0
+    while true; do
+        sleep "$POLL_INTERVAL"
+        waited=$((waited+POLL_INTERVAL))
+
+        http_request GET "$status_url" "$label" || return $?
+        if [ "$http_code" -ne 200 ]; then
+            log "ERROR: $label poll failed (status $http_code): $body"
+            return 1
+        fi
+
+        trang_thai=$(json_string TrangThai)
+        if [ "$trang_thai" != "Đang chạy" ]; then
+            break
+        fi
+        log "$label running (${waited}s): $(json_number contracts_done)/$(json_number contracts_total) contracts"
+
+        if [ "$waited" -ge "$POLL_TIMEOUT" ]; then
+            log "ERROR: $label still running after ${POLL_TIMEOUT}s, giving up polling"
+            return 1
+        fi
+    done
+
+    log "$label Response: $body"
+    if [ "$trang_thai" != "Thành công" ]; then
+        log "ERROR: $label job finished with status '$trang_thai'"
+        return 1
+    fi
+
+    log "SUCCESS: $label job completed"
+    return 0
+}
 
-call_api "TraGop" "$TRA_GOP_URL"
-tg_status=$?
+log "Current time (Asia/Ho_Chi_Minh): $(TZ='Asia/Ho_Chi_Minh' date '+%Y-%m-%d %H:%M:%S %Z')"
 
-call_api "TraLaiTinChap" "$TIN_CHAP_URL"
-tc_status=$?
+tg_status=0
+tc_status=0
+if [ -n "$ACCRUAL_URL" ]; then
+    # 1 job cộng dồn chung cho cả trả góp và tín chấp
+    submit_and_poll "Accrual" "$ACCRUAL_URL" || tg_status=$?
+else
+    call_api "TraGop" "$TRA_GOP_URL" || tg_status=$?
+    call_api "TraLaiTinChap" "$TIN_CHAP_URL" || tc_status=$?
+fi
 
 if [ $tg_status -ne 0 ] || [ $tc_status -ne 0 ]; then
     log "=========================================="